@@ -1,273 +1,1097 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g, stream_with_context
 from flask_cors import CORS
+import base64
+import calendar
+import hashlib
+import json
+import math
+import os
+import queue
+import random
 import sqlite3
-from custom_algorithm import TaxiZoneRanker
+import threading
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from types import MappingProxyType
+import columnar
+import shards
+from cache import QueryCache, MemoryBackend, SqliteBackend, make_key
+from custom_algorithm import TaxiZoneRanker, RANKING_GROUPS, RANKING_METRICS, ranking_columns
 
-app = Flask(__name__)
-_cache = {}
+try:
+    import orjson
+except ImportError:  # Optional, faster encoder for streamed responses
+    orjson = None
 
-def cached_query(key, query_func):
-    if key not in _cache:
-        _cache[key] = query_func()
-    return _cache[key]
+app = Flask(__name__)
 
 CORS(app, origins="*", supports_credentials=False)  # Allow frontend to call this API
 
 DATABASE = 'nyc_taxi.db'
+RANKER_ENGINE = 'python'  # 'numpy' for the vectorized TaxiZoneRanker engine
 
-def get_db():
-    """Create a database connection"""
-    conn = sqlite3.connect(DATABASE)
+# Where the aggregate endpoints get their numbers. 'auto' answers from the
+# summary tables when they cover the request, then the columnar snapshot
+# database.py writes next to the database, then SQLite. 'columnar' skips
+# the summary tables, 'sqlite' ignores the snapshot. 'shards' runs the
+# same SQL on the month shards from database.py --shards, SHARD_WORKERS
+# processes at a time, and adds up what they return.
+app.config['QUERY_ENGINE'] = os.environ.get('QUERY_ENGINE', 'auto')
+app.config['SHARD_WORKERS'] = int(os.environ.get('SHARD_WORKERS', os.cpu_count() or 1))
+
+# Reuse read-only connections across requests instead of connecting on
+# every one. The pool is per process and keeps up to DB_POOL_SIZE idle
+# connections; requests beyond that connect and close as before. It
+# works the same whether a server starts a thread per request (app.run)
+# or keeps worker threads (gunicorn gthread).
+app.config['DB_POOL'] = True
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 4))
+
+READ_PRAGMAS = [
+    "PRAGMA query_only=ON",
+    "PRAGMA cache_size=-262144",  # 256 MB page cache
+    "PRAGMA mmap_size=1073741824",  # Map up to 1 GB of the file
+]
+
+_pool = {'key': None, 'idle': None}
+_pool_lock = threading.Lock()
+
+def connect_readonly():
+    uri = Path(DATABASE).resolve().as_uri() + '?mode=ro'
+    # Pooled connections move between threads, one request at a time
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    for pragma in READ_PRAGMAS:
+        conn.execute(pragma)
     return conn
 
+def pooled_connection():
+    # A forked worker or a different DATABASE starts a new pool; the old
+    # one's connections are dropped as they come back
+    key = (os.getpid(), DATABASE)
+    with _pool_lock:
+        if _pool['key'] != key:
+            # Last in, first out: the busiest connections keep warm caches
+            _pool['idle'] = queue.LifoQueue(maxsize=app.config['DB_POOL_SIZE'])
+            _pool['key'] = key
+        idle = _pool['idle']
+    g.db_pool = idle
+    try:
+        return idle.get_nowait()
+    except queue.Empty:
+        return connect_readonly()
+
+def return_connection(conn, idle):
+    if idle is not _pool['idle']:
+        conn.close()
+        return
+    try:
+        idle.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+def get_db():
+    """Database connection for the current request"""
+    if 'db' not in g:
+        if app.config['DB_POOL']:
+            g.db = pooled_connection()
+        else:
+            g.db = connect_readonly()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exc):
+    conn = g.pop('db', None)
+    if conn is None:
+        return
+    idle = g.pop('db_pool', None)
+    if idle is None:
+        conn.close()
+        return
+    # Don't leave a half-read statement holding a read transaction
+    if conn.in_transaction:
+        conn.rollback()
+    return_connection(conn, idle)
+
+# Result cache for the endpoints, keyed on endpoint + normalized query
+# parameters and invalidated whenever the database is reloaded.
+# CACHE_BACKEND=sqlite shares it between gunicorn workers via CACHE_PATH.
+
+app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'memory')
+app.config['CACHE_PATH'] = os.environ.get('CACHE_PATH', 'api_cache.db')
+app.config['CACHE_TTL'] = int(os.environ.get('CACHE_TTL', 3600))
+app.config['CACHE_MAX_ENTRIES'] = int(os.environ.get('CACHE_MAX_ENTRIES', 512))
+
+def make_cache():
+    if app.config['CACHE_BACKEND'] == 'sqlite':
+        backend = SqliteBackend(app.config['CACHE_PATH'],
+                                max_entries=app.config['CACHE_MAX_ENTRIES'])
+    else:
+        backend = MemoryBackend(max_entries=app.config['CACHE_MAX_ENTRIES'])
+    return QueryCache(backend, ttl=app.config['CACHE_TTL'])
+
+cache = make_cache()
+
+def read_data_version():
+    # Stamp written by database.py on every load; databases built before
+    # that existed fall back to the file's size and modification time
+    try:
+        row = get_db().execute(
+            "SELECT value FROM db_meta WHERE key = 'data_version'"
+        ).fetchone()
+        if row:
+            return row[0]
+    except sqlite3.OperationalError:
+        pass
+    stat = os.stat(DATABASE)
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+def data_version():
+    """Data version for the current request, read once per request"""
+    if 'data_version' not in g:
+        g.data_version = read_data_version()
+    return g.data_version
+
+def cached_query(key, query_func, params=None):
+    return cache.get_or_compute(key, params, data_version(), query_func)
+
+# Zone, borough and payment names. The lookup tables are a few hundred
+# rows, so each process keeps a read-only copy and swaps in a new one
+# when the data version changes; endpoints resolve names from it instead
+# of querying (or joining) per row.
+
+Dimensions = namedtuple('Dimensions', 'version zones boroughs borough_ids payments')
+
+_dimensions = None
+
+def dimensions():
+    global _dimensions
+    version = data_version()
+    current = _dimensions
+    if current is None or current.version != version:
+        conn = get_db()
+        zones = {row[0]: (row[1], row[2])
+                 for row in conn.execute('SELECT LocationID, Borough, Zone FROM zones')}
+        boroughs = dict(conn.execute('SELECT borough_id, Borough FROM boroughs'))
+        payments = dict(conn.execute('SELECT payment_type, label FROM payment_types'))
+        current = Dimensions(
+            version,
+            MappingProxyType(zones),
+            MappingProxyType(boroughs),
+            MappingProxyType({name: borough_id for borough_id, name in boroughs.items()}),
+            MappingProxyType(payments)
+        )
+        _dimensions = current
+    return current
+
+# The columnar snapshot, mapped once per process and swapped when
+# database.py writes a new one. A snapshot that doesn't match the
+# database's data version (missing, or the database changed after it
+# was written) is not used.
+
+_column_store = None
+
+def column_store():
+    global _column_store
+    if app.config['QUERY_ENGINE'] not in ('auto', 'columnar') or columnar.np is None:
+        return None
+    version = data_version()
+    store = _column_store
+    if store is None or store.version != version or store.db_path != DATABASE:
+        if columnar.snapshot_version(DATABASE) != version:
+            return None
+        store = columnar.ColumnStore(DATABASE)
+        _column_store = store
+    return store
+
+def use_summary_tables(store):
+    return store is None or app.config['QUERY_ENGINE'] != 'columnar'
+
+# The month shards a date range touches, standing in for the connection
+# in the aggregate queries. Shards written from an older data version
+# (or none at all) leave the queries on DATABASE.
+
+_shard_manifest = None
+
+def shard_set(start=None, end=None):
+    global _shard_manifest
+    if app.config['QUERY_ENGINE'] != 'shards':
+        return None
+    version = data_version()
+    manifest = _shard_manifest
+    if manifest is None or manifest[0] != (DATABASE, version):
+        found = shards.read_manifest(DATABASE)
+        if found is None or found['version'] != version:
+            return None
+        manifest = _shard_manifest = ((DATABASE, version), found)
+    return shards.ShardSet(DATABASE, manifest[1], *trips_bounds(start, end),
+                           workers=app.config['SHARD_WORKERS'])
+
+def aggregate_source(start=None, end=None):
+    """Connection (or shard set) the aggregate queries for a range run on"""
+    sharded = shard_set(start, end)
+    return sharded if sharded is not None else get_db()
+
 @app.route('/', methods=['GET'])
 def home():
     return jsonify({'message': 'NYC Taxi API is running'})
 
+# Date filters for the summary endpoints: ?start= is inclusive, ?end=
+# exclusive, and a bare date for end means the whole of that day. Bounds
+# on the hour are answered from the hourly rollups built by database.py;
+# anything finer (or a database without rollups) reads trips.
+
+class InvalidFilter(ValueError):
+    pass
+
+@app.errorhandler(InvalidFilter)
+def invalid_filter(error):
+    return jsonify({'error': str(error)}), 400
+
+def parse_bound(value, is_end):
+    value = value.strip().replace('T', ' ')
+    try:
+        if len(value) == 10:
+            moment = datetime.strptime(value, '%Y-%m-%d')
+            return moment + timedelta(days=1) if is_end else moment
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise InvalidFilter(f'Bad date {value!r}, expected YYYY-MM-DD or YYYY-MM-DD HH:MM')
+
+def date_range():
+    start, end = (request.args.get(name, '') for name in ('start', 'end'))
+    return (parse_bound(start, False) if start else None,
+            parse_bound(end, True) if end else None)
+
+def on_the_hour(*bounds):
+    return all(b is None or (b.minute, b.second, b.microsecond) == (0, 0, 0) for b in bounds)
+
+def rollup_filter(start, end):
+    conditions, params = [], []
+    if start:
+        conditions.append('(pickup_date, pickup_hour) >= (?, ?)')
+        params += [start.strftime('%Y-%m-%d'), start.hour]
+    if end:
+        conditions.append('(pickup_date, pickup_hour) < (?, ?)')
+        params += [end.strftime('%Y-%m-%d'), end.hour]
+    return (f"WHERE {' AND '.join(conditions)}" if conditions else ''), params
+
+def epoch_seconds(moment):
+    # trips stores timestamps as seconds since 1970-01-01, wall clock time
+    return calendar.timegm(moment.timetuple())
+
+def trips_bounds(start, end):
+    return (epoch_seconds(start) if start else None,
+            epoch_seconds(end) if end else None)
+
+def trips_filter(start, end):
+    conditions, params = [], []
+    if start:
+        conditions.append('pickup_datetime >= ?')
+        params.append(epoch_seconds(start))
+    if end:
+        conditions.append('pickup_datetime < ?')
+        params.append(epoch_seconds(end))
+    return (f"WHERE {' AND '.join(conditions)}" if conditions else ''), params
+
+def range_params(start, end):
+    return {name: bound.isoformat(' ') for name, bound in (('start', start), ('end', end)) if bound}
+
+# Every summary the dashboard shows comes out of one pass: over the
+# hourly rollups, or one GROUP BY over trips when they can't be used.
+# Both are reduced to per (hour, borough) groups, distance range counts
+# and per payment label totals before being folded into each chart.
+
+DISTANCE_RANGES = ['0-1 miles', '1-3 miles', '3-5 miles', '5-10 miles', '10+ miles']
+
+# Both queries group on integer keys only; names come from dimensions()
+
+ROLLUP_SUMMARY_QUERY = '''
+    SELECT
+        pickup_hour,
+        PULocationID,
+        SUM(trip_count) as trips,
+        SUM(sum_fare) as revenue,
+        SUM(rush_trips) as rush_trips,
+        SUM(sum_distance) as distance,
+        SUM(sum_speed) as speed,
+        SUM(speed_count) as speed_trips,
+        SUM(trips_0_1), SUM(trips_1_3), SUM(trips_3_5),
+        SUM(trips_5_10), SUM(trips_10_plus)
+    FROM trip_rollup
+    {where}
+    GROUP BY pickup_hour, PULocationID
+'''
+
+ROLLUP_PAYMENT_QUERY = '''
+    SELECT payment_type, SUM(trip_count) as trips, SUM(sum_tip) as tips
+    FROM payment_rollup
+    {where}
+    GROUP BY payment_type
+'''
+
+SUMMARY_QUERY = '''
+    SELECT
+        pickup_hour,
+        pickup_borough_id,
+        CASE
+            WHEN trip_distance < 1  THEN '0-1 miles'
+            WHEN trip_distance < 3  THEN '1-3 miles'
+            WHEN trip_distance < 5  THEN '3-5 miles'
+            WHEN trip_distance < 10 THEN '5-10 miles'
+            ELSE '10+ miles'
+        END as distance_range,
+        payment_type,
+        COUNT(*) as trips,
+        SUM(total_amount) as revenue,
+        SUM(is_rush_hour) as rush_trips,
+        SUM(trip_distance) as distance,
+        MIN(trip_distance) as min_distance,
+        SUM(speed_mph) as speed,
+        COUNT(speed_mph) as speed_trips,
+        SUM(tip_amount) as tips
+    FROM trips
+    {where}
+    GROUP BY pickup_hour, pickup_borough_id, distance_range, payment_type
+'''
+
+GROUP_FIELDS = ('trips', 'revenue', 'rush_trips', 'distance', 'speed', 'speed_trips')
+
+def _accumulate(totals, key, cell, fields):
+    entry = totals.setdefault(key, dict.fromkeys(fields, 0))
+    for field in fields:
+        entry[field] += cell[field] or 0
+    return entry
+
+def _ratio(numerator, denominator, digits=2):
+    return round(numerator / denominator, digits) if denominator else None
+
+def _accumulate_group(groups, hour, borough, cell):
+    entry = _accumulate(groups, (hour, borough), cell, GROUP_FIELDS)
+    entry['pickup_hour'], entry['borough'] = hour, borough
+
+def _payment_totals(rows, labels):
+    payments = {}
+    for row in rows:
+        label = labels.get(row['payment_type'])
+        if label is not None:
+            _accumulate(payments, label, row, ('trips', 'tips'))
+    return [(label, entry['trips'], entry['tips']) for label, entry in payments.items()]
+
+def summary_from_rollups(conn, start, end):
+    where, params = rollup_filter(start, end)
+    dims = dimensions()
+    groups, ranges = {}, [0] * len(DISTANCE_RANGES)
+    for row in conn.execute(ROLLUP_SUMMARY_QUERY.format(where=where), params):
+        borough = dims.zones.get(row['PULocationID'], (None, None))[0]
+        _accumulate_group(groups, row['pickup_hour'], borough, row)
+        for i, count in enumerate(row[-len(DISTANCE_RANGES):]):
+            ranges[i] += count
+    distance = [(name, count) for name, count in zip(DISTANCE_RANGES, ranges) if count]
+    payments = _payment_totals(
+        conn.execute(ROLLUP_PAYMENT_QUERY.format(where=where), params), dims.payments)
+    return list(groups.values()), distance, payments
+
+def summary_from_columns(store, start, end):
+    scan = store.scan(*trips_bounds(start, end))
+    dims = dimensions()
+    groups = {}
+    for hour, borough_id, *sums in columnar.hour_borough_totals(scan):
+        _accumulate_group(groups, hour, dims.boroughs.get(borough_id),
+                          dict(zip(GROUP_FIELDS, sums)))
+    distance = [(name, count) for name, count
+                in zip(DISTANCE_RANGES, columnar.distance_counts(scan)) if count]
+    payments = _payment_totals(
+        (dict(zip(('payment_type', 'trips', 'tips'), row)) for row in columnar.payment_totals(scan)),
+        dims.payments)
+    return list(groups.values()), distance, payments
+
+def summary_from_trips(conn, start, end):
+    where, params = trips_filter(start, end)
+    dims = dimensions()
+    groups, ranges, cells = {}, {}, []
+    for cell in conn.execute(SUMMARY_QUERY.format(where=where), params):
+        _accumulate_group(groups, cell['pickup_hour'], dims.boroughs.get(cell['pickup_borough_id']), cell)
+        entry = _accumulate(ranges, cell['distance_range'], cell, ('trips',))
+        if cell['min_distance'] is not None:
+            entry['min'] = min(entry.get('min', cell['min_distance']), cell['min_distance'])
+        cells.append(cell)
+
+    distance = [
+        (name, entry['trips'])
+        for name, entry in sorted(ranges.items(), key=lambda item: item[1].get('min', float('inf')))
+    ]
+    return list(groups.values()), distance, _payment_totals(cells, dims.payments)
+
+def build_summary(groups, distance, payments):
+    overall = {'trips': 0, 'revenue': 0, 'rush_trips': 0, 'distance': 0}
+    hours, boroughs = {}, {}
+    for group in groups:
+        for field in overall:
+            overall[field] += group[field] or 0
+        _accumulate(hours, group['pickup_hour'], group,
+                    ('trips', 'revenue', 'speed', 'speed_trips'))
+        if group['borough'] is not None:
+            _accumulate(boroughs, group['borough'], group, ('trips', 'revenue'))
+
+    total = overall['trips']
+    stats = {
+        'total_trips': total,
+        'average_fare': _ratio(overall['revenue'], total),
+        'total_revenue': round(overall['revenue'], 2) if total else None,
+        'rush_hour_pct': _ratio(overall['rush_trips'] * 100, total, 1),
+        'average_distance': _ratio(overall['distance'], total)
+    }
+
+    hourly = [
+        {
+            'hour': hour,
+            'trip_count': entry['trips'],
+            'avg_fare': _ratio(entry['revenue'], entry['trips']),
+            'avg_speed': _ratio(entry['speed'], entry['speed_trips'])
+        }
+        for hour, entry in sorted(hours.items(), key=lambda item: (item[0] is not None, item[0]))
+    ]
+
+    borough_rows = [
+        {
+            'borough': borough,
+            'trip_count': entry['trips'],
+            'total_revenue': round(entry['revenue'], 2),
+            'avg_fare': _ratio(entry['revenue'], entry['trips'])
+        }
+        for borough, entry in boroughs.items()
+    ]
+    borough_rows.sort(key=lambda row: row['trip_count'], reverse=True)
+
+    payment_rows = [
+        {
+            'payment_type': label,
+            'count': count,
+            'avg_tip': _ratio(tips, count)
+        }
+        for label, count, tips in payments
+    ]
+    payment_rows.sort(key=lambda row: row['count'], reverse=True)
+
+    return {
+        'stats': stats,
+        'hourly': hourly,
+        'distance': [{'range': name, 'count': count} for name, count in distance],
+        'boroughs': borough_rows,
+        'payment_types': payment_rows
+    }
+
+def scan_summary(start=None, end=None):
+    conn = aggregate_source(start, end)
+    store = column_store()
+    if use_summary_tables(store) and on_the_hour(start, end):
+        try:
+            return build_summary(*summary_from_rollups(conn, start, end))
+        except sqlite3.OperationalError:
+            pass  # Database built before the rollups existed
+    if store is not None:
+        return build_summary(*summary_from_columns(store, start, end))
+    return build_summary(*summary_from_trips(conn, start, end))
+
+def summary():
+    start, end = date_range()
+    return cached_query('summary', lambda: scan_summary(start, end), range_params(start, end))
+
+# Everything the frontend needs on page load in one response
+
+@app.route('/api/dashboard', methods=['GET'])
+def get_dashboard():
+    limit = request.args.get('limit', 10, type=int)
+
+    payload = dict(summary())
+    payload['top_zones'] = top_zones_cached(limit)
+    return jsonify(payload)
+
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
-    def run():
-        conn = get_db()
-        cursor = conn.cursor()
-        
-    # Total trips
-
-        cursor.execute('SELECT COUNT(*) as count FROM trips')
-        total_trips = cursor.fetchone()['count']
-        
-    # Average fare
-
-        cursor.execute('SELECT ROUND(AVG(total_amount), 2) as avg FROM trips')
-        avg_fare = cursor.fetchone()['avg']
-        
-    # Total revenue
-
-        cursor.execute('SELECT ROUND(SUM(total_amount), 2) as total FROM trips')
-        total_revenue = cursor.fetchone()['total']
-        
-    # Rush hour percentage
-
-        cursor.execute('SELECT ROUND(AVG(is_rush_hour) * 100, 1) as pct FROM trips')
-        rush_hour_pct = cursor.fetchone()['pct']
-        
-    # Average distance
-
-        cursor.execute('SELECT ROUND(AVG(trip_distance), 2) as avg FROM trips')
-        avg_distance = cursor.fetchone()['avg']
-        
-        conn.close()
-        
-        return{
-            'total_trips': total_trips,
-            'average_fare': avg_fare,
-            'total_revenue': total_revenue,
-            'rush_hour_pct': rush_hour_pct,
-            'average_distance': avg_distance
-        }
-    return jsonify(cached_query('stats', run))
+    return jsonify(summary()['stats'])
 
 # Hourly trips
 
 @app.route('/api/hourly', methods=['GET'])
 def get_hourly():
-    def run():
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT
-                pickup_hour as hour,
-                COUNT(*) as trip_count,
-                ROUND(AVG(total_amount), 2) as avg_fare,
-                ROUND(AVG(speed_mph), 2) as avg_speed
-            FROM trips
-            GROUP BY pickup_hour
-            ORDER BY pickup_hour
-        ''')
-        
-        rows = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        
-        return rows
-    return jsonify(cached_query('hourly', run))
+    return jsonify(summary()['hourly'])
+
+# Per day (or per weekday with ?group=weekday) over the date range
+
+DAILY_ROLLUP_QUERY = '''
+    SELECT
+        pickup_date,
+        SUM(trip_count) as trips,
+        SUM(sum_fare) as revenue,
+        SUM(sum_tip) as tips,
+        SUM(sum_distance) as distance,
+        SUM(sum_speed) as speed,
+        SUM(speed_count) as speed_trips
+    FROM trip_rollup
+    {where}
+    GROUP BY pickup_date
+'''
+
+DAILY_TRIPS_QUERY = '''
+    SELECT
+        date(pickup_datetime / 86400 * 86400, 'unixepoch') as pickup_date,
+        COUNT(*) as trips,
+        TOTAL(total_amount) as revenue,
+        TOTAL(tip_amount) as tips,
+        TOTAL(trip_distance) as distance,
+        TOTAL(speed_mph) as speed,
+        COUNT(speed_mph) as speed_trips
+    FROM trips
+    {where}
+    GROUP BY pickup_datetime / 86400
+'''
+
+DAY_FIELDS = ('trips', 'revenue', 'tips', 'distance', 'speed', 'speed_trips')
+
+def daily_from_columns(store, start, end):
+    fields = ('pickup_date',) + DAY_FIELDS
+    return [
+        dict(zip(fields, ((date(1970, 1, 1) + timedelta(days=day)).isoformat(), *sums)))
+        for day, *sums in columnar.daily_totals(store.scan(*trips_bounds(start, end)))
+    ]
+
+def daily_totals(start, end, group):
+    conn = aggregate_source(start, end)
+    store = column_store()
+    rows = None
+    if use_summary_tables(store) and on_the_hour(start, end):
+        try:
+            where, params = rollup_filter(start, end)
+            rows = conn.execute(DAILY_ROLLUP_QUERY.format(where=where), params).fetchall()
+        except sqlite3.OperationalError:
+            pass
+    if rows is None and store is not None:
+        rows = daily_from_columns(store, start, end)
+    if rows is None:
+        where, params = trips_filter(start, end)
+        rows = conn.execute(DAILY_TRIPS_QUERY.format(where=where), params).fetchall()
+
+    totals = {}
+    for row in rows:
+        day = date.fromisoformat(row['pickup_date'])
+        key = day.weekday() if group == 'weekday' else day
+        _accumulate(totals, key, row, DAY_FIELDS)
+
+    results = []
+    for key, entry in sorted(totals.items()):
+        if group == 'weekday':
+            result = {'weekday': key, 'day_name': calendar.day_name[key]}
+        else:
+            result = {'date': key.isoformat(), 'day_name': calendar.day_name[key.weekday()]}
+        result.update({
+            'trip_count': entry['trips'],
+            'total_revenue': round(entry['revenue'], 2),
+            'avg_fare': _ratio(entry['revenue'], entry['trips']),
+            'avg_tip': _ratio(entry['tips'], entry['trips']),
+            'avg_distance': _ratio(entry['distance'], entry['trips']),
+            'avg_speed': _ratio(entry['speed'], entry['speed_trips'])
+        })
+        results.append(result)
+    return results
+
+@app.route('/api/daily', methods=['GET'])
+def get_daily():
+    start, end = date_range()
+    group = request.args.get('group', 'date')
+    if group not in ('date', 'weekday'):
+        return jsonify({'error': 'Unknown group', 'groups': ['date', 'weekday']}), 400
+
+    params = {**range_params(start, end), 'group': group}
+    return jsonify(cached_query('daily', lambda: daily_totals(start, end, group), params))
 
 # Use custom algorithms
 
-@app.route('/api/top-zones', methods=['GET'])
-def get_top_zones():
-    limit = request.args.get('limit', 10, type=int)
-    
+def merge_zone_totals(rows):
+    # Shards each return their own total for a zone
+    totals = {}
+    for zone_id, revenue in rows:
+        totals[zone_id] = totals.get(zone_id, 0) + revenue
+    return totals.items()
+
+def top_zones(limit, start=None, end=None):
     conn = get_db()
-    cursor = conn.cursor()
+    sharded = shard_set(start, end)
 
-    cursor.execute('SELECT PULocationID, total_amount FROM trips')
-    trips = [dict(row) for row in cursor.fetchall()]
-    
-# Use our custom quicksort algorithm to rank zones
+    # Use our custom top-K heap to rank zones from per-zone totals: the
+    # zone_revenue summary (one row per zone) built by database.py, or
+    # the hourly rollups summed per zone over a date range
 
-    ranker = TaxiZoneRanker()
-    ranked_zones = ranker.rank_zones_by_revenue(trips)[:limit]
-    
-# Add zone names by looking up each zone
+    ranker = TaxiZoneRanker(RANKER_ENGINE)
+    ranked_zones = None
+    store = column_store()
+    if use_summary_tables(store) and on_the_hour(start, end):
+        source = sharded if sharded is not None else conn
+        try:
+            if start or end:
+                where, params = rollup_filter(start, end)
+                rows = source.execute(
+                    f'SELECT PULocationID, SUM(sum_fare) FROM trip_rollup {where} GROUP BY PULocationID',
+                    params
+                )
+            else:
+                rows = source.execute('SELECT PULocationID, total_revenue FROM zone_revenue')
+            ranked_zones = ranker.rank_zone_totals(merge_zone_totals(rows), limit)
+        except sqlite3.OperationalError:
+            pass
+
+    if ranked_zones is None and sharded is not None:
+        # Per-zone sums from each shard's trips, added up
+        where, params = trips_filter(start, end)
+        rows = sharded.execute(
+            f'SELECT PULocationID, TOTAL(total_amount) FROM trips {where} GROUP BY PULocationID',
+            params
+        )
+        ranked_zones = ranker.rank_zone_totals(merge_zone_totals(rows), limit)
+
+    if ranked_zones is None and store is not None:
+        # Per-zone sums from one bincount over the mapped columns
+        scan = store.scan(*trips_bounds(start, end))
+        ranked_zones = ranker.rank_zone_totals(columnar.zone_totals(scan), limit)
 
+    if ranked_zones is None:
+        # Database built before the summary tables existed, or a range
+        # finer than an hour: stream the raw trips into the ranker as
+        # plain tuples a chunk at a time
+        where, params = trips_filter(start, end)
+        trip_cursor = conn.cursor()
+        trip_cursor.row_factory = None
+        trip_cursor.execute(f'SELECT PULocationID, total_amount FROM trips {where}', params)
+        ranked_zones = ranker.rank_zones_by_revenue(
+            trip_cursor, limit, zone_key=0, amount_key=1
+        )
+
+    # Add zone names from the in-memory lookup
+
+    zones = dimensions().zones
     results = []
     for zone_id, revenue in ranked_zones[:limit]:
-        cursor.execute(
-            'SELECT Borough, Zone FROM zones WHERE LocationID = ?',
-            (zone_id,)
-        )
-        zone = cursor.fetchone()
-        
+        borough, zone = zones.get(zone_id, ('Unknown', 'Unknown'))
         results.append({
             'zone_id': zone_id,
-            'borough': zone['Borough'] if zone else 'Unknown',
-            'zone': zone['Zone'] if zone else 'Unknown',
+            'borough': borough,
+            'zone': zone,
             'revenue': round(revenue, 2)
         })
-    
-    conn.close()
-    return jsonify(results)
+
+    return results
+
+def top_zones_cached(limit):
+    start, end = date_range()
+    params = {**range_params(start, end), 'limit': limit}
+    return cached_query('top-zones', lambda: top_zones(limit, start, end), params)
+
+@app.route('/api/top-zones', methods=['GET'])
+def get_top_zones():
+    limit = request.args.get('limit', 10, type=int)
+    return jsonify(top_zones_cached(limit))
+
+# Several rankings (group x metric) computed from one scan of trips
+
+def _list_arg(name, default):
+    values = []
+    for value in request.args.getlist(name) or [default]:
+        values.extend(v.strip() for v in value.split(',') if v.strip())
+    return list(dict.fromkeys(values))
+
+@app.route('/api/rankings', methods=['GET'])
+def get_rankings():
+    groups = _list_arg('group', 'pickup')
+    metrics = _list_arg('metric', 'revenue')
+    limit = request.args.get('limit', 10, type=int)
+    order = request.args.get('order', 'DESC')
+
+    unknown_groups = [g for g in groups if g not in RANKING_GROUPS]
+    unknown_metrics = [m for m in metrics if m not in RANKING_METRICS]
+    if unknown_groups or unknown_metrics:
+        return jsonify({
+            'error': 'Unknown group or metric',
+            'unknown_groups': unknown_groups,
+            'unknown_metrics': unknown_metrics,
+            'groups': list(RANKING_GROUPS),
+            'metrics': list(RANKING_METRICS)
+        }), 400
+
+    def run():
+        # Columns come from the fixed RANKING_* tables, never from the request
+        columns = ranking_columns(groups, metrics)
+
+        conn = get_db()
+        zones = dimensions().zones
+        ranker = TaxiZoneRanker()
+
+        sharded = shard_set()
+        if sharded is not None:
+            # Each shard's per-key sums and counts, added up before
+            # anything is ranked, so averages and top-K see every trip
+            tables = ranker.merge_accumulators(
+                sharded.map(shards.accumulate_rankings, groups, metrics))
+            rankings = ranker.finish_many(tables, groups, metrics, limit,
+                                          descending=(order != 'ASC'))
+        else:
+            trip_cursor = conn.cursor()
+            trip_cursor.row_factory = None
+            trip_cursor.execute(f'SELECT {", ".join(columns)} FROM trips')
+
+            rankings = ranker.rank_many(
+                trip_cursor, groups, metrics, limit,
+                descending=(order != 'ASC'), columns=columns
+            )
+
+        def zone_fields(prefix, zone_id):
+            borough, zone = zones.get(zone_id, ('Unknown', 'Unknown'))
+            return {
+                f'{prefix}zone_id': zone_id,
+                f'{prefix}borough': borough,
+                f'{prefix}zone': zone
+            }
+
+        results = {}
+        for group, by_metric in rankings.items():
+            results[group] = {}
+            for metric, ranked in by_metric.items():
+                entries = []
+                for key, value in ranked:
+                    if group == 'od':
+                        entry = {**zone_fields('pickup_', key[0]),
+                                 **zone_fields('dropoff_', key[1])}
+                    else:
+                        entry = zone_fields('', key)
+                    entry['value'] = round(value, 2)
+                    entries.append(entry)
+                results[group][metric] = entries
+
+        return results
+    params = {
+        'group': ','.join(groups),
+        'metric': ','.join(metrics),
+        'limit': limit,
+        'order': order
+    }
+    return jsonify(cached_query('rankings', run, params))
 
 # Donut chart
 
 @app.route('/api/distance-distribution', methods=['GET'])
 def get_distance_distribution():
-    def run():
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT
-                CASE
-                    WHEN trip_distance < 1  THEN '0-1 miles'
-                    WHEN trip_distance < 3  THEN '1-3 miles'
-                    WHEN trip_distance < 5  THEN '3-5 miles'
-                    WHEN trip_distance < 10 THEN '5-10 miles'
-                    ELSE '10+ miles'
-                END as range,
-                COUNT(*) as count
-            FROM trips
-            GROUP BY range
-            ORDER BY MIN(trip_distance)
-        ''')
-        
-        rows = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        
-        return rows
-    return jsonify(cached_query('distance', run))
+    return jsonify(summary()['distance'])
 
 # Bar chart
 
 @app.route('/api/boroughs', methods=['GET'])
 def get_boroughs():
-    def run():
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT
-                pickup_borough as borough,
-                COUNT(*) as trip_count,
-                ROUND(SUM(total_amount), 2) as total_revenue,
-                ROUND(AVG(total_amount), 2) as avg_fare
-            FROM trips
-            WHERE pickup_borough IS NOT NULL
-            GROUP BY pickup_borough
-            ORDER BY trip_count DESC
-        ''')
-        
-        rows = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-        
-        return rows
-    return jsonify(cached_query('boroughs', run))
+    return jsonify(summary()['boroughs'])
+
+# Trips table. Pages are keyed on (sort column, trip_id): the opaque
+# cursor carries the last row's values, so every page is an index range
+# scan no matter how deep it is. With ?seed= the endpoint returns a
+# repeatable random sample instead, drawn by primary key lookups. Rows
+# come back with integer keys and get their names from dimensions().
+
+TRIP_FIELDS = '''
+    trip_id,
+    pickup_datetime,
+    PULocationID,
+    DOLocationID,
+    trip_distance,
+    duration_minutes,
+    speed_mph,
+    total_amount,
+    payment_type,
+    is_rush_hour
+'''
+
+TRIP_SORTS = [
+    'pickup_datetime',
+    'total_amount',
+    'trip_distance',
+    'duration_minutes',
+    'speed_mph'
+]
+NULLABLE_SORTS = {'speed_mph'}
+
+SAMPLE_BATCH = 500  # trip_ids looked up by the first query
+SAMPLE_MAX_BATCH = 8000  # each later one doubles, up to this
+
+# Larger limits are cut to MAX_TRIP_ROWS (next_cursor still points past
+# the last row returned). Pages above STREAM_MIN_ROWS, and any page asked
+# for with ?format=ndjson, are written out as rows are fetched instead of
+# being built in memory and cached.
+
+app.config['MAX_TRIP_ROWS'] = int(os.environ.get('MAX_TRIP_ROWS', 10000))
+app.config['STREAM_MIN_ROWS'] = int(os.environ.get('STREAM_MIN_ROWS', 1000))
+STREAM_BATCH = 500  # rows fetched and serialized per chunk
+
+def encode_cursor(state):
+    raw = json.dumps(state, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        state = json.loads(raw)
+        return state['q'], state['v'], int(state['id'])
+    except (ValueError, TypeError, KeyError):
+        return None
+
+def keyset_clause(sort, descending, value, trip_id):
+    # Rows after (value, trip_id) in ORDER BY sort, trip_id. NULL sort
+    # values order lowest: last when descending, first when ascending.
+    op = '<' if descending else '>'
+    if value is None:
+        clause = f'{sort} IS NULL AND trip_id {op} ?'
+        if not descending:
+            clause = f'{clause} OR {sort} IS NOT NULL'
+        return f'({clause})', [trip_id]
+    clause = f'({sort}, trip_id) {op} (?, ?)'
+    if descending and sort in NULLABLE_SORTS:
+        clause = f'{clause} OR {sort} IS NULL'
+    return f'({clause})', [value, trip_id]
+
+def sample_trip_ids(seed, where, params, limit, start=0):
+    """The first `limit` trip_ids matching `where` in a seeded shuffle of
+    the trip_id range, from position `start` of the shuffle. Returns them
+    and the position the next page starts at (None once every trip_id
+    has been tried)."""
+    conn = get_db()
+    # Separate subqueries: SQLite only answers MIN/MAX from the rowid
+    # b-tree directly when each is the only aggregate in its query
+    low, high = conn.execute(
+        'SELECT (SELECT MIN(trip_id) FROM trips), (SELECT MAX(trip_id) FROM trips)'
+    ).fetchone()
+    if low is None or not limit:
+        return [], None
+
+    # The shuffle is low + (step * i + shift) % span for i = 0, 1, ...: a
+    # step coprime with span visits every trip_id once, and any position
+    # can be picked up again from a cursor. Same seed, same data -> same
+    # order.
+    span = high - low + 1
+    rng = random.Random(seed)
+    step = 1
+    if span > 1:
+        step = rng.randrange(1, span)
+        while math.gcd(step, span) != 1:
+            step = rng.randrange(1, span)
+    shift = rng.randrange(span)
+
+    # Keep drawing until the page is full, in growing batches so sparse
+    # filters don't take thousands of queries. NOT INDEXED keeps SQLite
+    # on rowid lookups instead of scanning a filter column's index.
+    chosen = []
+    position = start
+    size = SAMPLE_BATCH
+    while position < span:
+        batch = [low + (step * i + shift) % span
+                 for i in range(position, min(position + size, span))]
+        marks = ', '.join('?' * len(batch))
+        found = {row[0] for row in conn.execute(
+            f'SELECT trip_id FROM trips NOT INDEXED WHERE trip_id IN ({marks}) AND {where}',
+            batch + params
+        )}
+        for offset, trip_id in enumerate(batch):
+            if trip_id in found:
+                chosen.append(trip_id)
+                if len(chosen) == limit:
+                    end = position + offset + 1
+                    return chosen, end if end < span else None
+        position += len(batch)
+        size = min(size * 2, SAMPLE_MAX_BATCH)
+    return chosen, None
+
+def dumps(value):
+    # Same output as jsonify (sorted keys), faster with orjson installed
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS).decode()
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+def trip_response(row, dims):
+    pickup_borough, pickup_zone = dims.zones.get(row['PULocationID'], (None, None))
+    dropoff_borough, dropoff_zone = dims.zones.get(row['DOLocationID'], (None, None))
+    return {
+        'trip_id': row['trip_id'],
+        'pickup_datetime': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(row['pickup_datetime'])),
+        'pickup_borough': pickup_borough,
+        'pickup_zone': pickup_zone,
+        'dropoff_borough': dropoff_borough,
+        'dropoff_zone': dropoff_zone,
+        'trip_distance': row['trip_distance'],
+        'duration_minutes': row['duration_minutes'],
+        'speed_mph': row['speed_mph'],
+        'total_amount': row['total_amount'],
+        'payment_label': dims.payments.get(row['payment_type']),
+        'is_rush_hour': row['is_rush_hour']
+    }
+
+def next_page_cursor(query_id, sort, last):
+    return encode_cursor({'q': query_id, 'v': last[sort], 'id': last['trip_id']})
+
+def stream_trips(cursor, limit, next_cursor, ndjson):
+    # Rows go out a batch at a time, so memory stays flat however many
+    # are asked for. NDJSON is one trip per line and then a final
+    # {"next_cursor": ...} line; JSON keeps the usual response shape.
+    dims = dimensions()
+
+    def generate():
+        sent, last, more = 0, None, False
+        if not ndjson:
+            yield '{"trips":['
+        while not more:
+            rows = cursor.fetchmany(STREAM_BATCH)
+            if not rows:
+                break
+            if sent + len(rows) > limit:
+                rows, more = rows[:limit - sent], True
+            if not rows:
+                break
+            chunk = [dumps(trip_response(row, dims)) for row in rows]
+            if ndjson:
+                yield '\n'.join(chunk) + '\n'
+            else:
+                yield (',' if sent else '') + ','.join(chunk)
+            sent += len(rows)
+            last = rows[-1]
+
+        token = next_cursor(last) if more and last is not None else None
+        if ndjson:
+            yield dumps({'next_cursor': token}) + '\n'
+        else:
+            yield f'],"next_cursor":{dumps(token)}}}\n'
+
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
 
 @app.route('/api/trips', methods=['GET'])
 def get_trips():
-    limit = request.args.get('limit', 100, type=int)
+    limit = min(max(request.args.get('limit', 100, type=int), 0), app.config['MAX_TRIP_ROWS'])
     borough = request.args.get('borough', '')
     min_fare = request.args.get('min_fare', 0, type=float)
     max_fare = request.args.get('max_fare', 9999, type=float)
     rush_hour = request.args.get('rush_hour', '')
     sort_by = request.args.get('sort_by', 'pickup_datetime')
     order = request.args.get('order', 'DESC')
+    token = request.args.get('cursor', '')
+    seed = request.args.get('seed', '')
+    ndjson = request.args.get('format', 'json') == 'ndjson'
     
 # Prevent sql injections
 
-    allowed_sorts = [
-        'pickup_datetime',
-        'total_amount',
-        'trip_distance',
-        'duration_minutes',
-        'speed_mph'
-    ]
-    safe_sort = sort_by if sort_by in allowed_sorts else 'pickup_datetime'
+    safe_sort = sort_by if sort_by in TRIP_SORTS else 'pickup_datetime'
     safe_order = 'ASC' if order == 'ASC' else 'DESC'
     
 # Build query based on filters
 
-    query = '''
-        SELECT
-            trip_id,
-            pickup_datetime,
-            pickup_borough,
-            pickup_zone,
-            dropoff_borough,
-            dropoff_zone,
-            trip_distance,
-            duration_minutes,
-            speed_mph,
-            total_amount,
-            payment_label,
-            is_rush_hour
-        FROM trips
-        WHERE total_amount BETWEEN ? AND ?
-        AND trip_id % 50 = 0
-    '''
+    # Unless sorting by fare, the unary + keeps the planner off the fare
+    # index (the default range matches nearly every row) and on the sort one
+    fare = 'total_amount' if safe_sort == 'total_amount' else '+total_amount'
+    conditions = [f'{fare} BETWEEN ? AND ?']
     params = [min_fare, max_fare]
     
     if borough:
-        query += ' AND pickup_borough = ?'
-        params.append(borough)
+        # An unknown borough becomes NULL, which matches no trips
+        conditions.append('pickup_borough_id = ?')
+        params.append(dimensions().borough_ids.get(borough))
     
     if rush_hour != '':
-        query += ' AND is_rush_hour = ?'
+        conditions.append('is_rush_hour = ?')
         params.append(int(rush_hour))
+
+    key_params = {
+        'limit': limit,
+        'borough': borough,
+        'min_fare': min_fare,
+        'max_fare': max_fare,
+        'rush_hour': rush_hour,
+        'sort_by': safe_sort,
+        'order': safe_order
+    }
+    ordering = f'ORDER BY {safe_sort} {safe_order}, trip_id {safe_order}'
+
+    # A cursor is only valid for the filters, sort (and seed) it was
+    # issued for
+    if seed:
+        query_id = make_key('trips-sample', {**key_params, 'seed': seed})
+    else:
+        query_id = make_key('trips', key_params)
+    query_id = hashlib.sha1(query_id.encode()).hexdigest()[:12]
+    state = None
+    if token:
+        state = decode_cursor(token)
+        if state is None or state[0] != query_id:
+            return jsonify({'error': 'Invalid cursor for this query'}), 400
+
+    if seed:
+        # A sample's cursor holds the shuffle position to carry on from
+        def run_sample():
+            trip_ids, position = sample_trip_ids(seed, ' AND '.join(conditions), params,
+                                                 limit, state[2] if state else 0)
+            next_cursor = None
+            if position is not None:
+                next_cursor = encode_cursor({'q': query_id, 'v': None, 'id': position})
+            if not trip_ids:
+                return {'trips': [], 'next_cursor': next_cursor, 'seed': seed}
+            marks = ', '.join('?' * len(trip_ids))
+            rows = get_db().execute(
+                f'SELECT {TRIP_FIELDS} FROM trips WHERE trip_id IN ({marks}) {ordering}',
+                trip_ids
+            ).fetchall()
+            dims = dimensions()
+            return {'trips': [trip_response(row, dims) for row in rows],
+                    'next_cursor': next_cursor, 'seed': seed}
+        return jsonify(cached_query('trips-sample', run_sample,
+                                    {**key_params, 'seed': seed, 'cursor': token}))
+
+    if state:
+        clause, values = keyset_clause(safe_sort, safe_order == 'DESC', state[1], state[2])
+        conditions.append(clause)
+        params.extend(values)
+
+    query = f'''
+        SELECT {TRIP_FIELDS}
+        FROM trips
+        WHERE {' AND '.join(conditions)}
+        {ordering}
+        LIMIT ?
+    '''
+    # One extra row tells us whether there is a next page
+    params.append(limit + 1)
+
+    if ndjson or limit > app.config['STREAM_MIN_ROWS']:
+        cursor = get_db().execute(query, params)
+        return stream_trips(cursor, limit,
+                            lambda last: next_page_cursor(query_id, safe_sort, last), ndjson)
     
-    query += f' ORDER BY {safe_sort} {safe_order} LIMIT ?'
-    params.append(limit)
-    
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute(query, params)
+    def run():
+        conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute(query, params)
     
-    rows = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+        rows = cursor.fetchall()
+
+        next_cursor = None
+        if limit and len(rows) > limit:
+            next_cursor = next_page_cursor(query_id, safe_sort, rows[limit - 1])
     
-    return jsonify(rows)
+        dims = dimensions()
+        return {'trips': [trip_response(row, dims) for row in rows[:limit]],
+                'next_cursor': next_cursor}
+    return jsonify(cached_query('trips', run, {**key_params, 'cursor': token}))
 
 @app.route('/api/payment-types', methods=['GET'])
 def get_payment_types():
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT
-            payment_label as payment_type,
-            COUNT(*) as count,
-            ROUND(AVG(tip_amount), 2) as avg_tip
-        FROM trips
-        WHERE payment_label IS NOT NULL
-        GROUP BY payment_label
-        ORDER BY count DESC
-    ''')
-    
-    rows = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    
-    return jsonify(rows)
+    return jsonify(summary()['payment_types'])
+
+@app.route('/api/cache-stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(cache.stats())
 
 # Start server
 
@@ -0,0 +1,299 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import benchmark
+import columnar
+import data_processor
+import database
+import shards
+import synthetic
+from custom_algorithm import TaxiZoneRanker, RANKING_GROUPS, RANKING_METRICS, ranking_columns, np
+
+# End-to-end benchmarks on synthetic trips (synthetic.py), so runs on
+# different machines or commits see the same data:
+#
+#   python bench_suite.py --rows 1000000 --output before.json
+#   ... change something ...
+#   python bench_suite.py --rows 1000000 --output after.json
+#   python bench_suite.py --compare before.json after.json
+#
+# Every step runs twice: once for the time, once under tracemalloc for
+# the peak Python allocation (tracing slows things down, so its time is
+# not the one recorded). Anything a step only reads is prepared before
+# the clock starts. Everything is written to a scratch folder; nothing in
+# the backend folder is touched.
+
+ENDPOINT_VARIANTS = [
+    '/api/dashboard?start=2019-01-05&end=2019-01-12',
+    '/api/dashboard?start=2019-01-05 08:30&end=2019-01-20',
+    '/api/daily?group=weekday',
+    '/api/top-zones?limit=10&start=2019-01-05 08:30',
+    '/api/rankings?group=pickup,dropoff,od&metric=revenue,tip,trips,avg_fare,revenue_per_mile,speed',
+    '/api/trips?limit=50&sort_by=total_amount&order=DESC',
+    '/api/trips?limit=50&borough=Manhattan&rush_hour=1',
+    '/api/trips?limit=1000',
+    '/api/trips?seed=42&limit=50',
+]
+
+# --compare ignores slowdowns smaller than this, whatever the ratio
+NOISE_SECONDS = 0.005
+
+
+@contextlib.contextmanager
+def quiet():
+    # The pipeline and loader report progress on stdout
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def record(results, group, name, seconds, peak, **extra):
+    results.append({'group': group, 'name': name, 'seconds': round(seconds, 6),
+                    'peak_mb': round(peak / 1024 ** 2, 3), **extra})
+    print(f"  {group:<16}{name[:56]:<58}{seconds:>10.3f}{peak / 1024 ** 2:>10.1f}")
+
+
+def measure(func):
+    # (result, seconds, peak bytes) from an untraced and a traced run
+    with quiet():
+        result, seconds = benchmark.timed(func)
+        _, _, peak = benchmark.traced(func)
+    return result, seconds, peak
+
+
+# DataProcessor stages, in pipeline order on one processor. Each pass
+# runs the whole pipeline since every stage changes the frame.
+
+def bench_data_processor(results, trip_file, workdir):
+    data_processor.PARQUET_DIR = os.path.join(workdir, 'processed_trips')
+    data_processor.OUTPUT_FILE = os.path.join(workdir, 'processed_trips.csv')
+    output_format = 'parquet' if data_processor.pa is not None else 'csv'
+
+    def stages(processor):
+        def write_output():
+            processor.reset_output(output_format)
+            processor.write_part(processor.output_frame(), 0, output_format)
+
+        return [
+            ('load_data', lambda: processor.load_data([trip_file])),
+            ('integrate_data', processor.integrate_data),
+            ('clean_data', processor.clean_data),
+            ('normalize_data', processor.normalize_data),
+            ('create_features', processor.create_features),
+            (f'write_{output_format}', write_output),
+        ]
+
+    timings = []
+    processor = data_processor.DataProcessor(verbose=False)
+    with quiet():
+        for name, stage in stages(processor):
+            timings.append(benchmark.timed(stage)[1])
+    rows = len(processor.trips)
+
+    processor = data_processor.DataProcessor(verbose=False)
+    with quiet():
+        peaks = [benchmark.traced(stage)[2] for _, stage in stages(processor)]
+
+    for (name, _), seconds, peak in zip(stages(processor), timings, peaks):
+        record(results, 'data_processor', name, seconds, peak)
+    return data_processor.PARQUET_DIR if output_format == 'parquet' else data_processor.OUTPUT_FILE, rows
+
+
+# database.py bulk build from the pipeline output, from scratch each pass
+
+def bench_database(results, source, workdir):
+    database.DB_PATH = os.path.join(workdir, 'nyc_taxi.db')
+
+    def reset():
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(database.DB_PATH + suffix):
+                os.remove(database.DB_PATH + suffix)
+        shutil.rmtree(columnar.snapshot_path(database.DB_PATH), ignore_errors=True)
+        shutil.rmtree(shards.shard_dir(database.DB_PATH), ignore_errors=True)
+
+    steps = [
+        ('init_database', lambda: database.init_database(bulk=True)),
+        ('load_zones', database.load_zones),
+        ('load_trips', lambda: database.load_trips(source, bulk=True)),
+    ]
+    timings = []
+    reset()
+    with quiet():
+        for name, step in steps:
+            timings.append(benchmark.timed(step)[1])
+    reset()
+    with quiet():
+        peaks = [benchmark.traced(step)[2] for _, step in steps]
+
+    for (name, _), seconds, peak in zip(steps, timings, peaks):
+        record(results, 'database', name, seconds, peak)
+    return database.DB_PATH
+
+
+# TaxiZoneRanker on the loaded trips, read into memory beforehand
+
+def bench_ranker(results, db_path):
+    groups, metrics = list(RANKING_GROUPS), list(RANKING_METRICS)
+    columns = ranking_columns(groups, metrics)
+    conn = database.sqlite3.connect(db_path)
+    rows = conn.execute(f'SELECT {", ".join(columns)} FROM trips').fetchall()
+    conn.close()
+    zone, amount = columns.index('PULocationID'), columns.index('total_amount')
+
+    cases = [
+        ('rank_zones_by_revenue[python]', lambda: TaxiZoneRanker('python').rank_zones_by_revenue(
+            rows, 10, zone_key=zone, amount_key=amount)),
+        ('rank_many[all groups x metrics]', lambda: TaxiZoneRanker().rank_many(
+            rows, groups, metrics, columns=columns)),
+    ]
+    if np is not None:
+        arrays = (np.array([row[zone] for row in rows]), np.array([row[amount] for row in rows]))
+        cases.append(('rank_zones_by_revenue[numpy]', lambda: TaxiZoneRanker('numpy').rank_zones_by_revenue(
+            arrays, 10)))
+    od_table = TaxiZoneRanker().accumulate_many(rows, ['od'], ['revenue'], columns=columns)[0]
+    zone_totals = [(key, acc[1]) for key, acc in od_table.items()]
+    cases.append((f'top_k[{len(zone_totals):,} od pairs]', lambda: TaxiZoneRanker().rank_zone_totals(
+        zone_totals, 10)))
+
+    for name, func in cases:
+        _, seconds, peak = measure(func)
+        record(results, 'ranker', name, seconds, peak, rows=len(rows))
+
+
+# Every GET route of the Flask app plus the variants above, through the
+# test client on the benchmark database. cold clears the result cache
+# first, warm answers from it.
+
+def api_paths(api):
+    paths = sorted(str(rule) for rule in api.app.url_map.iter_rules()
+                   if rule.endpoint != 'static' and 'GET' in rule.methods and not rule.arguments)
+    return paths + ENDPOINT_VARIANTS
+
+
+def bench_api(results, db_path, repeat=3):
+    import app as api
+
+    api.DATABASE = db_path
+    api.cache.clear()
+    client = api.app.test_client()
+
+    def request(path):
+        response = client.get(path)
+        return response.status_code, len(response.get_data())
+
+    def cold(path):
+        api.cache.clear()
+        return request(path)
+
+    for path in api_paths(api):
+        # First request maps the snapshot and warms the connection
+        request(path)
+        best = min(benchmark.timed(lambda: cold(path))[1] for _ in range(repeat))
+        (status, size), _, peak = benchmark.traced(lambda: cold(path))
+        request(path)
+        warm = min(benchmark.timed(lambda: request(path))[1] for _ in range(repeat))
+        record(results, 'api', path, best, peak, status=status, bytes=size,
+               warm_seconds=round(warm, 6))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(rows, seed, workdir, repeat):
+    results = []
+    trip_file = os.path.join(workdir, 'synthetic_trips.csv')
+    print(f"{'group':<18}{'step':<58}{'seconds':>10}{'peak MB':>10}")
+    _, seconds, peak = measure(lambda: synthetic.write_trips(trip_file, rows, seed=seed))
+    record(results, 'synthetic', 'write_trips', seconds, peak, rows=rows)
+
+    source, clean_rows = bench_data_processor(results, trip_file, workdir)
+    db_path = bench_database(results, source, workdir)
+    bench_ranker(results, db_path)
+    bench_api(results, db_path, repeat)
+
+    return {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'rows': rows,
+            'clean_rows': clean_rows,
+            'seed': seed,
+            'repeat': repeat,
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'results': results,
+    }
+
+
+def compare(old_path, new_path, threshold=1.1):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    before = {(r['group'], r['name']): r for r in old['results']}
+
+    print(f"{old_path} ({old['meta']['rows']:,} rows, {old['meta']['commit']}) vs "
+          f"{new_path} ({new['meta']['rows']:,} rows, {new['meta']['commit']})")
+    print(f"{'group':<16}{'step':<58}{'old s':>9}{'new s':>9}{'ratio':>8}{'old MB':>9}{'new MB':>9}")
+    slower = []
+    for result in new['results']:
+        previous = before.get((result['group'], result['name']))
+        if previous is None:
+            continue
+        ratio = result['seconds'] / previous['seconds'] if previous['seconds'] else 1.0
+        flag = ''
+        if ratio > threshold and result['seconds'] - previous['seconds'] > NOISE_SECONDS:
+            flag = '  slower'
+            slower.append(result['name'])
+        print(f"{result['group']:<16}{result['name'][:56]:<58}{previous['seconds']:>9.3f}"
+              f"{result['seconds']:>9.3f}{ratio:>7.2f}x{previous['peak_mb']:>9.1f}"
+              f"{result['peak_mb']:>9.1f}{flag}")
+    print(f"\n{len(slower)} steps more than {threshold:.2f}x slower")
+    return slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='End-to-end benchmarks on synthetic trips')
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=3, help='API requests per endpoint, best kept')
+    parser.add_argument('--output', default=None,
+                        help='JSON results file (default bench_<rows>_<timestamp>.json)')
+    parser.add_argument('--workdir', default=None,
+                        help='scratch folder for the data (default a temporary one, removed after)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two results files instead of running')
+    parser.add_argument('--threshold', type=float, default=1.1,
+                        help='with --compare, slowdown ratio that fails the comparison')
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='nyc_taxi_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        report = run_suite(args.rows, args.seed, workdir, args.repeat)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or f"bench_{args.rows}_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
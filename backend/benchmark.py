@@ -0,0 +1,572 @@
+import argparse
+import io
+import os
+import random
+import sqlite3
+import threading
+import time
+import tracemalloc
+
+from custom_algorithm import TaxiZoneRanker, np
+
+# Roughly what one month of yellow cab data looks like
+NUM_ZONES = 265
+NUM_TRIPS = 1_000_000
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def traced(func):
+    tracemalloc.start()
+    try:
+        result, seconds = timed(func)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def make_zone_totals(num_zones, seed=42):
+    rng = random.Random(seed)
+    return [(zone_id, round(rng.uniform(0, 2_000_000), 2))
+            for zone_id in range(1, num_zones + 1)]
+
+
+def make_trip_amounts(num_trips, seed=42):
+    rng = random.Random(seed)
+    return [(trip_id, round(rng.lognormvariate(2.7, 0.6), 2))
+            for trip_id in range(num_trips)]
+
+
+# Quicksort everything then slice vs keeping a bounded heap of size k
+
+def bench_ranker(num_zones=NUM_ZONES, num_trips=NUM_TRIPS, k=10):
+    print(f"\nRanking top {k} (quicksort vs heap top-K)")
+    print(f"{'input':<24}{'algorithm':<14}{'seconds':>10}{'comparisons':>14}")
+
+    cases = [
+        (f'{num_zones:,} zone totals', make_zone_totals(num_zones)),
+        (f'{num_trips:,} trip amounts', make_trip_amounts(num_trips)),
+    ]
+    for label, items in cases:
+        quick = TaxiZoneRanker()
+        expected, quick_time = timed(
+            lambda: quick.quicksort(items, key_func=lambda x: -x[1])[:k]
+        )
+
+        heap = TaxiZoneRanker()
+        result, heap_time = timed(
+            lambda: heap.top_k(iter(items), k, key_func=lambda x: x[1])
+        )
+        assert result == expected, 'top-K disagrees with quicksort'
+
+        print(f"{label:<24}{'QuickSort':<14}{quick_time:>10.3f}{quick.comparisons:>14,}")
+        print(f"{label:<24}{'Heap top-K':<14}{heap_time:>10.3f}{heap.comparisons:>14,}")
+
+
+# fetchall() + dict per row vs streaming the cursor with fetchmany
+
+def bench_streaming(num_zones=NUM_ZONES, num_trips=NUM_TRIPS, k=10):
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE trips (PULocationID INTEGER, total_amount REAL)')
+    rng = random.Random(42)
+    conn.executemany(
+        'INSERT INTO trips VALUES (?, ?)',
+        ((rng.randint(1, num_zones), round(rng.lognormvariate(2.7, 0.6), 2))
+         for _ in range(num_trips))
+    )
+    query = 'SELECT PULocationID, total_amount FROM trips'
+
+    def materialized():
+        conn.row_factory = sqlite3.Row
+        trips = [dict(row) for row in conn.execute(query).fetchall()]
+        return TaxiZoneRanker().rank_zones_by_revenue(trips, k)
+
+    def streamed():
+        conn.row_factory = None
+        cursor = conn.execute(query)
+        return TaxiZoneRanker().rank_zones_by_revenue(
+            cursor, k, zone_key=0, amount_key=1
+        )
+
+    print(f"\nAggregating {num_trips:,} trips (materialized vs cursor)")
+    print(f"{'path':<16}{'seconds':>10}{'peak MB':>10}")
+    expected, seconds, peak = traced(materialized)
+    print(f"{'fetchall+dict':<16}{seconds:>10.3f}{peak / 1e6:>10.1f}")
+    result, seconds, peak = traced(streamed)
+    print(f"{'fetchmany':<16}{seconds:>10.3f}{peak / 1e6:>10.1f}")
+    assert result == expected, 'streamed ranking disagrees'
+    conn.close()
+
+
+# Per-trip python dict loop vs np.bincount over contiguous arrays
+
+def bench_engines(num_zones=NUM_ZONES, num_trips=NUM_TRIPS, k=10):
+    if np is None:
+        print("\nNumPy not installed, skipping engine benchmark")
+        return
+
+    rng = np.random.default_rng(42)
+    zone_ids = rng.integers(1, num_zones + 1, size=num_trips)
+    amounts = np.round(rng.lognormal(2.7, 0.6, size=num_trips), 2)
+    rows = list(zip(zone_ids.tolist(), amounts.tolist()))
+
+    print(f"\nAggregating + ranking {num_trips:,} trips (python vs numpy engine)")
+    print(f"{'engine':<10}{'seconds':>10}")
+    expected, python_time = timed(
+        lambda: TaxiZoneRanker('python').rank_zones_by_revenue(
+            rows, k, zone_key=0, amount_key=1
+        )
+    )
+    result, numpy_time = timed(
+        lambda: TaxiZoneRanker('numpy').rank_zones_by_revenue((zone_ids, amounts), k)
+    )
+    assert result == expected, 'numpy engine disagrees with python engine'
+    print(f"{'python':<10}{python_time:>10.3f}")
+    print(f"{'numpy':<10}{numpy_time:>10.3f}  ({python_time / numpy_time:.0f}x)")
+
+
+# Wall time of each DataProcessor stage on one trip file
+
+def bench_pipeline_stages(trip_file=None):
+    from data_processor import DataProcessor, TRIP_FILES
+
+    trip_file = trip_file or TRIP_FILES[0]
+    processor = DataProcessor(verbose=False)
+    stages = [
+        ('load_data', lambda: processor.load_data([trip_file])),
+        ('integrate_data', processor.integrate_data),
+        ('clean_data', processor.clean_data),
+        ('normalize_data', processor.normalize_data),
+        ('create_features', processor.create_features),
+        ('to_csv', lambda: processor.output_frame().to_csv(io.StringIO(), index=False)),
+    ]
+
+    print(f"\nDataProcessor stages on {trip_file}")
+    print(f"{'stage':<18}{'seconds':>10}")
+    for name, stage in stages:
+        _, seconds = timed(stage)
+        print(f"{name:<18}{seconds:>10.3f}")
+    return processor
+
+
+# integrate_data as two merges against the zone table (before) vs
+# gathering category codes from ID-indexed arrays (after)
+
+def join_by_merge(trips, zones):
+    for side, id_column in [('pickup', 'PULocationID'), ('dropoff', 'DOLocationID')]:
+        trips = trips.merge(zones[['LocationID', 'Borough', 'Zone']],
+                            left_on=id_column, right_on='LocationID', how='left')
+        trips = trips.rename(columns={'Borough': f'{side}_borough', 'Zone': f'{side}_zone'})
+        trips = trips.drop('LocationID', axis=1)
+    return trips
+
+
+def bench_zone_join(trip_file=None):
+    from data_processor import DataProcessor, TRIP_FILES
+
+    trip_file = trip_file or TRIP_FILES[0]
+    loader = DataProcessor(verbose=False)
+    raw = loader.read_trips(trip_file)
+    loader.load_zones()
+
+    def array_lookup(trips):
+        processor = DataProcessor(verbose=False)
+        processor.trips = trips
+        processor.zones = loader.zones
+        processor.integrate_data()
+        return processor.trips
+
+    runs = [('two merges', lambda trips: join_by_merge(trips, loader.zones)),
+            ('array lookup', array_lookup)]
+
+    # Each run gets its own copy of the input, made before the clock and
+    # tracemalloc start. Peak MB only covers memory tracemalloc sees, not
+    # Arrow-backed string columns.
+    print(f"\nintegrate_data on {len(raw):,} trips from {trip_file}")
+    print(f"{'implementation':<22}{'seconds':>10}{'peak MB':>10}{'frame MB':>10}")
+    results = []
+    for label, run in runs:
+        trips = raw.copy()
+        result, seconds = timed(lambda: run(trips))
+        trips = raw.copy()
+        peak = traced(lambda: run(trips))[2]
+        results.append(result)
+        frame_mb = result.memory_usage(deep=True).sum() / 1024 ** 2
+        print(f"{label:<22}{seconds:>10.3f}{peak / 1024 ** 2:>10.1f}{frame_mb:>10.1f}")
+    merged, gathered = results
+    same = merged.reset_index(drop=True).equals(
+        gathered.reset_index(drop=True).astype(merged.dtypes.to_dict()))
+    print(f"same names on every trip: {same}")
+
+
+# clean_data as eight filters in a row, each copying the surviving rows
+# and drop_duplicates hashing every column (before) vs the rule masks
+# and a single copy (after), on the same joined frame
+
+def clean_sequential(trips):
+    import pandas as pd
+    from data_processor import DATETIME_FORMAT
+
+    counts = []
+
+    def keep(frame, mask, rule):
+        counts.append((rule, len(frame) - int(mask.sum())))
+        return frame[mask]
+
+    before = len(trips)
+    trips = trips.drop_duplicates()
+    counts.append(("Duplicates removed", before - len(trips)))
+    before = len(trips)
+    trips = trips.dropna(subset=['PULocationID', 'DOLocationID'])
+    counts.append(("Missing location IDs removed", before - len(trips)))
+    trips = keep(trips, trips['fare_amount'] > 0, "Invalid fares (zero or negative) removed")
+    trips = keep(trips, trips['trip_distance'] > 0, "Zero distance trips removed")
+    trips = keep(trips, trips['trip_distance'] < 100, "Trips over 100 miles removed")
+    trips = trips.copy()
+    for column in ['tpep_pickup_datetime', 'tpep_dropoff_datetime']:
+        trips[column] = pd.to_datetime(trips[column], format=DATETIME_FORMAT)
+    trips['duration_minutes'] = (
+        trips['tpep_dropoff_datetime'] - trips['tpep_pickup_datetime']
+    ).dt.total_seconds() / 60
+    trips = keep(trips, trips['duration_minutes'] > 0, "Negative/zero duration trips removed")
+    trips = keep(trips, trips['duration_minutes'] < 180, "Trips over 3 hours removed")
+    trips = keep(trips, (trips['passenger_count'] > 0) & (trips['passenger_count'] <= 6),
+                 "Invalid passenger count removed")
+    return trips, counts
+
+
+def bench_cleaning(trip_file=None):
+    from data_processor import DataProcessor, TRIP_FILES
+
+    trip_file = trip_file or TRIP_FILES[0]
+    loader = DataProcessor(verbose=False)
+    loader.trips = loader.read_trips(trip_file)
+    loader.load_zones()
+    loader.integrate_data()
+    joined = loader.trips
+
+    def rule_engine():
+        processor = DataProcessor(verbose=False)
+        processor.trips = joined.copy()
+        processor.clean_data()
+        return processor.trips, list(processor.cleaning_counts.items())
+
+    def sequential():
+        return clean_sequential(joined.copy())
+
+    # Timed and traced separately: tracemalloc slows the run down
+    print(f"\nclean_data on {len(joined):,} joined trips from {trip_file}")
+    print(f"{'implementation':<22}{'seconds':>10}{'peak MB':>10}")
+    results = []
+    for label, run in (('sequential filters', sequential), ('rule masks', rule_engine)):
+        result, seconds = timed(run)
+        peak = traced(run)[2]
+        results.append(result)
+        print(f"{label:<22}{seconds:>10.3f}{peak / 1024 ** 2:>10.1f}")
+    (old, old_counts), (new, new_counts) = results
+    same = old.index.equals(new.index) and old_counts == new_counts
+    print(f"same rows kept and same counts per rule: {same}")
+
+
+# Datetime work per stage: re-parsing strings everywhere (before) vs
+# parsing once with an explicit format and formatting at output (after)
+
+def bench_datetime_parsing(trip_file=None):
+    import pandas as pd
+    from data_processor import DATETIME_FORMAT, TRIP_FILES
+
+    trip_file = trip_file or TRIP_FILES[0]
+    raw = pd.read_csv(trip_file, usecols=['tpep_pickup_datetime', 'tpep_dropoff_datetime'])
+    pickup, dropoff = raw['tpep_pickup_datetime'], raw['tpep_dropoff_datetime']
+
+    def before_clean():
+        return pd.to_datetime(dropoff) - pd.to_datetime(pickup)
+
+    def before_normalize():
+        return (pd.to_datetime(pickup).dt.strftime(DATETIME_FORMAT),
+                pd.to_datetime(dropoff).dt.strftime(DATETIME_FORMAT))
+
+    def before_features(strings):
+        return (pd.to_datetime(strings).dt.hour,
+                pd.to_datetime(strings).dt.dayofweek)
+
+    def after_clean():
+        return (pd.to_datetime(pickup, format=DATETIME_FORMAT),
+                pd.to_datetime(dropoff, format=DATETIME_FORMAT))
+
+    def after_features(typed):
+        return typed.dt.hour, typed.dt.dayofweek
+
+    (pickup_str, dropoff_str), _ = timed(before_normalize)
+    (pickup_dt, dropoff_dt), _ = timed(after_clean)
+    rows = [
+        ('clean_data', timed(before_clean)[1], timed(after_clean)[1]),
+        ('normalize_data', timed(before_normalize)[1], 0.0),
+        ('create_features', timed(lambda: before_features(pickup_str))[1],
+         timed(lambda: after_features(pickup_dt))[1]),
+        ('to_csv', timed(lambda: pd.DataFrame({'p': pickup_str, 'd': dropoff_str})
+                         .to_csv(io.StringIO(), index=False))[1],
+         timed(lambda: pd.DataFrame({'p': pickup_dt, 'd': dropoff_dt})
+               .to_csv(io.StringIO(), index=False, date_format=DATETIME_FORMAT))[1]),
+    ]
+
+    print(f"\nDatetime handling per stage, {len(raw):,} trips")
+    print(f"{'stage':<18}{'before':>10}{'after':>10}")
+    for name, before, after in rows:
+        print(f"{name:<18}{before:>10.3f}{after:>10.3f}")
+    print(f"{'total':<18}{sum(r[1] for r in rows):>10.3f}{sum(r[2] for r in rows):>10.3f}")
+
+
+# Concurrent load on the API: pooled read-only connections vs a fresh
+# connection per request, through the threaded server app.run uses (a
+# new thread for every request), so reuse has to come from the pool and
+# not from long-lived threads. Run from backend/ next to nyc_taxi.db.
+
+POOL_ENDPOINTS = ['/api/top-zones?limit=10', '/api/trips?limit=20', '/api/payment-types']
+
+def bench_api_pool(threads=8, requests_per_thread=200, endpoints=POOL_ENDPOINTS):
+    import logging
+    import urllib.request
+    from werkzeug.serving import make_server
+    import app as api
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # no access log
+    server = make_server('127.0.0.1', 0, api.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+
+    # Count the connections each mode opens
+    opened = [0]
+    connect_readonly = api.connect_readonly
+
+    def counting_connect():
+        opened[0] += 1
+        return connect_readonly()
+
+    def worker():
+        for i in range(requests_per_thread):
+            with urllib.request.urlopen(base + endpoints[i % len(endpoints)]) as response:
+                assert response.status == 200, response.status
+                response.read()
+
+    total = threads * requests_per_thread
+    print(f"\nAPI load test, threaded server, {threads} clients x {requests_per_thread} requests")
+    print(f"{'connections':<14}{'seconds':>10}{'req/s':>10}{'opened':>10}")
+    api.connect_readonly = counting_connect
+    try:
+        for pooled in (False, True):
+            api.app.config['DB_POOL'] = pooled
+            opened[0] = 0
+            clients = [threading.Thread(target=worker) for _ in range(threads)]
+            start = time.perf_counter()
+            for thread in clients:
+                thread.start()
+            for thread in clients:
+                thread.join()
+            seconds = time.perf_counter() - start
+            label = 'pooled' if pooled else 'per request'
+            print(f"{label:<14}{seconds:>10.3f}{total / seconds:>10,.0f}{opened[0]:>10,}")
+    finally:
+        api.connect_readonly = connect_readonly
+        server.shutdown()
+
+
+# Normalized trips (integer keys and epoch timestamps, names joined at
+# response time) vs the old denormalized rows: a copy of an old-layout
+# database is migrated and both are measured side by side
+
+STORAGE_QUERIES = {
+    'full scan': (
+        'SELECT COUNT(*), TOTAL(total_amount), MAX(pickup_datetime) FROM trips NOT INDEXED',
+        'SELECT COUNT(*), TOTAL(total_amount), MAX(pickup_datetime) FROM trips NOT INDEXED',
+    ),
+    'trips per day': (
+        'SELECT substr(pickup_datetime, 1, 10) AS day, COUNT(*) FROM trips GROUP BY day',
+        'SELECT pickup_datetime / 86400 AS day, COUNT(*) FROM trips GROUP BY day',
+    ),
+}
+
+
+def bench_storage(old_db='nyc_taxi.db', pages=200, page_size=50):
+    import os
+    import shutil
+    import tempfile
+    import database
+
+    conn = sqlite3.connect(old_db)
+    normalized = database.is_normalized(conn)
+    conn.close()
+    if normalized:
+        print(f"\n{old_db} is already normalized; pass a database built before the migration")
+        return
+
+    workdir = tempfile.mkdtemp()
+    try:
+        new_db = os.path.join(workdir, 'normalized.db')
+        shutil.copy(old_db, new_db)
+        database.DB_PATH = new_db
+        _, migrate_seconds = timed(database.migrate)
+
+        old_page = 'SELECT * FROM trips WHERE trip_id BETWEEN ? AND ?'
+        new_page = (
+            'SELECT t.*, pz.Zone, dz.Zone, pt.label FROM trips t '
+            'LEFT JOIN zones pz ON pz.LocationID = t.PULocationID '
+            'LEFT JOIN zones dz ON dz.LocationID = t.DOLocationID '
+            'LEFT JOIN payment_types pt ON pt.payment_type = t.payment_type '
+            'WHERE t.trip_id BETWEEN ? AND ?'
+        )
+        layouts = []
+        for path, page in ((old_db, old_page), (new_db, new_page)):
+            conn = sqlite3.connect(path)
+            trips, high = conn.execute('SELECT COUNT(*), MAX(trip_id) FROM trips').fetchone()
+            rng = random.Random(42)
+            starts = [rng.randint(1, max(high - page_size, 1)) for _ in range(pages)]
+            seconds = {}
+            for name, queries in STORAGE_QUERIES.items():
+                sql = queries[len(layouts)]
+                seconds[name] = min(timed(lambda: conn.execute(sql).fetchall())[1] for _ in range(3))
+            seconds[f'{pages} pages'] = timed(lambda: [
+                conn.execute(page, (start, start + page_size - 1)).fetchall() for start in starts
+            ])[1]
+            conn.close()
+            layouts.append((os.path.getsize(path), trips, seconds))
+
+        print(f"\nTrips storage, {layouts[0][1]:,} trips (migration took {migrate_seconds:.1f}s)")
+        print(f"{'':<18}{'old':>12}{'normalized':>12}")
+        print(f"{'file MB':<18}" + ''.join(f"{size / 1024 ** 2:>12.1f}" for size, _, _ in layouts))
+        print(f"{'bytes per trip':<18}" + ''.join(f"{size / max(trips, 1):>12.0f}" for size, trips, _ in layouts))
+        for name in layouts[0][2]:
+            print(f"{name + ' s':<18}" + ''.join(f"{seconds[name]:>12.3f}" for _, _, seconds in layouts))
+    finally:
+        database.DB_PATH = 'nyc_taxi.db'
+        shutil.rmtree(workdir)
+
+
+# Aggregate endpoints per query engine (see QUERY_ENGINE in app.py), with
+# the result cache cleared before every request. Ranges finer than an
+# hour can't use the rollups, so the SQLite engine scans trips for them.
+# Run from backend/ after database.py has written the columnar snapshot.
+
+ENGINE_ENDPOINTS = [
+    '/api/stats',
+    '/api/hourly',
+    '/api/boroughs',
+    '/api/distance-distribution',
+    '/api/payment-types',
+    '/api/top-zones?limit=10',
+    '/api/daily',
+    '/api/stats?start=2019-01-05 08:30&end=2019-01-20',
+    '/api/top-zones?limit=10&start=2019-01-05 08:30&end=2019-01-20',
+]
+
+
+def bench_query_engines(endpoints=ENGINE_ENDPOINTS, repeat=5):
+    import app as api
+
+    client = api.app.test_client()
+    engines = ('sqlite', 'columnar', 'auto')
+    with api.app.test_request_context():
+        if api.column_store() is None:
+            print("\nNo up to date columnar snapshot, run `python database.py --columns`")
+            return
+
+    def best_ms(path):
+        seconds = []
+        for _ in range(repeat):
+            api.cache.clear()
+            response, elapsed = timed(lambda: client.get(path))
+            assert response.status_code == 200, response.status_code
+            seconds.append(elapsed)
+        return min(seconds) * 1000
+
+    print(f"\nAggregate endpoints by query engine, best of {repeat} (ms)")
+    print(f"{'endpoint':<60}" + ''.join(f"{engine:>10}" for engine in engines))
+    try:
+        for path in endpoints:
+            times = []
+            for engine in engines:
+                api.app.config['QUERY_ENGINE'] = engine
+                times.append(best_ms(path))
+            print(f"{path:<60}" + ''.join(f"{ms:>10.1f}" for ms in times))
+    finally:
+        api.app.config['QUERY_ENGINE'] = 'auto'
+
+
+SHARD_ENDPOINTS = [
+    '/api/dashboard',
+    '/api/daily',
+    '/api/dashboard?start=2019-01-05 08:30',
+    '/api/top-zones?limit=10&start=2019-01-05 08:30',
+    '/api/rankings?group=pickup,od&metric=revenue,avg_fare',
+]
+
+
+def bench_shards(endpoints=SHARD_ENDPOINTS, repeat=3):
+    import app as api
+
+    client = api.app.test_client()
+    cores = os.cpu_count() or 1
+    workers = sorted({1, 2, 4, cores})
+    api.app.config['QUERY_ENGINE'] = 'shards'
+    with api.app.test_request_context():
+        sharded = api.shard_set()
+    if sharded is None:
+        api.app.config['QUERY_ENGINE'] = 'auto'
+        print("\nNo up to date month shards, run `python database.py --shards`")
+        return
+
+    def best_ms(path):
+        seconds = []
+        for _ in range(repeat):
+            api.cache.clear()
+            response, elapsed = timed(lambda: client.get(path))
+            assert response.status_code == 200, response.status_code
+            seconds.append(elapsed)
+        return min(seconds) * 1000
+
+    print(f"\nMonth shards ({len(sharded.paths)}) fanned out over N worker processes "
+          f"vs the single database, best of {repeat} (ms, {cores} cores)")
+    print(f"{'endpoint':<55}{'sqlite':>10}" + ''.join(f"{f'N={n}':>10}" for n in workers))
+    try:
+        for path in endpoints:
+            api.app.config['QUERY_ENGINE'] = 'sqlite'
+            times = [best_ms(path)]
+            api.app.config['QUERY_ENGINE'] = 'shards'
+            for n in workers:
+                api.app.config['SHARD_WORKERS'] = n
+                times.append(best_ms(path))
+            print(f"{path:<55}" + ''.join(f"{ms:>10.1f}" for ms in times))
+    finally:
+        api.app.config['QUERY_ENGINE'] = 'auto'
+        api.app.config['SHARD_WORKERS'] = cores
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark backend hot paths')
+    parser.add_argument('--zones', type=int, default=NUM_ZONES)
+    parser.add_argument('--trips', type=int, default=NUM_TRIPS)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--trip-file', default=None,
+                        help='raw trip CSV for the DataProcessor benchmarks')
+    parser.add_argument('--old-db', default=None,
+                        help='database built before trips was normalized, '
+                             'to compare storage layouts')
+    args = parser.parse_args()
+
+    bench_ranker(args.zones, args.trips, args.top)
+    bench_streaming(args.zones, args.trips, args.top)
+    bench_engines(args.zones, args.trips, args.top)
+    bench_pipeline_stages(args.trip_file)
+    bench_zone_join(args.trip_file)
+    bench_cleaning(args.trip_file)
+    bench_datetime_parsing(args.trip_file)
+    bench_api_pool()
+    bench_query_engines()
+    bench_shards()
+    if args.old_db:
+        bench_storage(args.old_db)
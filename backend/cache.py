@@ -0,0 +1,203 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+
+def make_key(endpoint, params=None):
+    # Same endpoint + same parameters (in any order) -> same key
+    if not params:
+        return endpoint
+    items = sorted((str(k), str(v)) for k, v in params.items())
+    return f"{endpoint}?{urlencode(items)}"
+
+
+# Where entries live. Both backends store (version, expires_at, size,
+# value) per key and evict least recently used entries past their limits.
+
+class MemoryBackend:
+    """Per-process LRU dict"""
+
+    def __init__(self, max_entries=512, max_bytes=64 * 1024 ** 2):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, version, expires_at, size, value):
+        evicted = 0
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self.entries[key] = (version, expires_at, size, value)
+            self.bytes += size
+            while self.entries and (len(self.entries) > self.max_entries
+                                    or self.bytes > self.max_bytes):
+                _, dropped = self.entries.popitem(last=False)
+                self.bytes -= dropped[2]
+                evicted += 1
+        return evicted
+
+    def delete(self, key):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def size(self):
+        return len(self.entries), self.bytes
+
+
+class SqliteBackend:
+    """On-disk LRU shared by every worker process on the machine"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS cache (
+        key        TEXT     NOT NULL,
+        version    TEXT     NOT NULL,
+        expires_at REAL     NOT NULL,
+        size       INTEGER  NOT NULL,
+        last_used  REAL     NOT NULL,
+        value      TEXT     NOT NULL,
+
+        CONSTRAINT pk_cache PRIMARY KEY (key)
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_cache_last_used
+        ON cache (last_used);
+    """
+
+    def __init__(self, path='api_cache.db', max_entries=4096, max_bytes=512 * 1024 ** 2):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+
+    def conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self.conn()
+        row = conn.execute(
+            'SELECT version, expires_at, size, value FROM cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute('UPDATE cache SET last_used = ? WHERE key = ?', (time.time(), key))
+        return row[0], row[1], row[2], json.loads(row[3])
+
+    def put(self, key, version, expires_at, size, value):
+        conn = self.conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?)',
+                (key, version, expires_at, size, time.time(), json.dumps(value))
+            )
+            count, total = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache'
+            ).fetchone()
+            evicted = 0
+            for old_key, old_size in conn.execute(
+                    'SELECT key, size FROM cache ORDER BY last_used').fetchall():
+                if count <= self.max_entries and total <= self.max_bytes:
+                    break
+                conn.execute('DELETE FROM cache WHERE key = ?', (old_key,))
+                count -= 1
+                total -= old_size
+                evicted += 1
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return evicted
+
+    def delete(self, key):
+        self.conn().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def clear(self):
+        self.conn().execute('DELETE FROM cache')
+
+    def size(self):
+        return self.conn().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache'
+        ).fetchone()
+
+
+class QueryCache:
+    """Caches JSON-able query results per (endpoint, params).
+
+    Entries are tagged with the database's data version; a lookup with a
+    different version (the data was reloaded) or past its TTL is a miss.
+    """
+
+    def __init__(self, backend=None, ttl=3600):
+        self.backend = backend or MemoryBackend()
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.metrics = {'hits': 0, 'misses': 0, 'stale': 0, 'expired': 0, 'evictions': 0}
+
+    def count(self, metric, amount=1):
+        with self.lock:
+            self.metrics[metric] += amount
+
+    def get_or_compute(self, endpoint, params, version, compute):
+        key = make_key(endpoint, params)
+        entry = self.backend.get(key)
+        if entry is not None:
+            entry_version, expires_at, _, value = entry
+            if entry_version != version:
+                self.count('stale')
+            elif expires_at < time.time():
+                self.count('expired')
+            else:
+                self.count('hits')
+                return value
+
+        self.count('misses')
+        value = compute()
+        size = len(json.dumps(value))
+        evicted = self.backend.put(key, version, time.time() + self.ttl, size, value)
+        if evicted:
+            self.count('evictions', evicted)
+        return value
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        with self.lock:
+            metrics = dict(self.metrics)
+        lookups = metrics['hits'] + metrics['misses']
+        entries, size = self.backend.size()
+        metrics.update({
+            'hit_rate': round(metrics['hits'] / lookups, 3) if lookups else None,
+            'entries': entries,
+            'bytes': size,
+            'backend': type(self.backend).__name__,
+            'ttl': self.ttl
+        })
+        return metrics
@@ -0,0 +1,222 @@
+import json
+import os
+import shutil
+import sqlite3
+
+try:
+    import numpy as np
+except ImportError:  # The columnar engine is optional
+    np = None
+
+# Columns the aggregate endpoints read, with the dtype each is stored as
+# and what a NULL becomes: -1 for keys (no zone, borough or payment type
+# has it), NaN for measures so they can be skipped like SQL's SUM does
+
+COLUMNS = {
+    'pickup_datetime':   ('int64', None),
+    'pickup_hour':       ('int8', -1),
+    'PULocationID':      ('int16', -1),
+    'pickup_borough_id': ('int16', -1),
+    'payment_type':      ('int16', -1),
+    'is_rush_hour':      ('int8', 0),
+    'trip_distance':     ('float64', None),
+    'total_amount':      ('float64', None),
+    'tip_amount':        ('float64', None),
+    'speed_mph':         ('float64', None),
+}
+
+DISTANCE_BOUNDS = [1, 3, 5, 10]  # Upper bounds of the distance ranges but the last
+
+
+def snapshot_path(db_path):
+    # nyc_taxi.db -> nyc_taxi_columns/
+    return os.path.splitext(db_path)[0] + '_columns'
+
+
+def read_data_version(conn):
+    row = conn.execute("SELECT value FROM db_meta WHERE key = 'data_version'").fetchone()
+    return row[0] if row else None
+
+
+def write_snapshot(db_path, batch_size=500000):
+    """Write trips out as one .npy file per column next to the database"""
+    path = snapshot_path(db_path)
+    tmp = path + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute('BEGIN')  # Count and rows from the same read transaction
+    try:
+        version = read_data_version(conn)
+        count = conn.execute('SELECT COUNT(*) FROM trips').fetchone()[0]
+        arrays = {
+            name: np.lib.format.open_memmap(os.path.join(tmp, f'{name}.npy'), mode='w+',
+                                            dtype=dtype, shape=(count,))
+            for name, (dtype, _) in COLUMNS.items()
+        }
+        select = ', '.join(name if null is None else f'COALESCE({name}, {null})'
+                           for name, (_, null) in COLUMNS.items())
+        cursor = conn.execute(f'SELECT {select} FROM trips ORDER BY trip_id')
+        offset = 0
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for (name, (dtype, _)), values in zip(COLUMNS.items(), zip(*rows)):
+                # None -> NaN for the float columns
+                arrays[name][offset:offset + len(rows)] = np.array(values, dtype=dtype)
+            offset += len(rows)
+    finally:
+        conn.rollback()
+        conn.close()
+
+    for array in arrays.values():
+        array.flush()
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump({'version': version, 'rows': count,
+                   'columns': {name: dtype for name, (dtype, _) in COLUMNS.items()}}, f)
+
+    # Swap the new snapshot in. Processes still reading the old one keep
+    # their mappings; the files go away once they let go of them.
+    old = path + '.old'
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.isdir(path):
+        os.rename(path, old)
+    os.rename(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+    return count
+
+
+def snapshot_version(db_path):
+    try:
+        with open(os.path.join(snapshot_path(db_path), 'meta.json')) as f:
+            return json.load(f)['version']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+class ColumnStore:
+    """A snapshot opened read-only; columns are memory-mapped, not loaded"""
+
+    def __init__(self, db_path):
+        path = snapshot_path(db_path)
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.db_path = db_path
+        self.version = meta['version']
+        self.rows = meta['rows']
+        self.columns = {
+            name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+            for name in meta['columns']
+        }
+
+    def scan(self, start=None, end=None):
+        return Scan(self, start, end)
+
+
+class Scan:
+    """Columns of the trips picked up in [start, end) (epoch seconds)"""
+
+    def __init__(self, store, start=None, end=None):
+        self.store = store
+        self.mask = None
+        if start is not None or end is not None:
+            pickup = store.columns['pickup_datetime']
+            self.mask = np.ones(len(pickup), dtype=bool)
+            if start is not None:
+                self.mask &= pickup >= start
+            if end is not None:
+                self.mask &= pickup < end
+        self.cache = {}
+
+    def __getitem__(self, name):
+        # Without a date range a column is the mapped file itself
+        if name not in self.cache:
+            column = self.store.columns[name]
+            self.cache[name] = column if self.mask is None else column[self.mask]
+        return self.cache[name]
+
+    def measure(self, name):
+        # (values with NULLs as 0, which rows had a value)
+        values = self[name]
+        present = ~np.isnan(values)
+        return np.where(present, values, 0.0), present
+
+
+def _key(values):
+    # Shift keys so -1 (NULL) lands on 0 for bincount
+    return values.astype(np.int64) + 1
+
+
+def _unkey(index):
+    return None if index == 0 else int(index) - 1
+
+
+def hour_borough_totals(scan):
+    """(hour, borough_id, trips, revenue, rush_trips, distance, speed, speed_trips)"""
+    hours = _key(scan['pickup_hour'])
+    boroughs = _key(scan['pickup_borough_id'])
+    width = int(boroughs.max()) + 1 if len(boroughs) else 1
+    groups = hours * width + boroughs
+    size = 25 * width
+
+    speed, has_speed = scan.measure('speed_mph')
+    sums = [
+        np.bincount(groups, minlength=size),
+        np.bincount(groups, weights=scan['total_amount'], minlength=size),
+        np.bincount(groups, weights=scan['is_rush_hour'], minlength=size),
+        np.bincount(groups, weights=scan['trip_distance'], minlength=size),
+        np.bincount(groups, weights=speed, minlength=size),
+        np.bincount(groups, weights=has_speed, minlength=size),
+    ]
+    return [
+        (_unkey(group // width), _unkey(group % width),
+         int(sums[0][group]), *(float(s[group]) for s in sums[1:5]), int(sums[5][group]))
+        for group in np.flatnonzero(sums[0])
+    ]
+
+
+def distance_counts(scan):
+    """Trips per distance range: < 1, 1-3, 3-5, 5-10 and 10+ miles"""
+    # Trips at or past each bound; neighbours' differences are the ranges
+    distance = scan['trip_distance']
+    at_least = [len(distance)] + [int(np.count_nonzero(distance >= bound))
+                                  for bound in DISTANCE_BOUNDS] + [0]
+    return [at_least[i] - at_least[i + 1] for i in range(len(DISTANCE_BOUNDS) + 1)]
+
+
+def payment_totals(scan):
+    """(payment_type, trips, tips) per payment type"""
+    types = _key(scan['payment_type'])
+    tips, _ = scan.measure('tip_amount')
+    counts = np.bincount(types)
+    totals = np.bincount(types, weights=tips, minlength=len(counts))
+    return [(_unkey(key), int(counts[key]), float(totals[key]))
+            for key in np.flatnonzero(counts) if key != 0]
+
+
+def zone_totals(scan):
+    """(zone_id, revenue) for every pickup zone with trips"""
+    zones = _key(scan['PULocationID'])
+    counts = np.bincount(zones)
+    totals = np.bincount(zones, weights=scan['total_amount'], minlength=len(counts))
+    return [(_unkey(key), float(totals[key])) for key in np.flatnonzero(counts)]
+
+
+def daily_totals(scan):
+    """(days since 1970-01-01, trips, revenue, tips, distance, speed, speed_trips)"""
+    days = scan['pickup_datetime'] // 86400
+    if not len(days):
+        return []
+    first = int(days.min())
+    days = days - first
+    tips, _ = scan.measure('tip_amount')
+    speed, has_speed = scan.measure('speed_mph')
+    counts = np.bincount(days)
+    sums = [np.bincount(days, weights=w, minlength=len(counts))
+            for w in (scan['total_amount'], tips, scan['trip_distance'], speed, has_speed)]
+    return [
+        (first + int(day), int(counts[day]), *(float(s[day]) for s in sums[:4]), int(sums[4][day]))
+        for day in np.flatnonzero(counts)
+    ]
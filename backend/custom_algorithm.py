@@ -1,6 +1,64 @@
+from itertools import islice
+
+try:
+    import numpy as np
+except ImportError:  # NumPy engine is optional
+    np = None
+
+ENGINES = ('python', 'numpy')
+
+# Things rank_many can group trips by: name -> trip columns making up the key
+RANKING_GROUPS = {
+    'pickup': ('PULocationID',),
+    'dropoff': ('DOLocationID',),
+    'od': ('PULocationID', 'DOLocationID'),
+}
+
+
+def _ratio(top, bottom):
+    return top / bottom if bottom else None
+
+
+# Metrics rank_many can rank by: name -> (columns it sums, how to turn the
+# trip count and {column: (sum, non-null count)} into the metric value)
+RANKING_METRICS = {
+    'revenue': (('total_amount',), lambda n, s: s['total_amount'][0]),
+    'tip': (('tip_amount',), lambda n, s: s['tip_amount'][0]),
+    'trips': ((), lambda n, s: n),
+    'avg_fare': (('total_amount',), lambda n, s: _ratio(*s['total_amount'])),
+    # Total revenue over total miles, so short trips don't dominate
+    'revenue_per_mile': (('total_amount', 'trip_distance'),
+                         lambda n, s: _ratio(s['total_amount'][0], s['trip_distance'][0])),
+    'speed': (('speed_mph',), lambda n, s: _ratio(*s['speed_mph'])),
+}
+
+
+def ranking_columns(groups, metrics):
+    # Trip columns rank_many needs, in the order it expects tuple rows
+    columns = []
+    for name in groups:
+        columns.extend(RANKING_GROUPS[name])
+    for name in metrics:
+        columns.extend(RANKING_METRICS[name][0])
+    return list(dict.fromkeys(columns))
+
+
+def _sum_columns(metrics):
+    return list(dict.fromkeys(
+        col for name in metrics for col in RANKING_METRICS[name][0]
+    ))
+
+
 class TaxiZoneRanker:
-    def __init__(self):
+    def __init__(self, engine='python'):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine {engine!r}, expected one of {ENGINES}")
+        if engine == 'numpy' and np is None:
+            raise ImportError("The numpy engine needs NumPy installed")
+        
+        self.engine = engine
         self.comparisons = 0
+        self.algorithm = 'QuickSort'
     
     def quicksort(self, arr, key_func=None):
         if key_func is None:
@@ -35,32 +93,322 @@ class TaxiZoneRanker:
                 middle + 
                 self.quicksort(right, key_func))
     
-    def rank_zones_by_revenue(self, trips_data):
+    def top_k(self, items, k, key_func=None, descending=True, keep_ties=False):
+        if key_func is None:
+            key_func = lambda x: x
+        
+        self.algorithm = 'Heap top-K'
+        if k <= 0:
+            return []
+        
+        # Bounded heap holding the k best items seen so far, worst one at
+        # the root. Entries are [value, seq, item]; seq is the arrival
+        # order so that equal values keep their input order like quicksort.
+        heap = []
+        ties = []  # Items tied with the root that didn't fit in the heap
+        
+        def worse(a, b):
+            # True if entry a ranks below entry b
+            self.comparisons += 1
+            if a[0] == b[0]:
+                return a[1] > b[1]
+            return a[0] < b[0] if descending else a[0] > b[0]
+        
+        def sift_up(pos):
+            while pos > 0:
+                parent = (pos - 1) // 2
+                if not worse(heap[pos], heap[parent]):
+                    break
+                heap[pos], heap[parent] = heap[parent], heap[pos]
+                pos = parent
+        
+        def sift_down(pos):
+            size = len(heap)
+            while True:
+                child = 2 * pos + 1
+                if child >= size:
+                    break
+                if child + 1 < size and worse(heap[child + 1], heap[child]):
+                    child += 1
+                if not worse(heap[child], heap[pos]):
+                    break
+                heap[pos], heap[child] = heap[child], heap[pos]
+                pos = child
+        
+        # Single pass, so items can be any iterator (e.g. a DB cursor)
+        for seq, item in enumerate(items):
+            entry = [key_func(item), seq, item]
+            
+            if len(heap) < k:
+                heap.append(entry)
+                sift_up(len(heap) - 1)
+            elif worse(heap[0], entry):
+                evicted = heap[0]
+                heap[0] = entry
+                sift_down(0)
+                if keep_ties:
+                    ties = [t for t in ties if t[0] == heap[0][0]]
+                    if evicted[0] == heap[0][0]:
+                        ties.append(evicted)
+            elif keep_ties and entry[0] == heap[0][0]:
+                ties.append(entry)
+        
+        # Pop worst-first, then reverse to get best-first
+        ranked = []
+        while heap:
+            last = heap.pop()
+            if heap:
+                ranked.append(heap[0])
+                heap[0] = last
+                sift_down(0)
+            else:
+                ranked.append(last)
+        ranked.reverse()
+        
+        ties.sort(key=lambda t: t[1])
+        return [entry[2] for entry in ranked + ties]
+    
+    def iter_rows(self, source, chunk_size=10000):
+        
+        # DB cursors are drained with fetchmany so only one chunk of rows
+        # is in memory at a time, anything else is just iterated
+        if hasattr(source, 'fetchmany'):
+            while True:
+                rows = source.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield from rows
+        else:
+            yield from source
+    
+    def rank_zones_by_revenue(self, trips_data, limit=None, descending=True,
+                              zone_key='PULocationID', amount_key='total_amount',
+                              chunk_size=10000):
+        
+        # trips_data can be any iterable of rows: dicts, sqlite3.Row, or
+        # plain tuples with zone_key/amount_key given as column positions
+        # (e.g. zone_key=0, amount_key=1), including a raw sqlite3 cursor
+        if self.engine == 'numpy':
+            zone_ids, amounts = self.load_arrays(
+                trips_data, zone_key, amount_key, chunk_size
+            )
+            return self.rank_arrays(zone_ids, amounts, limit, descending)
     
         # Manually calculate revenue per zone (no groupby!)
         zone_revenue = {}
         
-        for trip in trips_data:
-            zone_id = trip['PULocationID']
-            revenue = trip['total_amount']
+        for trip in self.iter_rows(trips_data, chunk_size):
+            zone_id = trip[zone_key]
+            revenue = trip[amount_key]
             
             if zone_id in zone_revenue:
                 zone_revenue[zone_id] += revenue
             else:
                 zone_revenue[zone_id] = revenue
         
-        # Convert to list of tuples
-        zone_list = [(zone_id, revenue) for zone_id, revenue in zone_revenue.items()]
+        return self.rank_zone_totals(zone_revenue.items(), limit, descending)
+    
+    def rank_zone_totals(self, zone_totals, limit=None, descending=True):
+        
+        # Rank (zone_id, revenue) pairs that are already summed per zone,
+        # e.g. rows read from the zone_revenue summary table
+        zone_pairs = ((zone_id, revenue) for zone_id, revenue in zone_totals)
         
-        # Sort using our custom quicksort (by revenue, descending)
+        # Only the best `limit` zones are needed, keep a heap of that size
+        if limit is not None:
+            return self.top_k(
+                zone_pairs,
+                limit,
+                key_func=lambda x: x[1],
+                descending=descending
+            )
+        
+        # Sort using our custom quicksort (by revenue)
+        sign = -1 if descending else 1  # Negative for descending order
         sorted_zones = self.quicksort(
-            zone_list,
-            key_func=lambda x: -x[1]  # Negative for descending order
+            list(zone_pairs),
+            key_func=lambda x: sign * x[1]
         )
         
         return sorted_zones
     
+    def rank_many(self, trips_data, groups, metrics, limit=10, descending=True,
+                  columns=None, chunk_size=10000):
+        
+        # Rank every (group, metric) combination from one pass over the
+        # trips. Rows are dicts/sqlite3.Row, or tuples laid out like
+        # `columns` (see ranking_columns). Returns
+        # {group: {metric: [(key, value), ...]}} where key is a zone ID,
+        # or a (pickup, dropoff) pair for the 'od' group.
+        tables = self.accumulate_many(trips_data, groups, metrics, columns, chunk_size)
+        return self.finish_many(tables, groups, metrics, limit, descending)
+    
+    def accumulate_many(self, trips_data, groups, metrics, columns=None,
+                        chunk_size=10000):
+        
+        # The pass rank_many makes, without the ranking: one accumulator
+        # table per group, key -> [trip count, sum_1, non-null_1, ...].
+        # Tables from separate sets of trips can be added together with
+        # merge_accumulators before finish_many ranks them.
+        for name in groups:
+            if name not in RANKING_GROUPS:
+                raise ValueError(f"Unknown ranking group {name!r}")
+        for name in metrics:
+            if name not in RANKING_METRICS:
+                raise ValueError(f"Unknown ranking metric {name!r}")
+        
+        position = {col: col for col in ranking_columns(groups, metrics)}
+        if columns is not None:
+            position = {col: i for i, col in enumerate(columns)}
+        
+        sum_positions = [position[col] for col in _sum_columns(metrics)]
+        
+        tables = []
+        for name in groups:
+            key_positions = [position[col] for col in RANKING_GROUPS[name]]
+            tables.append(({}, key_positions))
+        
+        for trip in self.iter_rows(trips_data, chunk_size):
+            for table, key_positions in tables:
+                if len(key_positions) == 1:
+                    key = trip[key_positions[0]]
+                else:
+                    key = tuple(trip[pos] for pos in key_positions)
+                
+                acc = table.get(key)
+                if acc is None:
+                    acc = table[key] = [0] + [0, 0] * len(sum_positions)
+                
+                acc[0] += 1
+                for i, pos in enumerate(sum_positions):
+                    value = trip[pos]
+                    if value is not None:
+                        acc[2 * i + 1] += value
+                        acc[2 * i + 2] += 1
+        
+        return [table for table, _ in tables]
+    
+    def merge_accumulators(self, partials):
+        
+        # Add up accumulate_many results (same groups and metrics) key by key
+        merged = None
+        for tables in partials:
+            if merged is None:
+                merged = [dict(table) for table in tables]
+                continue
+            for total, table in zip(merged, tables):
+                for key, acc in table.items():
+                    current = total.get(key)
+                    if current is None:
+                        total[key] = acc
+                    else:
+                        total[key] = [a + b for a, b in zip(current, acc)]
+        return merged
+    
+    def finish_many(self, tables, groups, metrics, limit=10, descending=True):
+        
+        # Finish each metric per key and keep the best `limit` of each
+        sum_columns = _sum_columns(metrics)
+        results = {}
+        for name, table in zip(groups, tables or [{} for _ in groups]):
+            results[name] = {}
+            for metric in metrics:
+                finish = RANKING_METRICS[metric][1]
+                values = []
+                for key, acc in table.items():
+                    sums = {col: (acc[2 * i + 1], acc[2 * i + 2])
+                            for i, col in enumerate(sum_columns)}
+                    value = finish(acc[0], sums)
+                    if value is not None:
+                        values.append((key, value))
+                
+                results[name][metric] = self.top_k(
+                    values, limit, key_func=lambda x: x[1], descending=descending
+                )
+        
+        return results
+    
+    def load_arrays(self, trips_data, zone_key='PULocationID',
+                    amount_key='total_amount', chunk_size=10000):
+        
+        # Already columnar: a (zone_ids, amounts) pair of arrays
+        if (isinstance(trips_data, tuple) and len(trips_data) == 2
+                and all(hasattr(col, 'dtype') for col in trips_data)):
+            zone_ids, amounts = trips_data
+            return (np.ascontiguousarray(zone_ids, dtype=np.int64),
+                    np.ascontiguousarray(amounts, dtype=np.float64))
+        
+        # Otherwise pull the two columns out of the rows chunk by chunk
+        id_chunks = []
+        amount_chunks = []
+        rows = self.iter_rows(trips_data, chunk_size)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            id_chunks.append(np.fromiter(
+                (row[zone_key] for row in chunk), dtype=np.int64, count=len(chunk)
+            ))
+            amount_chunks.append(np.fromiter(
+                (row[amount_key] for row in chunk), dtype=np.float64, count=len(chunk)
+            ))
+        
+        if not id_chunks:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        return np.concatenate(id_chunks), np.concatenate(amount_chunks)
+    
+    def rank_arrays(self, zone_ids, amounts, limit=None, descending=True):
+        self.algorithm = 'NumPy argpartition'
+        if len(zone_ids) == 0 or (limit is not None and limit <= 0):
+            return []
+        if zone_ids.min() < 0:
+            raise ValueError("Zone IDs must be non-negative to use the numpy engine")
+        
+        # bincount adds the weights in input order, which is the same
+        # sequence of float additions the python dict loop does, so the
+        # totals come out bit-for-bit identical
+        counts = np.bincount(zone_ids)
+        totals = np.bincount(zone_ids, weights=amounts)
+        
+        zones = np.flatnonzero(counts)
+        keys = -totals[zones] if descending else totals[zones]
+        
+        # Keep everything up to (and tied with) the limit-th best total
+        candidates = np.arange(len(zones))
+        if limit is not None and limit < len(zones):
+            best = np.argpartition(keys, limit - 1)[:limit]
+            candidates = np.flatnonzero(keys <= keys[best].max())
+        
+        # Equal totals are ordered by first appearance in the input, like
+        # the python engine's dict insertion order
+        cand_keys = keys[candidates]
+        if len(np.unique(cand_keys)) < len(cand_keys):
+            first_seen = np.full(len(counts), len(zone_ids), dtype=np.int64)
+            np.minimum.at(first_seen, zone_ids, np.arange(len(zone_ids)))
+            order = np.lexsort((first_seen[zones[candidates]], cand_keys))
+        else:
+            order = np.argsort(cand_keys)
+        
+        ranked = candidates[order][:limit]
+        return [(int(zones[i]), float(totals[zones[i]])) for i in ranked]
+    
     def get_stats(self):
+        if self.algorithm == 'NumPy argpartition':
+            return {
+                'comparisons': self.comparisons,
+                'algorithm': self.algorithm,
+                'time_complexity_avg': 'O(n + z log k)',
+                'time_complexity_worst': 'O(n + z log z)',
+                'space_complexity': 'O(n + z)'
+            }
+        if self.algorithm == 'Heap top-K':
+            return {
+                'comparisons': self.comparisons,
+                'algorithm': self.algorithm,
+                'time_complexity_avg': 'O(n log k)',
+                'time_complexity_worst': 'O(n log k)',
+                'space_complexity': 'O(k)'
+            }
         return {
             'comparisons': self.comparisons,
             'algorithm': 'QuickSort',
@@ -92,4 +440,13 @@ if __name__ == "__main__":
     print(f"\nAlgorithm Stats:")
     stats = ranker.get_stats()
     for key, value in stats.items():
-        print(f"  {key}: {value}")
\ No newline at end of file
+        print(f"  {key}: {value}")
+    
+    # Same ranking but only keeping the best 2 zones
+    top_ranker = TaxiZoneRanker()
+    top_zones = top_ranker.rank_zones_by_revenue(test_trips, limit=2)
+    
+    print("\nTop 2 Zones (heap top-K):")
+    for zone_id, revenue in top_zones:
+        print(f"  Zone {zone_id}: ${revenue:.2f}")
+    print(f"  comparisons: {top_ranker.get_stats()['comparisons']}")
\ No newline at end of file
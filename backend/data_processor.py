@@ -1,22 +1,332 @@
+import numpy as np
 import pandas as pd
+import argparse
 import json
+import os
+import shutil
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet output is optional, CSV always works
+    pa = None
+    pq = None
+
+TRIP_FILES = ['../data/yellow_tripdata_2019-01.csv']
+ZONE_FILE = '../data/taxi_zone_lookup.csv'
+OUTPUT_FILE = 'processed_trips.csv'
+PARQUET_DIR = 'processed_trips'  # Parquet dataset, one folder per pickup date
+OUTPUT_FORMATS = ('parquet', 'csv')
+
+# Timestamp layout of the TLC files and of our output
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+DUPLICATES_RULE = "Duplicates removed"
+
+# Cleaning rules, applied in this order. A rule either keeps the rows
+# where every [column, op, value] condition in 'keep' holds, or, with
+# 'unique', drops repeats of the 'unique' columns (null: every column of
+# the trip file). Each rule's count in the cleaning log is what it
+# removed from the rows the earlier rules kept. duration_minutes is
+# worked out before any rule runs. Pass --rules with a JSON file of the
+# same shape to change them.
+
+CLEANING_RULES = [
+    {'rule': DUPLICATES_RULE, 'unique': None},
+    {'rule': "Missing location IDs removed",
+     'keep': [['PULocationID', 'notnull'], ['DOLocationID', 'notnull']]},
+    {'rule': "Invalid fares (zero or negative) removed",
+     'keep': [['fare_amount', '>', 0]]},
+    {'rule': "Zero distance trips removed",
+     'keep': [['trip_distance', '>', 0]]},
+    {'rule': "Trips over 100 miles removed",
+     'keep': [['trip_distance', '<', 100]]},
+    {'rule': "Negative/zero duration trips removed",
+     'keep': [['duration_minutes', '>', 0]]},
+    {'rule': "Trips over 3 hours removed",
+     'keep': [['duration_minutes', '<', 180]]},
+    {'rule': "Invalid passenger count removed",
+     'keep': [['passenger_count', '>', 0], ['passenger_count', '<=', 6]]},
+]
+
+# Comparisons are False for a missing value, so those rows are dropped
+RULE_OPS = {
+    '>': lambda column, value: column > value,
+    '>=': lambda column, value: column >= value,
+    '<': lambda column, value: column < value,
+    '<=': lambda column, value: column <= value,
+    '==': lambda column, value: column == value,
+    '!=': lambda column, value: column.notna() & (column != value),
+    'notnull': lambda column: column.notna(),
+}
+
+def load_rules(path):
+    with open(path) as f:
+        rules = json.load(f)
+    for rule in rules:
+        if 'rule' not in rule or ('keep' in rule) == ('unique' in rule):
+            raise ValueError(f"Rule needs a name and one of 'keep' or 'unique': {rule}")
+        for condition in rule.get('keep', []):
+            arity = 2 if len(condition) > 1 and condition[1] == 'notnull' else 3
+            if len(condition) != arity or condition[1] not in RULE_OPS:
+                raise ValueError(f"Bad condition {condition} in {rule['rule']!r}: expected "
+                                 f"[column, op, value] or [column, 'notnull'], "
+                                 f"ops are {', '.join(RULE_OPS)}")
+    return rules
+
+def keep_mask(frame, conditions):
+    # True for the rows meeting every condition. Nullable (compact mode)
+    # columns compare to NA, which counts as not meeting it.
+    mask = None
+    for column, op, *value in conditions:
+        passes = RULE_OPS[op](frame[column], *value)
+        if passes.dtype != bool:
+            passes = passes.fillna(False).astype(bool)
+        mask = passes if mask is None else mask & passes
+    return mask
+
+# Columns integrate_data adds. They follow from the location IDs, so
+# duplicate checks on whole rows leave them out.
+JOINED_COLUMNS = ['pickup_borough', 'pickup_zone', 'dropoff_borough', 'dropoff_zone']
+
+def duplicates_rule(rules):
+    return next((rule for rule in rules if 'unique' in rule), None)
+
+def duplicate_hashes(frame, key):
+    # One 64-bit hash per row of the key columns; rows with equal hashes
+    # count as duplicates, so a collision would drop a row (about 1 in
+    # 10^19 per pair of rows)
+    return pd.util.hash_pandas_object(frame[key], index=False)
+
+def seen_before(seen, hashes):
+    # Which hashes are in seen, a sorted uint64 array
+    positions = np.searchsorted(seen, hashes)
+    found = positions < len(seen)
+    found[found] = seen[positions[found]] == hashes[found]
+    return found
+
+def add_seen(seen, hashes):
+    # Both sorted, so the stable sort (timsort) only merges two runs
+    return np.sort(np.concatenate([seen, np.sort(hashes)]), kind='stable')
+
+OUTPUT_COLUMNS = [
+    'pickup_datetime',
+    'dropoff_datetime',
+    'passenger_count',
+    'trip_distance',
+    'PULocationID',
+    'DOLocationID',
+    'payment_type',
+    'payment_label',
+    'fare_amount',
+    'tip_amount',
+    'total_amount',
+    'duration_minutes',
+    'speed_mph',
+    'revenue_per_mile',
+    'is_rush_hour',
+    'pickup_hour',
+    'pickup_day_num',
+    'pickup_borough',
+    'pickup_zone',
+    'dropoff_borough',
+    'dropoff_zone'
+]
+
+# Narrow types for the raw TLC columns, used by the compact (memory
+# optimized) mode. Nullable ints so a missing value doesn't fail the load.
+# The amounts that end up in the output stay float64: float32 only holds
+# cents exactly below 2^17 (131,072), and the TLC files have totals above
+# that (np.float32(623259.86) reads back as 623259.88).
+COMPACT_DTYPES = {
+    'VendorID': 'Int8',
+    'passenger_count': 'Int8',
+    'trip_distance': 'float32',
+    'RatecodeID': 'Int8',
+    'store_and_fwd_flag': 'category',
+    'PULocationID': 'Int16',
+    'DOLocationID': 'Int16',
+    'payment_type': 'Int8',
+    'fare_amount': 'float64',
+    'extra': 'float32',
+    'mta_tax': 'float32',
+    'tip_amount': 'float64',
+    'tolls_amount': 'float32',
+    'improvement_surcharge': 'float32',
+    'total_amount': 'float64',
+    'congestion_surcharge': 'float32'
+}
+
+# Types for the raw TLC columns when run_chunked reads a file in chunks.
+# Left to itself read_csv infers them per chunk: a chunk with one blank
+# passenger_count reads the column as float64, and its rows then hash
+# differently from the same rows in other chunks. Nullable ints keep
+# blanks without changing type.
+CHUNK_DTYPES = {
+    'VendorID': 'Int64',
+    'tpep_pickup_datetime': 'str',
+    'tpep_dropoff_datetime': 'str',
+    'passenger_count': 'Int64',
+    'trip_distance': 'float64',
+    'RatecodeID': 'Int64',
+    'store_and_fwd_flag': 'str',
+    'PULocationID': 'Int64',
+    'DOLocationID': 'Int64',
+    'payment_type': 'Int64',
+    'fare_amount': 'float64',
+    'extra': 'float64',
+    'mta_tax': 'float64',
+    'tip_amount': 'float64',
+    'tolls_amount': 'float64',
+    'improvement_surcharge': 'float64',
+    'total_amount': 'float64',
+    'congestion_surcharge': 'float64'
+}
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+# Narrow types for the Parquet output (text columns become dictionary
+# encoded categoricals)
+PARQUET_DTYPES = {
+    'passenger_count': 'Int8',
+    'PULocationID': 'int16',
+    'DOLocationID': 'int16',
+    'payment_type': 'Int8',
+    'payment_label': 'category',
+    'is_rush_hour': 'int8',
+    'pickup_hour': 'int8',
+    'pickup_day_num': 'int8',
+    'pickup_borough': 'category',
+    'pickup_zone': 'category',
+    'dropoff_borough': 'category',
+    'dropoff_zone': 'category'
+}
+
+def parquet_frame(frame):
+    frame = frame.astype(PARQUET_DTYPES)
+    for column in ['pickup_datetime', 'dropoff_datetime']:
+        frame[column] = frame[column].astype('datetime64[s]')
+    frame['pickup_date'] = frame['pickup_datetime'].dt.strftime('%Y-%m-%d')
+    return frame
+
+def write_parquet(frame, part=0):
+    table = pa.Table.from_pandas(parquet_frame(frame), preserve_index=False)
+    pq.write_to_dataset(
+        table,
+        PARQUET_DIR,
+        partition_cols=['pickup_date'],
+        basename_template=f'part-{part:05d}-{{i}}.parquet',
+        existing_data_behavior='overwrite_or_ignore'
+    )
+
+# Zone join by array lookup. LocationIDs are small integers, so each name
+# column is an array of category codes indexed by the ID itself, and the
+# join is one gather per trip column instead of a merge of the frame.
+
+class ZoneLookup:
+    
+    def __init__(self, zones):
+        ids = zones['LocationID'].to_numpy()
+        self.known = np.zeros(int(ids.max()) + 1, dtype=bool)
+        self.known[ids] = True
+        self.columns = {}
+        for column in ['Borough', 'Zone']:
+            names = zones[column].astype('category')
+            codes = np.full(len(self.known), -1, dtype=np.int16)
+            codes[ids] = names.cat.codes.to_numpy()
+            self.columns[column] = (codes, names.cat.categories)
+    
+    def positions(self, location_ids):
+        # Array positions for the IDs, and which IDs are in the lookup
+        ids = location_ids.to_numpy(dtype='float64', na_value=np.nan)
+        known = np.zeros(len(ids), dtype=bool)
+        in_range = (ids >= 0) & (ids < len(self.known))
+        positions = np.where(in_range, ids, 0).astype(np.intp)
+        known[in_range] = self.known[positions[in_range]]
+        return positions, known
+    
+    def names(self, column, positions, known):
+        codes, categories = self.columns[column]
+        return pd.Categorical.from_codes(np.where(known, codes[positions], -1), categories)
+
+# Read processed trips back for analysis. Only the requested columns are
+# read, and start/end ('YYYY-MM-DD', inclusive) skip whole date folders.
+
+def read_processed(columns=None, start=None, end=None):
+    filters = []
+    if start:
+        filters.append(('pickup_date', '>=', start))
+    if end:
+        filters.append(('pickup_date', '<=', end))
+    return pd.read_parquet(PARQUET_DIR, columns=columns, filters=filters or None)
+
+def format_unknown(unknown_zones):
+    return ', '.join(f"{location_id} ({count:,} trips)"
+                     for location_id, count in sorted(unknown_zones.items()))
 
 class DataProcessor:
     
-    def __init__(self):
+    def __init__(self, verbose=True, compact=False, memory_report=None, rules=None):
         self.trips = None
         self.zones = None
         self.geojson = None
         self.cleaning_log = []
+        self.cleaning_counts = {}
+        self.unknown_zones = {}
+        self.verbose = verbose
+        
+        # compact: narrow dtypes and categorical zone names throughout
+        self.compact = compact
+        self.memory_report = compact if memory_report is None else memory_report
+        self.memory_log = []
+        self.rules = CLEANING_RULES if rules is None else rules
+    
+    def log(self, message):
+        if self.verbose:
+            print(message)
+    
+    def track_memory(self, stage):
+        if not self.memory_report or self.trips is None:
+            return
+        frame_mb = self.trips.memory_usage(deep=True).sum() / 1024 ** 2
+        rss_mb = peak_rss_mb()
+        self.memory_log.append((stage, frame_mb, rss_mb))
+        rss = f", peak RSS {rss_mb:,.0f} MB" if rss_mb is not None else ""
+        self.log(f"Memory after {stage}: trips {frame_mb:,.1f} MB{rss}")
+    
+    def read_trips(self, path, **kwargs):
+        if self.compact:
+            kwargs['dtype'] = COMPACT_DTYPES
+        return pd.read_csv(path, **kwargs)
+    
+    def record_removed(self, rule, count):
+        self.cleaning_counts[rule] = self.cleaning_counts.get(rule, 0) + count
+        self.cleaning_log.append(f"{rule}: {count}")
     
     # Load data files
 
-    def load_data(self):
+    def load_data(self, trip_files=None):
         print("Loading csv trip data...")
-        self.trips = pd.read_csv('../data/yellow_tripdata_2019-01.csv')
+        trip_files = trip_files or TRIP_FILES
+        self.trips = pd.concat(
+            [self.read_trips(path) for path in trip_files],
+            ignore_index=True
+        )
         
-        print("Loading zone lookup CSV...")
-        self.zones = pd.read_csv('../data/taxi_zone_lookup.csv')
+        self.load_zones()
         
         print("Loading GeoJSON spatial data...")
         try:
@@ -29,132 +339,104 @@ class DataProcessor:
         
         print(f"Trips loaded: {len(self.trips)}")
         print(f"Zones loaded: {len(self.zones)}")
+        self.track_memory('load_data')
+    
+    def load_zones(self):
+        print("Loading zone lookup CSV...")
+        self.zones = pd.read_csv(ZONE_FILE)
+        if self.compact:
+            # Joined names become categoricals: one small code per trip
+            # instead of a Python string object
+            self.zones['Borough'] = self.zones['Borough'].astype('category')
+            self.zones['Zone'] = self.zones['Zone'].astype('category')
     
     
     # Connect locationIDs to zone names
 
     def integrate_data(self):
-        print("\nJoining trip data with zone metadata...")
+        self.log("\nJoining trip data with zone metadata...")
         
-        # Join pickup zone info
-
-        self.trips = self.trips.merge(
-            self.zones[['LocationID', 'Borough', 'Zone']],
-            left_on='PULocationID',
-            right_on='LocationID',
-            how='left'
-        )
-
-        # Rename so we know these are pickup columns
-
-        self.trips.rename(columns={
-            'Borough': 'pickup_borough',
-            'Zone': 'pickup_zone'
-        }, inplace=True)
-        self.trips.drop('LocationID', axis=1, inplace=True)
+        # Names come out as categoricals; IDs the lookup doesn't have get
+        # no names (like the left join did) and are counted per ID
+        lookup = ZoneLookup(self.zones)
+        for side, id_column in [('pickup', 'PULocationID'), ('dropoff', 'DOLocationID')]:
+            positions, known = lookup.positions(self.trips[id_column])
+            self.trips[f'{side}_borough'] = lookup.names('Borough', positions, known)
+            self.trips[f'{side}_zone'] = lookup.names('Zone', positions, known)
+            
+            unknown = self.trips[id_column][~known].dropna()
+            for location_id, count in unknown.value_counts().items():
+                self.unknown_zones[int(location_id)] = (
+                    self.unknown_zones.get(int(location_id), 0) + int(count))
         
-        # Join dropoff zone info
-
-        self.trips = self.trips.merge(
-            self.zones[['LocationID', 'Borough', 'Zone']],
-            left_on='DOLocationID',
-            right_on='LocationID',
-            how='left'
-        )
-        self.trips.rename(columns={
-            'Borough': 'dropoff_borough',
-            'Zone': 'dropoff_zone'
-        }, inplace=True)
-        self.trips.drop('LocationID', axis=1, inplace=True)
-        
-        print("Zone data joined successfully")
+        if self.unknown_zones:
+            self.log(f"Location IDs not in the zone lookup: {format_unknown(self.unknown_zones)}")
+        self.log("Zone data joined successfully")
+        self.track_memory('integrate_data')
     
     # Data cleaning (remove anything the doesn't make sense)
 
-    def clean_data(self):
-        print("\nCleaning data...")
+    def clean_data(self, drop_duplicates=True):
+        self.log("\nCleaning data...")
         original = len(self.trips)
+        columns = [column for column in self.trips.columns if column not in JOINED_COLUMNS]
 
-        before = len(self.trips)
-        self.trips = self.trips.drop_duplicates()
-        self.cleaning_log.append(
-            f"Duplicates removed: {before - len(self.trips)}"
-        )
-
-        before = len(self.trips)
-        self.trips = self.trips.dropna(
-            subset=['PULocationID', 'DOLocationID']
-        )
-        self.cleaning_log.append(
-            f"Missing location IDs removed: {before - len(self.trips)}"
-        )
-    
-        before = len(self.trips)
-        self.trips = self.trips[self.trips['fare_amount'] > 0]
-        self.cleaning_log.append(
-            f"Invalid fares (zero or negative) removed: {before - len(self.trips)}"
-        )
-
-        before = len(self.trips)
-        self.trips = self.trips[self.trips['trip_distance'] > 0]
-        self.cleaning_log.append(
-            f"Zero distance trips removed: {before - len(self.trips)}"
-        )
-
-        before = len(self.trips)
-        self.trips = self.trips[self.trips['trip_distance'] < 100]
-        self.cleaning_log.append(
-            f"Trips over 100 miles removed: {before - len(self.trips)}"
-        )
-
+        self.parse_datetimes()
         self.trips['duration_minutes'] = (
-            pd.to_datetime(self.trips['tpep_dropoff_datetime']) -
-            pd.to_datetime(self.trips['tpep_pickup_datetime'])
+            self.trips['tpep_dropoff_datetime'] -
+            self.trips['tpep_pickup_datetime']
         ).dt.total_seconds() / 60
 
-        before = len(self.trips)
-        self.trips = self.trips[self.trips['duration_minutes'] > 0]
-        self.cleaning_log.append(
-            f"Negative/zero duration trips removed: {before - len(self.trips)}"
-        )
+        # Every rule becomes a boolean mask over the whole frame, and rows
+        # only get copied once, at the end. A rule's count covers the rows
+        # still kept when it runs, like filtering one rule at a time would.
+        kept = pd.Series(True, index=self.trips.index)
+        for rule in self.rules:
+            if 'unique' in rule:
+                # The chunked pipeline removes duplicates itself across chunks
+                if not drop_duplicates:
+                    continue
+                # First of each key among the rows still kept
+                hashes = duplicate_hashes(self.trips, rule['unique'] or columns)[kept]
+                passes = ~hashes.duplicated().reindex(self.trips.index, fill_value=True)
+            else:
+                passes = keep_mask(self.trips, rule['keep'])
+            removed = kept & ~passes
+            self.record_removed(rule['rule'], int(removed.sum()))
+            kept &= passes
 
-        before = len(self.trips)
-        self.trips = self.trips[self.trips['duration_minutes'] < 180]
-        self.cleaning_log.append(
-            f"Trips over 3 hours removed: {before - len(self.trips)}"
-        )
-
-        before = len(self.trips)
-        self.trips = self.trips[
-            (self.trips['passenger_count'] > 0) &
-            (self.trips['passenger_count'] <= 6)
-        ]
-        self.cleaning_log.append(
-            f"Invalid passenger count removed: {before - len(self.trips)}"
-        )
+        self.trips = self.trips[kept]
         
-        print(f"Original records: {original}")
-        print(f"After cleaning: {len(self.trips)}")
-        print(f"Total removed: {original - len(self.trips)}")
+        self.log(f"Original records: {original}")
+        self.log(f"After cleaning: {len(self.trips)}")
+        self.log(f"Total removed: {original - len(self.trips)}")
+        self.track_memory('clean_data')
     
     
+    # Parse the raw timestamps once, every later stage uses the
+    # datetime64 columns and strings are only produced when saving
+
+    def parse_datetimes(self):
+        for column in ['tpep_pickup_datetime', 'tpep_dropoff_datetime']:
+            if not pd.api.types.is_datetime64_any_dtype(self.trips[column]):
+                self.trips[column] = pd.to_datetime(
+                    self.trips[column], format=DATETIME_FORMAT
+                )
+    
     # Normalization
 
     def normalize_data(self):
-        print("\nNormalizing data...")
+        self.log("\nNormalizing data...")
 
-        self.trips['pickup_datetime'] = pd.to_datetime(
-            self.trips['tpep_pickup_datetime']
-        ).dt.strftime('%Y-%m-%d %H:%M:%S')
-        
-        self.trips['dropoff_datetime'] = pd.to_datetime(
-            self.trips['tpep_dropoff_datetime']
-        ).dt.strftime('%Y-%m-%d %H:%M:%S')
+        self.parse_datetimes()
+        self.trips['pickup_datetime'] = self.trips['tpep_pickup_datetime']
+        self.trips['dropoff_datetime'] = self.trips['tpep_dropoff_datetime']
 
-        self.trips['fare_amount']  = self.trips['fare_amount'].round(2)
-        self.trips['tip_amount']   = self.trips['tip_amount'].round(2)
-        self.trips['total_amount'] = self.trips['total_amount'].round(2)
-        self.trips['trip_distance'] = self.trips['trip_distance'].round(2)
+        # Compact mode reads trip_distance as float32. Widening and
+        # rounding to hundredths gives back the float64 value for anything
+        # under 2^17 miles, so derived features match the default mode.
+        for column in ['fare_amount', 'tip_amount', 'total_amount', 'trip_distance']:
+            self.trips[column] = self.trips[column].astype('float64').round(2)
 
         payment_map = {
             1: 'Credit Card',
@@ -166,13 +448,17 @@ class DataProcessor:
         }
         self.trips['payment_label'] = self.trips['payment_type'].map(payment_map)
 
-        self.trips['PULocationID'] = self.trips['PULocationID'].astype(int)
-        self.trips['DOLocationID'] = self.trips['DOLocationID'].astype(int)
+        id_dtype = 'int16' if self.compact else int
+        self.trips['PULocationID'] = self.trips['PULocationID'].astype(id_dtype)
+        self.trips['DOLocationID'] = self.trips['DOLocationID'].astype(id_dtype)
+        if self.compact:
+            self.trips['payment_label'] = self.trips['payment_label'].astype('category')
         
-        print("Normalization done")
+        self.log("Normalization done")
+        self.track_memory('normalize_data')
 
     def create_features(self):
-        print("\nCreating derived features...")
+        self.log("\nCreating derived features...")
         
         self.trips['speed_mph'] = (
             self.trips['trip_distance'] /
@@ -184,67 +470,201 @@ class DataProcessor:
             self.trips['trip_distance']
         ).round(2)
         
-        hour = pd.to_datetime(self.trips['pickup_datetime']).dt.hour
-        day  = pd.to_datetime(self.trips['pickup_datetime']).dt.dayofweek
+        hour = self.trips['pickup_datetime'].dt.hour
+        day  = self.trips['pickup_datetime'].dt.dayofweek
         
         self.trips['is_rush_hour'] = (
             ((hour >= 7) & (hour < 9)) |
             ((hour >= 17) & (hour < 19))
         ) & (day < 5)
         
-        self.trips['is_rush_hour'] = self.trips['is_rush_hour'].astype(int)
+        small_int = 'int8' if self.compact else int
+        self.trips['is_rush_hour'] = self.trips['is_rush_hour'].astype(small_int)
         
-        self.trips['pickup_hour']    = hour
-        self.trips['pickup_day_num'] = day
+        self.trips['pickup_hour']    = hour.astype(small_int) if self.compact else hour
+        self.trips['pickup_day_num'] = day.astype(small_int) if self.compact else day
         
-        print("Features created: speed_mph, revenue_per_mile, is_rush_hour")
+        self.log("Features created: speed_mph, revenue_per_mile, is_rush_hour")
+        self.track_memory('create_features')
     
-    def save_outputs(self):
-        print("\nSaving outputs...")
-        
+    def save_cleaning_log(self):
         with open('cleaning_log.txt', 'w') as f:
             f.write("DATA CLEANING LOG\n")
             f.write("=" * 40 + "\n\n")
             for entry in self.cleaning_log:
                 f.write(f"- {entry}\n")
         print("Cleaning log saved: cleaning_log.txt")
+    
+    def output_frame(self):
+        return self.trips[OUTPUT_COLUMNS]
+    
+    def reset_output(self, output_format):
+        if output_format == 'parquet':
+            if pa is None:
+                raise ImportError("Parquet output needs pyarrow installed")
+            shutil.rmtree(PARQUET_DIR, ignore_errors=True)
+        elif os.path.exists(OUTPUT_FILE):
+            os.remove(OUTPUT_FILE)
+    
+    def write_part(self, frame, part, output_format):
+        if output_format == 'parquet':
+            write_parquet(frame, part)
+        else:
+            frame.to_csv(
+                OUTPUT_FILE,
+                mode='w' if part == 0 else 'a',
+                header=part == 0,
+                index=False,
+                date_format=DATETIME_FORMAT
+            )
+    
+    def output_path(self, output_format):
+        return PARQUET_DIR if output_format == 'parquet' else OUTPUT_FILE
+    
+    def save_outputs(self, output_format='parquet'):
+        print("\nSaving outputs...")
+        
+        self.save_cleaning_log()
+        
+        self.reset_output(output_format)
+        self.write_part(self.output_frame(), 0, output_format)
+        print(f"Processed trips saved: {self.output_path(output_format)}")
+    
+    # Chunked pipeline: stream the CSVs and run the per-row stages on a
+    # process pool, so memory depends on chunksize (plus 8 bytes per kept
+    # row of the current file for duplicate detection) rather than file size
+
+    def run_chunked(self, trip_files=None, chunksize=250_000, workers=None,
+                    output_format='parquet'):
+        trip_files = trip_files or TRIP_FILES
+        workers = workers or os.cpu_count() or 1
+        self.load_zones()
+        self.reset_output(output_format)
+        
+        # Exact duplicates are found here, before the chunks are farmed
+        # out, so rows repeated across chunks of a file are caught too.
+        # The hashes of a file's kept rows are held in one sorted uint64
+        # array, 8 bytes per row (about 56 MB for a 7M-trip month).
+        # Keep the duplicates rule first so the log order matches clean_data
+        # (which is also where clean_data runs it with the default rules).
+        dedupe = duplicates_rule(self.rules)
+        self.cleaning_counts = {dedupe['rule']: 0} if dedupe else {}
+        original = 0
+        kept = 0
+        written = 0
+        
+        def write(future):
+            nonlocal kept, written
+            frame, counts, unknown_zones = future.result()
+            for rule, count in counts.items():
+                self.cleaning_counts[rule] = self.cleaning_counts.get(rule, 0) + count
+            for location_id, count in unknown_zones.items():
+                self.unknown_zones[location_id] = self.unknown_zones.get(location_id, 0) + count
+            self.write_part(frame, written, output_format)
+            kept += len(frame)
+            written += 1
         
-        columns_to_keep = [
-            'pickup_datetime',
-            'dropoff_datetime',
-            'passenger_count',
-            'trip_distance',
-            'PULocationID',
-            'DOLocationID',
-            'payment_type',
-            'payment_label',
-            'fare_amount',
-            'tip_amount',
-            'total_amount',
-            'duration_minutes',
-            'speed_mph',
-            'revenue_per_mile',
-            'is_rush_hour',
-            'pickup_hour',
-            'pickup_day_num',
-            'pickup_borough',
-            'pickup_zone',
-            'dropoff_borough',
-            'dropoff_zone'
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker,
+                                 initargs=(self.zones, self.compact, self.rules)) as pool:
+            
+            # Bounded queue of in-flight chunks, written back in order
+            pending = deque()
+            
+            for path in trip_files:
+                print(f"Processing {path} in chunks of {chunksize:,}...")
+                seen = np.empty(0, dtype=np.uint64)
+                
+                for chunk in self.read_trips(path, chunksize=chunksize, dtype=CHUNK_DTYPES):
+                    original += len(chunk)
+                    if dedupe:
+                        hashes = duplicate_hashes(chunk, dedupe['unique'] or list(chunk.columns))
+                        duplicate = (hashes.duplicated().to_numpy()
+                                     | seen_before(seen, hashes.to_numpy()))
+                        seen = add_seen(seen, hashes.to_numpy()[~duplicate])
+                        self.cleaning_counts[dedupe['rule']] += int(duplicate.sum())
+                        chunk = chunk[~duplicate]
+                    
+                    pending.append(pool.submit(_process_chunk, chunk))
+                    if len(pending) >= 2 * workers:
+                        write(pending.popleft())
+                        print(f"  {original:,} rows read, {kept:,} kept...")
+            
+            while pending:
+                write(pending.popleft())
+        
+        self.cleaning_log = [
+            f"{rule}: {count}" for rule, count in self.cleaning_counts.items()
         ]
+        self.save_cleaning_log()
         
-        self.trips[columns_to_keep].to_csv(
-            'processed_trips.csv',
-            index=False
-        )
-        print("Processed trips saved: processed_trips.csv")
+        print(f"Original records: {original}")
+        print(f"After cleaning: {kept}")
+        print(f"Total removed: {original - kept}")
+        if self.unknown_zones:
+            print(f"Location IDs not in the zone lookup: {format_unknown(self.unknown_zones)}")
+        print(f"Processed trips saved: {self.output_path(output_format)}")
 
-if __name__ == "__main__":
-    processor = DataProcessor()
-    processor.load_data()
+# Worker side of run_chunked, module level so the pool can pickle them
+
+_worker_zones = None
+_worker_compact = False
+_worker_rules = None
+
+def _init_worker(zones, compact, rules):
+    global _worker_zones, _worker_compact, _worker_rules
+    _worker_zones = zones
+    _worker_compact = compact
+    _worker_rules = rules
+
+def _process_chunk(chunk):
+    processor = DataProcessor(verbose=False, compact=_worker_compact,
+                              memory_report=False, rules=_worker_rules)
+    processor.trips = chunk
+    processor.zones = _worker_zones
     processor.integrate_data()
-    processor.clean_data()
+    processor.clean_data(drop_duplicates=False)
     processor.normalize_data()
     processor.create_features()
-    processor.save_outputs()
-    print("\nData processing complete!")
\ No newline at end of file
+    return processor.output_frame(), processor.cleaning_counts, processor.unknown_zones
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Clean and enrich NYC taxi trips')
+    parser.add_argument('trip_files', nargs='*',
+                        help='monthly trip CSVs (default: %(default)s)',
+                        default=TRIP_FILES)
+    parser.add_argument('--chunked', action='store_true',
+                        help='stream the CSVs in chunks across a process pool')
+    parser.add_argument('--chunksize', type=int, default=250_000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='parquet',
+                        help='partitioned Parquet dataset or a single CSV')
+    parser.add_argument('--compact', action='store_true',
+                        help='narrow dtypes and categorical zones to cut memory')
+    parser.add_argument('--memory-report', action='store_true',
+                        help='print trip frame size and peak RSS after each stage')
+    parser.add_argument('--rules', default=None,
+                        help='JSON file of cleaning rules to use instead of '
+                             'CLEANING_RULES (same shape)')
+    args = parser.parse_args()
+    
+    processor = DataProcessor(compact=args.compact,
+                              memory_report=args.compact or args.memory_report,
+                              rules=load_rules(args.rules) if args.rules else None)
+    if args.chunked:
+        processor.run_chunked(args.trip_files, args.chunksize, args.workers,
+                              args.format)
+    else:
+        processor.load_data(args.trip_files)
+        processor.integrate_data()
+        processor.clean_data()
+        processor.normalize_data()
+        processor.create_features()
+        processor.save_outputs(args.format)
+    
+    if processor.memory_log:
+        print("\nMemory by stage (MB):")
+        for stage, frame_mb, rss_mb in processor.memory_log:
+            rss = f"{rss_mb:>10,.0f}" if rss_mb is not None else f"{'n/a':>10}"
+            print(f"  {stage:<18}{frame_mb:>10,.1f}{rss}")
+    print("\nData processing complete!")
@@ -1,15 +1,45 @@
 import sqlite3
+import argparse
+import calendar
 import csv
+import hashlib
+import os
+import time
+
+import columnar
+import shards
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+except ImportError:  # Only needed to load the Parquet output
+    pa = None
 
 DB_PATH = 'nyc_taxi.db'
+TRIPS_CSV = 'processed_trips.csv'
+TRIPS_PARQUET = 'processed_trips'  # Dataset folder written by data_processor.py
 
-# Database design and triple quotations to make it neat
+# Full rebuilds drop everything first, incremental ingests only create
+# whatever is missing
 
-SCHEMA = """   
+DROP_TABLES = """
+DROP TABLE IF EXISTS db_meta;
+DROP TABLE IF EXISTS ingested_files;
+DROP TABLE IF EXISTS payment_rollup;
+DROP TABLE IF EXISTS trip_rollup;
+DROP TABLE IF EXISTS zone_revenue;
 DROP TABLE IF EXISTS trips;
+DROP TABLE IF EXISTS payment_types;
+DROP TABLE IF EXISTS boroughs;
 DROP TABLE IF EXISTS zones;
+"""
+
+# Database design and triple quotations to make it neat
+
+TABLES = """
 
-CREATE TABLE zones (
+CREATE TABLE IF NOT EXISTS zones (
     LocationID   INTEGER  NOT NULL,
     Borough      TEXT     NOT NULL,
     Zone         TEXT     NOT NULL,
@@ -18,29 +48,47 @@ CREATE TABLE zones (
     CONSTRAINT pk_zones PRIMARY KEY (LocationID)
 );
 
-CREATE TABLE trips (
-    trip_id          INTEGER  NOT NULL,
-    pickup_datetime  TEXT     NOT NULL,
-    dropoff_datetime TEXT     NOT NULL,
-    passenger_count  INTEGER,
-    trip_distance    REAL     NOT NULL,
-    PULocationID     INTEGER  NOT NULL,
-    DOLocationID     INTEGER  NOT NULL,
-    payment_type     INTEGER,
-    payment_label    TEXT,
-    fare_amount      REAL     NOT NULL,
-    tip_amount       REAL,
-    total_amount     REAL     NOT NULL,
-    duration_minutes REAL     NOT NULL,
-    speed_mph        REAL,
-    revenue_per_mile REAL,
-    is_rush_hour     INTEGER  DEFAULT 0,
-    pickup_hour      INTEGER,
-    pickup_day_num   INTEGER,
-    pickup_borough   TEXT,
-    pickup_zone      TEXT,
-    dropoff_borough  TEXT,
-    dropoff_zone     TEXT,
+CREATE TABLE IF NOT EXISTS boroughs (
+    borough_id INTEGER  NOT NULL,
+    Borough    TEXT     NOT NULL,
+
+    CONSTRAINT pk_boroughs PRIMARY KEY (borough_id),
+    CONSTRAINT uq_borough UNIQUE (Borough)
+);
+
+CREATE TABLE IF NOT EXISTS payment_types (
+    payment_type INTEGER  NOT NULL,
+    label        TEXT     NOT NULL,
+
+    CONSTRAINT pk_payment_types PRIMARY KEY (payment_type)
+);
+
+-- Trips hold integer keys only: zone, borough and payment names live in
+-- the lookup tables above and are joined in when a response needs them.
+-- Timestamps are the recorded (NYC local) time as seconds since
+-- 1970-01-01, so datetime(pickup_datetime, 'unixepoch') gives the
+-- original text back. pickup_borough_id copies the pickup zone's borough
+-- so the borough filter can use an index.
+
+CREATE TABLE IF NOT EXISTS trips (
+    trip_id           INTEGER  NOT NULL,
+    pickup_datetime   INTEGER  NOT NULL,
+    dropoff_datetime  INTEGER  NOT NULL,
+    passenger_count   INTEGER,
+    trip_distance     REAL     NOT NULL,
+    PULocationID      INTEGER  NOT NULL,
+    DOLocationID      INTEGER  NOT NULL,
+    payment_type      INTEGER,
+    fare_amount       REAL     NOT NULL,
+    tip_amount        REAL,
+    total_amount      REAL     NOT NULL,
+    duration_minutes  REAL     NOT NULL,
+    speed_mph         REAL,
+    revenue_per_mile  REAL,
+    is_rush_hour      INTEGER  DEFAULT 0,
+    pickup_hour       INTEGER,
+    pickup_day_num    INTEGER,
+    pickup_borough_id INTEGER,
 
     CONSTRAINT pk_trips
         PRIMARY KEY (trip_id AUTOINCREMENT),
@@ -53,6 +101,10 @@ CREATE TABLE trips (
         FOREIGN KEY (DOLocationID)
         REFERENCES zones (LocationID),
 
+    CONSTRAINT fk_pickup_borough
+        FOREIGN KEY (pickup_borough_id)
+        REFERENCES boroughs (borough_id),
+
     CONSTRAINT chk_distance
         CHECK (trip_distance > 0),
 
@@ -66,33 +118,428 @@ CREATE TABLE trips (
         CHECK (is_rush_hour IN (0, 1))
 );
 
-CREATE INDEX idx_pickup_zone
-    ON trips (PULocationID);
+-- Revenue per pickup zone, kept current as trips are loaded so that
+-- /api/top-zones only has to rank ~265 rows instead of every trip
 
-CREATE INDEX idx_dropoff_zone
-    ON trips (DOLocationID);
+CREATE TABLE IF NOT EXISTS zone_revenue (
+    PULocationID  INTEGER  NOT NULL,
+    trip_count    INTEGER  NOT NULL DEFAULT 0,
+    total_revenue REAL     NOT NULL DEFAULT 0,
 
-CREATE INDEX idx_pickup_datetime
-    ON trips (pickup_datetime);
+    CONSTRAINT pk_zone_revenue PRIMARY KEY (PULocationID)
+);
+
+-- Hourly rollups for the summary endpoints: one row per pickup date, hour
+-- and zone (and per payment type), so any hour-aligned date range is
+-- answered without touching trips. Sums rather than averages so rows can
+-- be added up across any range.
 
-CREATE INDEX idx_pickup_hour
-    ON trips (pickup_hour);
+CREATE TABLE IF NOT EXISTS trip_rollup (
+    pickup_date   TEXT     NOT NULL,
+    pickup_hour   INTEGER  NOT NULL,
+    PULocationID  INTEGER  NOT NULL,
+    trip_count    INTEGER  NOT NULL DEFAULT 0,
+    rush_trips    INTEGER  NOT NULL DEFAULT 0,
+    sum_fare      REAL     NOT NULL DEFAULT 0,
+    sum_tip       REAL     NOT NULL DEFAULT 0,
+    sum_distance  REAL     NOT NULL DEFAULT 0,
+    sum_speed     REAL     NOT NULL DEFAULT 0,
+    speed_count   INTEGER  NOT NULL DEFAULT 0,
+    trips_0_1     INTEGER  NOT NULL DEFAULT 0,
+    trips_1_3     INTEGER  NOT NULL DEFAULT 0,
+    trips_3_5     INTEGER  NOT NULL DEFAULT 0,
+    trips_5_10    INTEGER  NOT NULL DEFAULT 0,
+    trips_10_plus INTEGER  NOT NULL DEFAULT 0,
+
+    CONSTRAINT pk_trip_rollup
+        PRIMARY KEY (pickup_date, pickup_hour, PULocationID)
+);
 
-CREATE INDEX idx_rush_hour
-    ON trips (is_rush_hour);
+CREATE TABLE IF NOT EXISTS payment_rollup (
+    pickup_date   TEXT     NOT NULL,
+    pickup_hour   INTEGER  NOT NULL,
+    payment_type  INTEGER  NOT NULL,
+    trip_count    INTEGER  NOT NULL DEFAULT 0,
+    sum_tip       REAL     NOT NULL DEFAULT 0,
 
-CREATE INDEX idx_total_amount
+    CONSTRAINT pk_payment_rollup
+        PRIMARY KEY (pickup_date, pickup_hour, payment_type)
+);
+
+-- Every processed trips file loaded so far, keyed on a hash of its
+-- content so loading the same file twice is a no-op. min_pickup and
+-- max_pickup bound the whole hours holding its trips, less a few stray
+-- pickups at either end (see pickup_span); a new file whose trips mostly
+-- fall in that range is the same data again.
+
+CREATE TABLE IF NOT EXISTS ingested_files (
+    fingerprint   TEXT     NOT NULL,
+    source        TEXT     NOT NULL,
+    row_count     INTEGER  NOT NULL,
+    first_trip_id INTEGER,
+    last_trip_id  INTEGER,
+    min_pickup    TEXT,
+    max_pickup    TEXT,
+    loaded_at     TEXT     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT pk_ingested_files PRIMARY KEY (fingerprint)
+);
+
+-- Small key/value store; data_version changes on every load so the
+-- API knows when its cached results are stale
+
+CREATE TABLE IF NOT EXISTS db_meta (
+    key   TEXT  NOT NULL,
+    value TEXT  NOT NULL,
+
+    CONSTRAINT pk_db_meta PRIMARY KEY (key)
+);
+"""
+
+SCHEMA = DROP_TABLES + TABLES
+
+# Secondary indexes on trips. Kept apart from SCHEMA so the bulk loader
+# can build them once after the data is in instead of on every insert.
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_pickup_datetime
+    ON trips (pickup_datetime);
+
+CREATE INDEX IF NOT EXISTS idx_total_amount
     ON trips (total_amount);
+
+-- /api/trips pages in (sort column, trip_id) order. trip_id is the rowid,
+-- which every index already ends with, so an index per sort column (and
+-- per borough + sort column for the borough filter) makes each page a
+-- range scan.
+
+CREATE INDEX IF NOT EXISTS idx_trip_distance
+    ON trips (trip_distance);
+
+CREATE INDEX IF NOT EXISTS idx_duration
+    ON trips (duration_minutes);
+
+CREATE INDEX IF NOT EXISTS idx_speed
+    ON trips (speed_mph);
+
+CREATE INDEX IF NOT EXISTS idx_borough_pickup_datetime
+    ON trips (pickup_borough_id, pickup_datetime);
+
+CREATE INDEX IF NOT EXISTS idx_borough_total_amount
+    ON trips (pickup_borough_id, total_amount);
+
+CREATE INDEX IF NOT EXISTS idx_borough_trip_distance
+    ON trips (pickup_borough_id, trip_distance);
+
+CREATE INDEX IF NOT EXISTS idx_borough_duration
+    ON trips (pickup_borough_id, duration_minutes);
+
+CREATE INDEX IF NOT EXISTS idx_borough_speed
+    ON trips (pickup_borough_id, speed_mph);
 """
 
-def init_database():
+# Indexes older databases were built with that no API query uses (see
+# index_advisor.py). idx_rush_hour and idx_pickup_hour were worse than
+# useless: the planner picked them and then sorted or fetched every row.
+
+OBSOLETE_INDEXES = [
+    'idx_pickup_zone',
+    'idx_dropoff_zone',
+    'idx_pickup_hour',
+    'idx_rush_hour',
+]
+
+# Settings for the bulk loader: the database is being rebuilt from
+# scratch, so durability is traded for speed until the load finishes
+
+BULK_PAGE_SIZE = 16384
+BULK_PRAGMAS = [
+    "PRAGMA journal_mode=OFF",
+    "PRAGMA synchronous=OFF",
+    "PRAGMA cache_size=-1048576",  # 1 GB
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA locking_mode=EXCLUSIVE",
+]
+
+# Columns stored in trips, and the columns read from a processed file to
+# fill them: the payment label only goes into payment_types, and
+# pickup_borough_id is looked up from the pickup zone
+
+TRIP_COLUMNS = [
+    'pickup_datetime', 'dropoff_datetime', 'passenger_count', 'trip_distance',
+    'PULocationID', 'DOLocationID', 'payment_type', 'fare_amount', 'tip_amount',
+    'total_amount', 'duration_minutes', 'speed_mph', 'revenue_per_mile',
+    'is_rush_hour', 'pickup_hour', 'pickup_day_num', 'pickup_borough_id'
+]
+
+SOURCE_COLUMNS = TRIP_COLUMNS[:-1] + ['payment_label']
+
+def _text(value):
+    return value if value != '' else None
+
+def _int(value):
+    return int(float(value)) if value != '' else None
+
+def _real(value):
+    return float(value) if value != '' else None
+
+_day_seconds = {}
+
+def _epoch(value):
+    # 'YYYY-MM-DD HH:MM:SS' -> seconds since 1970-01-01. Only a few hundred
+    # distinct days per file, so the date part is converted once per day.
+    if value == '':
+        return None
+    day = value[:10]
+    seconds = _day_seconds.get(day)
+    if seconds is None:
+        seconds = calendar.timegm(time.strptime(day, '%Y-%m-%d'))
+        _day_seconds[day] = seconds
+    return seconds + int(value[11:13]) * 3600 + int(value[14:16]) * 60 + int(value[17:19])
+
+# How to turn each CSV string back into the value stored in trips
+CSV_TYPES = [
+    _epoch, _epoch, _int, _real,
+    _int, _int, _int, _real, _real,
+    _real, _real, _real, _real,
+    _int, _int, _int, _text
+]
+
+INSERT_TRIP = f'''INSERT INTO trips
+    ({', '.join(TRIP_COLUMNS)})
+    VALUES ({', '.join('?' * len(TRIP_COLUMNS))})'''
+
+def init_database(bulk=False):
     print("Creating tables...")
     conn = sqlite3.connect(DB_PATH)
     conn.executescript(SCHEMA)
+    if bulk:
+        # page_size only changes on a rollback-journal database once it
+        # is vacuumed, which is cheap while the tables are still empty
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.execute(f"PRAGMA page_size={BULK_PAGE_SIZE}")
+        conn.execute("VACUUM")
+    else:
+        conn.executescript(INDEXES)
     conn.commit()
     conn.close()
     print("Tables created.")
 
+def create_indexes(conn):
+    print("Building indexes...")
+    conn.executescript(INDEXES)
+
+# Databases built before trips was normalized still carry the zone,
+# borough and payment names on every row and text timestamps. The table
+# is rebuilt into the current layout in one transaction; the old rows'
+# own borough and payment label fill the lookups, so nothing has to be
+# reloaded from the source files.
+
+NORMALIZE_TRIPS = f"""
+BEGIN;
+DROP TABLE IF EXISTS payment_rollup;
+DROP TABLE IF EXISTS trip_rollup;
+ALTER TABLE trips RENAME TO trips_old;
+{TABLES}
+INSERT OR IGNORE INTO boroughs (Borough)
+    SELECT Borough FROM (
+        SELECT Borough FROM zones
+        UNION SELECT pickup_borough FROM trips_old WHERE pickup_borough IS NOT NULL
+    ) ORDER BY Borough;
+INSERT OR IGNORE INTO payment_types (payment_type, label)
+    SELECT DISTINCT payment_type, payment_label FROM trips_old
+    WHERE payment_type IS NOT NULL AND payment_label IS NOT NULL;
+INSERT INTO trips (trip_id, {', '.join(TRIP_COLUMNS)})
+    SELECT
+        trip_id,
+        CAST(strftime('%s', pickup_datetime) AS INTEGER),
+        CAST(strftime('%s', dropoff_datetime) AS INTEGER),
+        {', '.join(TRIP_COLUMNS[2:-1])},
+        (SELECT borough_id FROM boroughs WHERE Borough = pickup_borough)
+    FROM trips_old
+    ORDER BY trip_id;
+DROP TABLE trips_old;
+COMMIT;
+"""
+
+def is_normalized(conn):
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(trips)')}
+    return 'pickup_zone' not in columns
+
+def migrate_schema(conn):
+    if is_normalized(conn):
+        return False
+    print("Normalizing trips (rewrites the whole table)...")
+    # The old indexes move with the renamed table and go when it is dropped
+    conn.commit()
+    try:
+        conn.executescript(NORMALIZE_TRIPS)
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    # The rollups were dropped with the old table, and zone_revenue is
+    # new to databases built before the summary tables
+    backfill_summaries(conn)
+    bump_data_version(conn)
+    conn.commit()
+    return True
+
+def zone_totals(conn, table='trips'):
+    # Trips and revenue per pickup zone, from trips or zone_revenue
+    if table == 'trips':
+        sql = 'SELECT PULocationID, COUNT(*), TOTAL(total_amount) FROM trips GROUP BY PULocationID'
+    else:
+        sql = 'SELECT PULocationID, trip_count, total_revenue FROM zone_revenue'
+    return {zone: (count, revenue) for zone, count, revenue in conn.execute(sql)}
+
+def zone_mismatches(expected, actual):
+    # Zones whose count differs, or whose revenue is off by a cent or more
+    return sorted(
+        zone for zone in expected.keys() | actual.keys()
+        if zone not in expected or zone not in actual
+        or expected[zone][0] != actual[zone][0]
+        or abs(expected[zone][1] - actual[zone][1]) >= 0.01
+    )
+
+def migrate():
+    # Bring an existing database in line with the current layout without
+    # reloading it: normalized trips, the indexes in INDEXES and fresh
+    # planner statistics
+    conn = sqlite3.connect(DB_PATH)
+    # What /api/top-zones ranks, read from trips before anything changes
+    expected = zone_totals(conn)
+    rebuilt = migrate_schema(conn)
+    # Also fills summaries left empty by an earlier migration
+    if backfill_summaries(conn):
+        bump_data_version(conn)
+        conn.commit()
+    mismatched = zone_mismatches(expected, zone_totals(conn, 'zone_revenue'))
+    if mismatched:
+        conn.close()
+        raise RuntimeError(f"zone_revenue disagrees with trips for {len(mismatched)} "
+                           f"zones (first: {mismatched[:5]})")
+    for name in OBSOLETE_INDEXES:
+        print(f"Dropping {name}...")
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    create_indexes(conn)
+    conn.execute("ANALYZE")
+    conn.commit()
+    if rebuilt:
+        print("Reclaiming space...")
+        conn.execute("VACUUM")
+    conn.close()
+    write_columns()
+    update_shards()
+    print("Database migrated.")
+
+def write_columns():
+    # Columnar copy of trips the API can scan instead of SQLite (see
+    # columnar.py). Rewritten whenever it no longer matches the database.
+    if columnar.np is None:
+        print("NumPy not installed, skipping the columnar snapshot.")
+        return
+    conn = sqlite3.connect(DB_PATH)
+    version = columnar.read_data_version(conn)
+    conn.close()
+    if version is not None and columnar.snapshot_version(DB_PATH) == version:
+        return
+    print("Writing columnar snapshot...")
+    start = time.perf_counter()
+    count = columnar.write_snapshot(DB_PATH)
+    print(f"{count:,} trips written to {columnar.snapshot_path(DB_PATH)} "
+          f"in {time.perf_counter() - start:.1f}s.")
+
+# Month shards (see shards.py): each is a small database of its own with
+# the lookups, that month's trips and their summary tables. Only the
+# pickup time index is built; the shards serve the aggregate endpoints,
+# /api/trips keeps paging the main database.
+
+SHARD_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_pickup_datetime
+    ON trips (pickup_datetime);
+"""
+
+def trip_months(conn, after_trip_id=0):
+    return [row[0] for row in conn.execute(
+        "SELECT DISTINCT strftime('%Y-%m', pickup_datetime, 'unixepoch') "
+        "FROM trips WHERE trip_id > ? ORDER BY 1", (after_trip_id,)
+    )]
+
+def write_shard(month, version):
+    path = shards.shard_path(DB_PATH, month)
+    tmp = path + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+    conn = sqlite3.connect(tmp)
+    for pragma in BULK_PRAGMAS:
+        conn.execute(pragma)
+    conn.executescript(TABLES)
+    conn.execute('ATTACH DATABASE ? AS source', (DB_PATH,))
+    for table in ('zones', 'boroughs', 'payment_types'):
+        conn.execute(f'INSERT INTO {table} SELECT * FROM source.{table}')
+    columns = ', '.join(['trip_id'] + TRIP_COLUMNS)
+    count = conn.execute(f'''
+        INSERT INTO trips ({columns})
+        SELECT {columns} FROM source.trips
+        WHERE pickup_datetime >= ? AND pickup_datetime < ?
+        ORDER BY trip_id
+    ''', shards.month_bounds(month)).rowcount
+    conn.commit()
+    conn.execute('DETACH DATABASE source')
+
+    update_summaries(conn)
+    conn.executescript(SHARD_INDEXES)
+    conn.execute(
+        "INSERT INTO db_meta (key, value) VALUES ('data_version', ?)", (version,)
+    )
+    conn.commit()
+    conn.close()
+    os.replace(tmp, path)
+    return count
+
+def write_shards(months=None):
+    # Rewrite the shards of the given months (every month when None) from
+    # the main database. Shards of months it no longer has are removed.
+    conn = sqlite3.connect(DB_PATH)
+    version = columnar.read_data_version(conn)
+    present = trip_months(conn)
+    conn.close()
+
+    os.makedirs(shards.shard_dir(DB_PATH), exist_ok=True)
+    manifest = shards.read_manifest(DB_PATH) or {'months': {}}
+    counts = {month: rows for month, rows in manifest['months'].items() if month in present}
+    for month in set(manifest['months']) - set(present):
+        if os.path.exists(shards.shard_path(DB_PATH, month)):
+            os.remove(shards.shard_path(DB_PATH, month))
+
+    print("Writing month shards...")
+    start = time.perf_counter()
+    for month in present if months is None else [m for m in present if m in months]:
+        counts[month] = write_shard(month, version)
+        print(f"  {month}: {counts[month]:,} trips")
+    # Written last: until then the API sees the shards as stale and
+    # answers from the main database
+    shards.write_manifest(DB_PATH, version, counts)
+    print(f"{len(counts)} month shards in {shards.shard_dir(DB_PATH)} "
+          f"up to date in {time.perf_counter() - start:.1f}s.")
+
+def update_shards(months=None):
+    # Loads only keep shards current once --shards has created them
+    if os.path.isdir(shards.shard_dir(DB_PATH)):
+        write_shards(months)
+
+FILL_BOROUGHS = '''INSERT OR IGNORE INTO boroughs (Borough)
+    SELECT DISTINCT Borough FROM zones ORDER BY Borough'''
+
+def bump_data_version(conn):
+    # Unique per load (not a counter) so a rebuilt database never
+    # reuses a version an old cache entry was stamped with
+    conn.execute(
+        "INSERT OR REPLACE INTO db_meta (key, value) VALUES ('data_version', ?)",
+        (str(time.time_ns()),)
+    )
+
 def load_zones():
     print("Loading zones...")
     conn = sqlite3.connect(DB_PATH)
@@ -101,59 +548,500 @@ def load_zones():
         for row in reader:
             conn.execute('INSERT OR IGNORE INTO zones VALUES (?,?,?,?)', 
                          (row['LocationID'], row['Borough'], row['Zone'], row.get('service_zone', '')))
+    conn.execute(FILL_BOROUGHS)
+    bump_data_version(conn)
     conn.commit()
     conn.close()
     print("Zones loaded.")
 
-def load_trips():
+def max_trip_id(conn):
+    return conn.execute('SELECT COALESCE(MAX(trip_id), 0) FROM trips').fetchone()[0]
+
+def update_zone_revenue(conn, after_trip_id=0):
+    """Fold trips with trip_id > after_trip_id into the zone_revenue summary"""
+    conn.execute('''
+        INSERT INTO zone_revenue (PULocationID, trip_count, total_revenue)
+        SELECT PULocationID, COUNT(*), SUM(total_amount)
+        FROM trips
+        WHERE trip_id > ?
+        GROUP BY PULocationID
+        ON CONFLICT (PULocationID) DO UPDATE SET
+            trip_count    = trip_count + excluded.trip_count,
+            total_revenue = total_revenue + excluded.total_revenue
+    ''', (after_trip_id,))
+
+def update_rollups(conn, after_trip_id=0, pickup_range=None):
+    """Fold trips with trip_id > after_trip_id into the hourly rollups
+    (only those picked up in pickup_range, [start, end) seconds, if given)"""
+    where, params = 'trip_id > ?', [after_trip_id]
+    if pickup_range is not None:
+        where += ' AND pickup_datetime >= ? AND pickup_datetime < ?'
+        params += list(pickup_range)
+    conn.execute(f'''
+        INSERT INTO trip_rollup
+        SELECT
+            date(pickup_datetime / 3600 * 3600, 'unixepoch'),
+            pickup_datetime / 3600 % 24,
+            PULocationID,
+            COUNT(*),
+            TOTAL(is_rush_hour),
+            TOTAL(total_amount),
+            TOTAL(tip_amount),
+            TOTAL(trip_distance),
+            TOTAL(speed_mph),
+            COUNT(speed_mph),
+            TOTAL(trip_distance < 1),
+            TOTAL(trip_distance >= 1 AND trip_distance < 3),
+            TOTAL(trip_distance >= 3 AND trip_distance < 5),
+            TOTAL(trip_distance >= 5 AND trip_distance < 10),
+            TOTAL(trip_distance >= 10)
+        FROM trips
+        WHERE {where}
+        GROUP BY pickup_datetime / 3600, PULocationID
+        ON CONFLICT (pickup_date, pickup_hour, PULocationID) DO UPDATE SET
+            trip_count    = trip_count + excluded.trip_count,
+            rush_trips    = rush_trips + excluded.rush_trips,
+            sum_fare      = sum_fare + excluded.sum_fare,
+            sum_tip       = sum_tip + excluded.sum_tip,
+            sum_distance  = sum_distance + excluded.sum_distance,
+            sum_speed     = sum_speed + excluded.sum_speed,
+            speed_count   = speed_count + excluded.speed_count,
+            trips_0_1     = trips_0_1 + excluded.trips_0_1,
+            trips_1_3     = trips_1_3 + excluded.trips_1_3,
+            trips_3_5     = trips_3_5 + excluded.trips_3_5,
+            trips_5_10    = trips_5_10 + excluded.trips_5_10,
+            trips_10_plus = trips_10_plus + excluded.trips_10_plus
+    ''', params)
+    conn.execute(f'''
+        INSERT INTO payment_rollup
+        SELECT
+            date(pickup_datetime / 3600 * 3600, 'unixepoch'),
+            pickup_datetime / 3600 % 24,
+            payment_type,
+            COUNT(*),
+            TOTAL(tip_amount)
+        FROM trips
+        WHERE {where} AND payment_type IS NOT NULL
+        GROUP BY pickup_datetime / 3600, payment_type
+        ON CONFLICT (pickup_date, pickup_hour, payment_type) DO UPDATE SET
+            trip_count = trip_count + excluded.trip_count,
+            sum_tip    = sum_tip + excluded.sum_tip
+    ''', params)
+
+# Summary tables kept in step with trips, and how to bring each up to date
+SUMMARIES = [
+    ('zone_revenue', update_zone_revenue),
+    ('trip_rollup', update_rollups),
+]
+
+def update_summaries(conn, after_trip_id=0):
+    for _, update in SUMMARIES:
+        update(conn, after_trip_id)
+
+def backfill_summaries(conn):
+    # A database loaded before a summary table existed has that table
+    # empty; build it from every trip before anything is appended
+    if not conn.execute('SELECT EXISTS (SELECT 1 FROM trips)').fetchone()[0]:
+        return False
+    built = False
+    for table, update in SUMMARIES:
+        if not conn.execute(f'SELECT EXISTS (SELECT 1 FROM {table})').fetchone()[0]:
+            print(f"Building {table} from existing trips...")
+            update(conn)
+            built = True
+    return built
+
+def insert_batch(conn, batch):
+    # Insert and summarize in the same transaction so the summary
+    # tables never disagree with trips
+
+    last_id = max_trip_id(conn)
+    conn.executemany(INSERT_TRIP, batch)
+    update_summaries(conn, last_id)
+    conn.commit()
+
+def iter_csv_batches(path, batch_size=10000):
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        positions = [header.index(column) for column in SOURCE_COLUMNS]
+        converters = list(zip(positions, CSV_TYPES))
+        batch = []
+        for row in reader:
+            batch.append(tuple(convert(row[i]) for i, convert in converters))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+def regroup_batches(record_batches, batch_size):
+    # The dataset yields at least one batch per file, and a date folder
+    # only holds a day of trips; gather them into batch_size-row batches
+    pending, rows = [], 0
+    for record_batch in record_batches:
+        pending.append(record_batch)
+        rows += record_batch.num_rows
+        if rows < batch_size:
+            continue
+        table = pa.Table.from_batches(pending).combine_chunks()
+        full = rows - rows % batch_size
+        for offset in range(0, full, batch_size):
+            yield from table.slice(offset, batch_size).to_batches()
+        pending = table.slice(full).to_batches()
+        rows -= full
+    if rows:
+        yield from pa.Table.from_batches(pending).combine_chunks().to_batches()
+
+def iter_parquet_batches(path, batch_size=10000):
+    # Values come out already typed; only the trip columns are read
+    dataset = ds.dataset(path, format='parquet', partitioning='hive')
+    record_batches = dataset.to_batches(columns=SOURCE_COLUMNS, batch_size=batch_size)
+    for record_batch in regroup_batches(record_batches, batch_size):
+        columns = []
+        for name in SOURCE_COLUMNS:
+            column = record_batch.column(name)
+            if pa.types.is_timestamp(column.type):
+                column = column.cast(pa.timestamp('s')).cast(pa.int64())
+            columns.append(column.to_pylist())
+        yield list(zip(*columns))
+
+def resolve_source(source=None):
+    # Prefer the Parquet dataset when data_processor.py produced one
+    if source is None:
+        source = TRIPS_PARQUET if os.path.isdir(TRIPS_PARQUET) else TRIPS_CSV
+    return source
+
+def normalize_batches(conn, batches):
+    # Source rows -> trips rows: new payment labels go into payment_types
+    # and the label is swapped for the pickup zone's borough_id
+    zone_boroughs = dict(conn.execute(
+        'SELECT LocationID, borough_id FROM zones JOIN boroughs USING (Borough)'
+    ))
+    labels = dict(conn.execute('SELECT payment_type, label FROM payment_types'))
+    for batch in batches:
+        rows = []
+        for *row, label in batch:
+            payment_type = row[6]
+            if label is not None and payment_type is not None and payment_type not in labels:
+                conn.execute('INSERT OR IGNORE INTO payment_types VALUES (?, ?)',
+                             (payment_type, label))
+                labels[payment_type] = label
+            row.append(zone_boroughs.get(row[4]))
+            rows.append(row)
+        yield rows
+
+def trip_batches(conn, source=None, batch_size=10000):
+    source = resolve_source(source)
+    if os.path.isdir(source) or source.endswith('.parquet'):
+        if pa is None:
+            raise ImportError("Loading Parquet trips needs pyarrow installed")
+        batches = iter_parquet_batches(source, batch_size)
+    else:
+        batches = iter_csv_batches(source, batch_size)
+    return normalize_batches(conn, batches)
+
+def load_trips(source=None, bulk=False):
     print("Loading trips (this will take a few minutes)...")
+    source = resolve_source(source)
+    conn = sqlite3.connect(DB_PATH)
+    start = time.perf_counter()
+
+    if bulk:
+        count = bulk_load_trips(conn, source)
+    else:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+
+        count = 0
+        for batch in trip_batches(conn, source):
+            insert_batch(conn, batch)
+            count += len(batch)
+            print(f"  {count:,} rows inserted...")
+
+    # A full load starts from an empty trips table
+    record_ingest(conn, source, fingerprint(source), 0)
+    bump_data_version(conn)
+    conn.commit()
+    conn.close()
+    elapsed = time.perf_counter() - start
+    print(f"Done! {count:,} trips loaded in {elapsed:.1f}s "
+          f"({count / elapsed if elapsed else 0:,.0f} rows/s).")
+    write_columns()
+    update_shards()
+
+# Bulk mode: one big transaction into an index-free table, then the
+# summary table and indexes are built once from the finished data.
+# Expects a database just created with init_database(bulk=True).
+
+def bulk_load_trips(conn, source=None, batch_size=100000):
+    for pragma in BULK_PRAGMAS:
+        conn.execute(pragma)
+
+    count = 0
+    conn.execute("BEGIN")
+    for batch in trip_batches(conn, source, batch_size):
+        conn.executemany(INSERT_TRIP, batch)
+        count += len(batch)
+        print(f"  {count:,} rows inserted...")
+
+    update_summaries(conn)
+    conn.commit()
+    create_indexes(conn)
+    conn.commit()
+
+    conn.execute("PRAGMA locking_mode=NORMAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    return count
+
+# Incremental ingestion
+
+def fingerprint(source):
+    # Hash of the file content (every file, for a Parquet folder)
+    digest = hashlib.sha256()
+    if os.path.isdir(source):
+        paths = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(source)
+            for name in names
+        )
+    else:
+        paths = [source]
+
+    for path in paths:
+        digest.update(os.path.relpath(path, source).encode())
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+def record_ingest(conn, source, file_hash, after_trip_id):
+    # Note which trip_ids and pickup span this source added
+    start, end = pickup_span(dict(conn.execute(
+        'SELECT pickup_datetime / 3600, COUNT(*) FROM trips WHERE trip_id > ? GROUP BY 1',
+        (after_trip_id,)
+    ))) or (None, None)
+    conn.execute('''
+        INSERT INTO ingested_files
+            (fingerprint, source, row_count, first_trip_id, last_trip_id,
+             min_pickup, max_pickup)
+        SELECT ?, ?, COUNT(*), MIN(trip_id), MAX(trip_id),
+               datetime(?, 'unixepoch'), datetime(?, 'unixepoch')
+        FROM trips
+        WHERE trip_id > ?
+    ''', (file_hash, os.path.abspath(source), start, end, after_trip_id))
+
+# Overlap checks. TLC months carry a few trips picked up outside the month
+# (a late-night spill into the next one, the odd year-2088 timestamp), so
+# a source's span leaves out the first and last SPAN_TRIM of its trips,
+# and a new source only counts as overlapping a loaded one when more than
+# OVERLAP_SHARE of its trips fall in that one's span.
+
+SPAN_TRIM = 0.001
+OVERLAP_SHARE = 0.01
+
+def source_hours(source):
+    """Trips per pickup hour (hours since 1970-01-01) in a processed file"""
+    hours = {}
+    if os.path.isdir(source) or source.endswith('.parquet'):
+        if pa is None:
+            raise ImportError("Loading Parquet trips needs pyarrow installed")
+        dataset = ds.dataset(source, format='parquet', partitioning='hive')
+        for batch in dataset.to_batches(columns=['pickup_datetime']):
+            seconds = batch.column(0).cast(pa.timestamp('s')).cast(pa.int64())
+            for item in pc.value_counts(pc.divide(seconds, 3600)).to_pylist():
+                if item['values'] is not None:
+                    hours[item['values']] = hours.get(item['values'], 0) + item['counts']
+    else:
+        with open(source, newline='') as f:
+            reader = csv.reader(f)
+            position = next(reader).index('pickup_datetime')
+            for row in reader:
+                seconds = _epoch(row[position])
+                if seconds is not None:
+                    hours[seconds // 3600] = hours.get(seconds // 3600, 0) + 1
+    return hours
+
+def pickup_span(hours):
+    # First and last second of the hours holding all but SPAN_TRIM of the
+    # trips at either end; None without trips
+    cutoff = sum(hours.values()) * SPAN_TRIM
+    ordered = sorted(hours.items())
+
+    def edge(items):
+        seen = 0
+        for hour, count in items:
+            seen += count
+            if seen > cutoff:
+                return hour
+
+    if not ordered:
+        return None
+    return edge(ordered) * 3600, edge(reversed(ordered)) * 3600 + 3599
+
+def overlapping_sources(conn, hours, file_hash):
+    # Loaded sources this one repeats: the same content, or enough of its
+    # trips inside their pickup span
+    total = sum(hours.values())
+    found = []
+    for row in conn.execute('''
+        SELECT fingerprint, source, loaded_at, first_trip_id, last_trip_id,
+               min_pickup, max_pickup
+        FROM ingested_files
+    '''):
+        if row[0] != file_hash:
+            if row[5] is None or not total:
+                continue
+            start, end = _epoch(row[5]), _epoch(row[6])
+            inside = sum(n for hour, n in hours.items() if start <= hour * 3600 <= end)
+            if inside / total <= OVERLAP_SHARE:
+                continue
+        found.append(row)
+    return found
+
+def remove_trips(conn, first_trip_id, last_trip_id):
+    """Delete trips first_trip_id..last_trip_id and take them out of the
+    summary tables; returns the pickup months they were in"""
+    span = (first_trip_id, last_trip_id)
+    months = [row[0] for row in conn.execute(
+        "SELECT DISTINCT strftime('%Y-%m', pickup_datetime, 'unixepoch') "
+        "FROM trips WHERE trip_id BETWEEN ? AND ?", span
+    )]
+    hours = [row[0] for row in conn.execute(
+        'SELECT DISTINCT pickup_datetime / 3600 FROM trips '
+        'WHERE trip_id BETWEEN ? AND ? ORDER BY 1', span
+    )]
+
+    conn.executemany(
+        'UPDATE zone_revenue SET trip_count = trip_count - ?, '
+        'total_revenue = total_revenue - ? WHERE PULocationID = ?',
+        conn.execute('''
+            SELECT COUNT(*), TOTAL(total_amount), PULocationID FROM trips
+            WHERE trip_id BETWEEN ? AND ? GROUP BY PULocationID
+        ''', span).fetchall()
+    )
+    conn.execute('DELETE FROM zone_revenue WHERE trip_count <= 0')
+
+    # Hourly rollups of the hours these trips were in are rebuilt from
+    # the trips that remain
+    keys = [(time.strftime('%Y-%m-%d', time.gmtime(hour * 3600)), hour % 24) for hour in hours]
+    for table in ('trip_rollup', 'payment_rollup'):
+        conn.executemany(
+            f'DELETE FROM {table} WHERE pickup_date = ? AND pickup_hour = ?', keys
+        )
+    conn.execute('DELETE FROM trips WHERE trip_id BETWEEN ? AND ?', span)
+    runs = []
+    for hour in hours:
+        if runs and runs[-1][1] == hour:
+            runs[-1][1] = hour + 1
+        else:
+            runs.append([hour, hour + 1])
+    for start, end in runs:
+        update_rollups(conn, pickup_range=(start * 3600, end * 3600))
+    return months
+
+def ingest(sources, replace=False):
+    # Append new processed files to the existing database. Each file is
+    # loaded, summarized and recorded in one transaction, so a crash
+    # halfway leaves no trace and the file can just be ingested again.
+    # A file repeating trips already loaded (same content, or mostly the
+    # same pickup range) is skipped, or with replace=True swapped in for
+    # the sources it repeats.
     conn = sqlite3.connect(DB_PATH)
     conn.execute("PRAGMA journal_mode=WAL")
     conn.execute("PRAGMA synchronous=NORMAL")
+    migrate_schema(conn)
+    conn.executescript(TABLES + INDEXES)
 
-    batch = []
-    count = 0
+    if conn.execute('SELECT COUNT(*) FROM zones').fetchone()[0] == 0:
+        conn.close()
+        load_zones()
+        conn = sqlite3.connect(DB_PATH)
 
-    with open('processed_trips.csv') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            batch.append((
-                row['pickup_datetime'], row['dropoff_datetime'], row['passenger_count'],
-                row['trip_distance'], row['PULocationID'], row['DOLocationID'],
-                row['payment_type'], row['payment_label'], row['fare_amount'],
-                row['tip_amount'], row['total_amount'], row['duration_minutes'],
-                row['speed_mph'], row['revenue_per_mile'], row['is_rush_hour'],
-                row['pickup_hour'], row['pickup_day_num'], row['pickup_borough'],
-                row['pickup_zone'], row['dropoff_borough'], row['dropoff_zone']
-            ))
-            if len(batch) == 10000:
-                conn.executemany('''INSERT INTO trips
-                    (pickup_datetime, dropoff_datetime, passenger_count, trip_distance,
-                     PULocationID, DOLocationID, payment_type, payment_label, fare_amount,
-                     tip_amount, total_amount, duration_minutes, speed_mph, revenue_per_mile,
-                     is_rush_hour, pickup_hour, pickup_day_num, pickup_borough, pickup_zone,
-                     dropoff_borough, dropoff_zone)
-                    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)''', batch)
-                conn.commit()
-                count += len(batch)
-                batch = []
-                print(f"  {count:,} rows inserted...")
-
-    if batch:
-        conn.executemany('''INSERT INTO trips
-            (pickup_datetime, dropoff_datetime, passenger_count, trip_distance,
-             PULocationID, DOLocationID, payment_type, payment_label, fare_amount,
-             tip_amount, total_amount, duration_minutes, speed_mph, revenue_per_mile,
-             is_rush_hour, pickup_hour, pickup_day_num, pickup_borough, pickup_zone,
-             dropoff_borough, dropoff_zone)
-            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)''', batch)
+    backfill_summaries(conn)
+    conn.commit()
+    months = set()
+
+    for source in sources:
+        file_hash = fingerprint(source)
+        loaded = conn.execute(
+            'SELECT source, loaded_at FROM ingested_files WHERE fingerprint = ?',
+            (file_hash,)
+        ).fetchone()
+        if loaded and not replace:
+            print(f"Skipping {source}: already loaded from {loaded[0]} at {loaded[1]}")
+            continue
+
+        repeats = overlapping_sources(conn, source_hours(source), file_hash)
+        if repeats and not replace:
+            for _, other, loaded_at, _, _, min_pickup, max_pickup in repeats:
+                print(f"Skipping {source}: its pickups ({min_pickup} to {max_pickup}) "
+                      f"were already loaded from {other} at {loaded_at}; "
+                      f"use --replace to reload them")
+            continue
+
+        print(f"Ingesting {source}...")
+        start = time.perf_counter()
+        for old_hash, other, _, first_old, last_old, min_pickup, max_pickup in repeats:
+            print(f"  replacing the trips loaded from {other} ({min_pickup} to {max_pickup})")
+            if first_old is not None:
+                months.update(remove_trips(conn, first_old, last_old))
+            conn.execute('DELETE FROM ingested_files WHERE fingerprint = ?', (old_hash,))
+        last_id = max_trip_id(conn)
+        count = 0
+        for batch in trip_batches(conn, source):
+            conn.executemany(INSERT_TRIP, batch)
+            count += len(batch)
+            print(f"  {count:,} rows inserted...")
+
+        # Summaries only take in the new trip_id range
+        update_summaries(conn, last_id)
+        record_ingest(conn, source, file_hash, last_id)
+        months.update(trip_months(conn, last_id))
+        bump_data_version(conn)
         conn.commit()
-        count += len(batch)
+
+        elapsed = time.perf_counter() - start
+        print(f"Done! {count:,} trips appended in {elapsed:.1f}s "
+              f"({count / elapsed if elapsed else 0:,.0f} rows/s).")
 
     conn.close()
-    print(f"Done! {count:,} trips loaded.")
+    write_columns()
+    if months:
+        update_shards(months)
 
 if __name__ == '__main__':
-    init_database()
-    load_zones()
-    load_trips()
+    parser = argparse.ArgumentParser(description='Build the NYC taxi SQLite database')
+    parser.add_argument('sources', nargs='*',
+                        help='processed trips (Parquet folder or CSV), '
+                             f'default {TRIPS_PARQUET} or {TRIPS_CSV}')
+    parser.add_argument('--bulk', action='store_true',
+                        help='fast load: no indexes until the end, tuned PRAGMAs')
+    parser.add_argument('--ingest', action='store_true',
+                        help='append new files to the existing database '
+                             'instead of rebuilding it')
+    parser.add_argument('--replace', action='store_true',
+                        help='with --ingest, reload files whose pickup range was '
+                             'already loaded, deleting the trips loaded before')
+    parser.add_argument('--migrate', action='store_true',
+                        help='bring the existing database up to the current '
+                             'layout: normalized trips, current indexes')
+    parser.add_argument('--columns', action='store_true',
+                        help='(re)write the columnar snapshot of trips the API scans')
+    parser.add_argument('--shards', action='store_true',
+                        help='(re)write the per-month shard databases; '
+                             'later loads keep them current')
+    args = parser.parse_args()
+
+    if args.migrate:
+        migrate()
+    elif args.columns:
+        write_columns()
+    elif args.shards:
+        write_shards()
+    elif args.ingest:
+        ingest(args.sources or [resolve_source()], args.replace)
+    else:
+        init_database(bulk=args.bulk)
+        load_zones()
+        load_trips(args.sources[0] if args.sources else None, bulk=args.bulk)
@@ -0,0 +1,148 @@
+import argparse
+import re
+import sys
+
+import app
+from database import DB_PATH, TRIP_COLUMNS
+
+# Requests that stand in for what the frontend and API clients send. The
+# advisor runs each one through the real Flask app, records every SQL
+# statement it executes and checks the plan SQLite picks for it.
+# full_scan marks endpoints that have to read every trip anyway.
+
+def api_requests():
+    requests = [
+        ('/api/dashboard', True),
+        ('/api/rankings?group=pickup,dropoff,od&metric=revenue,tip,trips,avg_fare,revenue_per_mile,speed', True),
+        ('/api/trips?seed=42&borough=Manhattan&limit=50', False),
+        ('/api/dashboard?start=2019-01-05&end=2019-01-12', False),
+        ('/api/dashboard?start=2019-01-05 08:30&end=2019-01-05 17:45', False),
+        ('/api/daily?group=weekday', False),
+        ('/api/daily?start=2019-01-05 08:30', False),
+    ]
+    filters = ['', '&borough=Queens', '&rush_hour=1', '&borough=Manhattan&rush_hour=0',
+               '&min_fare=20&max_fare=30']
+    for sort in app.TRIP_SORTS:
+        for order in ('DESC', 'ASC'):
+            for extra in filters:
+                requests.append((f'/api/trips?limit=50&sort_by={sort}&order={order}{extra}', False))
+    return requests
+
+
+def capture(client, conn, path):
+    # First and second page, so keyset queries are checked too
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        app.cache.clear()
+        response = client.get(path)
+        data = response.get_json()
+        if isinstance(data, dict) and data.get('next_cursor'):
+            app.cache.clear()
+            client.get(f"{path}&cursor={data['next_cursor']}")
+    finally:
+        conn.set_trace_callback(None)
+    return [sql for sql in statements if sql.lstrip().upper().startswith('SELECT')]
+
+
+def explain(conn, sql):
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+
+
+def problems(sql, plan, full_scan):
+    found = []
+    limited = re.search(r'\bLIMIT\b', sql, re.I) is not None
+    pk_lookup = any('INTEGER PRIMARY KEY' in step for step in plan)
+    for step in plan:
+        if step == 'SCAN trips' and not full_scan:
+            found.append('full table scan')
+        elif step.startswith('SCAN trips USING INDEX') and not limited:
+            # Walks a whole index and fetches every row from the table
+            found.append('non-covering index scan')
+        elif step.startswith('SCAN trips USING COVERING INDEX') and not (limited or full_scan):
+            found.append('full index scan')
+        elif step == 'USE TEMP B-TREE FOR ORDER BY' and not pk_lookup:
+            found.append('sorts every matching row')
+    return found
+
+
+def suggest(sql):
+    # Equality columns first, then the GROUP BY / ORDER BY columns. A query
+    # without a LIMIT reads every match, so also add whatever else it reads
+    # to make the index covering.
+    columns = [c for c in TRIP_COLUMNS if re.search(rf'\b{c}\b', sql)]
+    where = re.search(r'\bWHERE\b(.*?)(?:\bGROUP BY\b|\bORDER BY\b|\bLIMIT\b|$)', sql, re.S)
+    equal = [c for c in columns if where and re.search(rf'\b{c}\s*=', where.group(1))]
+    ordering = re.findall(r'\b(?:GROUP|ORDER) BY\b([^()]*?)(?:\bLIMIT\b|$)', sql, re.S)
+    ordered = [c for c in columns if any(re.search(rf'\b{c}\b', o) for o in ordering)]
+    key = list(dict.fromkeys(equal + ordered))
+    if not re.search(r'\bLIMIT\b', sql, re.I):
+        key += [c for c in columns if c not in key]
+    return f"CREATE INDEX idx_{'_'.join(key[:2])} ON trips ({', '.join(key)});"
+
+
+def trip_indexes(conn):
+    return [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master "
+        "WHERE type = 'index' AND tbl_name = 'trips' AND sql IS NOT NULL"
+    )]
+
+
+def index_used(step):
+    match = re.search(r'USING (?:COVERING )?INDEX (\w+)', step)
+    return match.group(1) if match else None
+
+
+def advise(db_path=DB_PATH, verbose=False):
+    app.DATABASE = db_path
+    # Plans are what is being checked, so keep the columnar engine out
+    app.app.config['QUERY_ENGINE'] = 'sqlite'
+    client = app.app.test_client()
+    with app.app.app_context():
+        conn = app.pooled_connection()
+
+    used = set()
+    failures = 0
+    seen = set()
+    for path, full_scan in api_requests():
+        for sql in capture(client, conn, path):
+            shape = re.sub(r"\b\d+(\.\d+)?\b|'[^']*'", '?', ' '.join(sql.split()))
+            plan = explain(conn, sql)
+            used.update(filter(None, map(index_used, plan)))
+            if shape in seen:
+                continue
+            seen.add(shape)
+            issues = problems(sql, plan, full_scan)
+
+            if issues:
+                failures += 1
+                print(f"\nFAIL {path}")
+                print(f"  {shape[:200]}")
+                for step in plan:
+                    print(f"    {step}")
+                print(f"  problems: {', '.join(issues)}")
+                print(f"  try:      {suggest(sql)}")
+            elif verbose:
+                print(f"\nok   {path}")
+                for step in plan:
+                    print(f"    {step}")
+
+    unused = [name for name in trip_indexes(conn) if name not in used]
+    print(f"\n{len(seen)} query shapes checked, {failures} with problems")
+    if unused:
+        print("Indexes no API query uses (they only slow down loading):")
+        for name in unused:
+            print(f"  {name}")
+    return failures, unused
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Check the query plans of the API against the database indexes')
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='print the plan of every query, not only the bad ones')
+    args = parser.parse_args()
+
+    failures, unused = advise(args.db, args.verbose)
+    sys.exit(1 if failures or unused else 0)
@@ -0,0 +1,160 @@
+import calendar
+import json
+import multiprocessing
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from custom_algorithm import TaxiZoneRanker, ranking_columns
+
+# Trips split into one database per pickup month, written by
+# database.py --shards next to the main database:
+#
+#   nyc_taxi_shards/trips_2019_01.db, trips_2019_02.db, ..., shards.json
+#
+# Each shard is laid out like the main database (lookups, trips, summary
+# tables) and holds only that month's trips. shards.json records the
+# main database's data version the shards were written from and the
+# months there are, so the API can tell when they are out of date.
+
+MANIFEST = 'shards.json'
+
+
+def shard_dir(db_path):
+    # nyc_taxi.db -> nyc_taxi_shards/
+    return os.path.splitext(db_path)[0] + '_shards'
+
+
+def shard_path(db_path, month):
+    # '2019-01' -> nyc_taxi_shards/trips_2019_01.db
+    return os.path.join(shard_dir(db_path), f"trips_{month.replace('-', '_')}.db")
+
+
+def month_bounds(month):
+    """'YYYY-MM' -> [start, end) of that month in epoch seconds"""
+    year, number = map(int, month.split('-'))
+    start = calendar.timegm((year, number, 1, 0, 0, 0))
+    year, number = (year + 1, 1) if number == 12 else (year, number + 1)
+    return start, calendar.timegm((year, number, 1, 0, 0, 0))
+
+
+def read_manifest(db_path):
+    try:
+        with open(os.path.join(shard_dir(db_path), MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(db_path, version, months):
+    path = os.path.join(shard_dir(db_path), MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'version': version, 'months': months}, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+# Worker side. Each process keeps one read-only connection per shard,
+# reopened when the shard has been rewritten since.
+
+_connections = {}
+
+
+def _connect(path, version):
+    cached = _connections.get(path)
+    if cached is None or cached[0] != version:
+        if cached is not None:
+            cached[1].close()
+        conn = sqlite3.connect(Path(path).resolve().as_uri() + '?mode=ro', uri=True)
+        conn.execute('PRAGMA query_only=ON')
+        cached = _connections[path] = (version, conn)
+    return cached[1]
+
+
+def _run(path, version, func, args):
+    return func(_connect(path, version), *args)
+
+
+def fetch(conn, sql, params):
+    # Plain tuples plus the column names: sqlite3.Row doesn't pickle
+    cursor = conn.execute(sql, params)
+    return [column[0] for column in cursor.description], cursor.fetchall()
+
+
+def accumulate_rankings(conn, groups, metrics):
+    columns = ranking_columns(groups, metrics)
+    cursor = conn.execute(f'SELECT {", ".join(columns)} FROM trips')
+    return TaxiZoneRanker().accumulate_many(cursor, groups, metrics, columns=columns)
+
+
+_pool = None
+
+
+def pool(workers):
+    # One pool per process (gunicorn workers each get their own). spawn
+    # rather than fork: the server process is threaded.
+    global _pool
+    key = (os.getpid(), workers)
+    if _pool is None or _pool[0] != key:
+        if _pool is not None and _pool[0][0] == key[0]:
+            _pool[1].shutdown()
+        executor = ProcessPoolExecutor(max_workers=workers,
+                                       mp_context=multiprocessing.get_context('spawn'))
+        _pool = (key, executor)
+    return _pool[1]
+
+
+class Row(tuple):
+    """A fetched row that, like sqlite3.Row, can also be read by column name"""
+
+    def __new__(cls, values, positions):
+        row = super().__new__(cls, values)
+        row.positions = positions
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self.positions[key]
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return list(self.positions)
+
+
+class Rows(list):
+    def fetchall(self):
+        return list(self)
+
+
+class ShardSet:
+    """The shards a query over [start, end) (epoch seconds) has to read
+
+    execute() stands in for a connection's: it runs the statement on every
+    shard at once and returns all their rows together. That is only right
+    for queries whose rows the caller adds up again (per-group sums and
+    counts); anything else has to be merged explicitly.
+    """
+
+    def __init__(self, db_path, manifest, start=None, end=None, workers=1):
+        self.version = manifest['version']
+        self.workers = workers
+        self.paths = []
+        for month in sorted(manifest['months']):
+            month_start, month_end = month_bounds(month)
+            # Months entirely outside the range are never opened
+            if (start is None or month_end > start) and (end is None or month_start < end):
+                self.paths.append(shard_path(db_path, month))
+
+    def map(self, func, *args):
+        """func(connection, *args) on every shard, results in month order"""
+        tasks = [(path, self.version, func, args) for path in self.paths]
+        if self.workers <= 1 or len(tasks) <= 1:
+            return [_run(*task) for task in tasks]
+        return list(pool(self.workers).map(_run, *zip(*tasks)))
+
+    def execute(self, sql, params=()):
+        rows = Rows()
+        for names, values in self.map(fetch, sql, list(params)):
+            positions = {name: i for i, name in enumerate(names)}
+            rows.extend(Row(row, positions) for row in values)
+        return rows
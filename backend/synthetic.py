@@ -0,0 +1,215 @@
+import argparse
+import calendar
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_processor import DATETIME_FORMAT, ZONE_FILE
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # Optional, writes the CSV about 8x faster
+    pa = None
+
+# Synthetic yellow cab trips with the columns of the TLC yellow_tripdata
+# CSVs. The same seed, month and row count always give the same file.
+# Rows are made CHUNK_ROWS at a time, each chunk from its own seeded
+# generator, so memory stays flat up to tens of millions of rows.
+#
+# The shapes roughly follow the 2019 files: most pickups in Manhattan and
+# at the airports, a quiet early morning and an evening peak, lognormal
+# distances, metered fares with the usual surcharges, card tips around
+# 20% and no tips on cash. About 1.5% of rows are the kind of junk the
+# cleaning rules exist for.
+
+CHUNK_ROWS = 1_000_000
+
+COLUMNS = [
+    'VendorID', 'tpep_pickup_datetime', 'tpep_dropoff_datetime', 'passenger_count',
+    'trip_distance', 'RatecodeID', 'store_and_fwd_flag', 'PULocationID', 'DOLocationID',
+    'payment_type', 'fare_amount', 'extra', 'mta_tax', 'tip_amount', 'tolls_amount',
+    'improvement_surcharge', 'total_amount', 'congestion_surcharge'
+]
+
+# Share of pickups (and dropoffs) per borough, spread over its zones
+BOROUGH_SHARE = {
+    'Manhattan': 0.88, 'Queens': 0.07, 'Brooklyn': 0.035, 'Bronx': 0.004,
+    'Staten Island': 0.0005, 'EWR': 0.0005, 'Unknown': 0.01,
+}
+AIRPORTS = {132: 0.02, 138: 0.015}  # JFK, LaGuardia on top of Queens' share
+JFK = 132
+
+# Share of pickups per hour of the day (percent)
+HOUR_SHARE = [2.9, 2.1, 1.5, 1.1, 0.9, 1.0, 2.2, 3.9, 4.6, 4.6, 4.4, 4.6,
+              4.9, 5.0, 5.3, 5.3, 4.9, 5.7, 6.5, 6.3, 5.6, 5.3, 5.0, 4.1]
+# Typical speed (mph) per hour of the day
+HOUR_SPEED = [17, 18, 19, 20, 21, 19, 15, 12, 10, 10, 10, 10,
+              10, 10, 10, 10, 10, 10, 10, 11, 13, 14, 15, 16]
+
+PASSENGERS = ([1, 2, 3, 4, 5, 6, 0], [0.70, 0.15, 0.04, 0.02, 0.045, 0.03, 0.015])
+PAYMENTS = ([1, 2, 3, 4], [0.72, 0.272, 0.006, 0.002])
+RATECODES = ([1, 2, 3, 4, 5], [0.972, 0.02, 0.002, 0.001, 0.005])
+
+# Kinds of dirty rows, as a share of all rows
+DIRTY = {
+    'zero_distance': 0.007,
+    'refund': 0.002,          # negative amounts
+    'long_trip': 0.0002,      # over 100 miles
+    'backwards': 0.001,       # dropoff before pickup
+    'overnight': 0.0005,      # over 3 hours
+    'duplicate': 0.0005,      # exact copy of the row before
+}
+
+
+def zone_weights(zones, rng):
+    # Every zone gets a lognormal share of its borough's share
+    weights = np.zeros(len(zones))
+    for borough, share in BOROUGH_SHARE.items():
+        in_borough = (zones['Borough'] == borough).to_numpy()
+        if in_borough.any():
+            raw = rng.lognormal(0, 1, in_borough.sum())
+            weights[in_borough] = share * raw / raw.sum()
+    for location_id, share in AIRPORTS.items():
+        weights[(zones['LocationID'] == location_id).to_numpy()] += share
+    return zones['LocationID'].to_numpy(), weights / weights.sum()
+
+
+def month_start(month):
+    year, number = map(int, month.split('-'))
+    return calendar.timegm((year, number, 1, 0, 0, 0)), calendar.monthrange(year, number)[1]
+
+
+def generate_chunk(rows, month, seed, index, zones):
+    """One chunk of synthetic trips as a DataFrame in the TLC layout"""
+    # Zone popularity comes from the seed alone, so it is the same in
+    # every chunk; everything else from (seed, chunk index)
+    zone_ids, weights = zone_weights(zones, np.random.default_rng(seed))
+    manhattan = set(zones.loc[zones['Borough'] == 'Manhattan', 'LocationID'])
+    rng = np.random.default_rng([seed, index])
+
+    start, days = month_start(month)
+    hour_share = np.array(HOUR_SHARE) / sum(HOUR_SHARE)
+    hour = rng.choice(24, rows, p=hour_share)
+    pickup = (start + rng.integers(0, days, rows) * 86400 + hour * 3600
+              + rng.integers(0, 3600, rows))
+
+    pu = rng.choice(zone_ids, rows, p=weights)
+    do = rng.choice(zone_ids, rows, p=weights)
+    payment = rng.choice(PAYMENTS[0], rows, p=PAYMENTS[1])
+    ratecode = rng.choice(RATECODES[0], rows, p=RATECODES[1])
+
+    distance = np.round(np.clip(rng.lognormal(0.55, 0.8, rows), 0.1, 60), 2)
+    airport = (pu == JFK) | (do == JFK)
+    distance = np.where(airport, np.round(rng.normal(17, 2.5, rows).clip(8), 2), distance)
+    speed = np.array(HOUR_SPEED)[hour] * rng.lognormal(0, 0.25, rows)
+    seconds = np.maximum(60, distance / speed * 3600 + rng.integers(0, 120, rows)).astype(np.int64)
+
+    # 2019 meter: $2.50 flag drop, $2.50 a mile and $0.50 a minute
+    # stopped, in 50 cent steps; flat $52 to or from JFK
+    minutes = seconds / 60
+    fare = np.round((2.5 + 2.5 * distance + 0.1 * minutes) * 2) / 2
+    fare = np.where(ratecode == 2, 52.0, fare)
+    weekday = ((pickup // 86400) + 3) % 7 < 5  # 1970-01-01 was a Thursday
+    extra = np.where((hour >= 20) | (hour < 6), 0.5,
+                     np.where(weekday & (hour >= 16) & (hour < 20), 1.0, 0.0))
+    tolls = np.where(rng.random(rows) < 0.05, 5.76, 0.0)
+    tip_rate = np.where(rng.random(rows) < 0.15, 0, rng.normal(0.21, 0.05, rows).clip(0.05, 0.5))
+    tip = np.where(payment == 1, np.round(fare * tip_rate, 2), 0.0)
+    # The congestion surcharge started on 2019-02-01
+    charged = np.isin(pu, list(manhattan)) | np.isin(do, list(manhattan))
+    congestion = (np.where(charged, 2.5, 0.0) if start >= calendar.timegm((2019, 2, 1, 0, 0, 0))
+                  else np.full(rows, np.nan))
+
+    trips = pd.DataFrame({
+        'VendorID': rng.choice([1, 2], rows, p=[0.36, 0.64]),
+        'pickup': pickup,
+        'seconds': seconds,
+        'passenger_count': rng.choice(PASSENGERS[0], rows, p=PASSENGERS[1]),
+        'trip_distance': distance,
+        'RatecodeID': ratecode,
+        'store_and_fwd_flag': np.where(rng.random(rows) < 0.005, 'Y', 'N'),
+        'PULocationID': pu,
+        'DOLocationID': do,
+        'payment_type': payment,
+        'fare_amount': fare,
+        'extra': extra,
+        'mta_tax': 0.5,
+        'tip_amount': tip,
+        'tolls_amount': tolls,
+        'improvement_surcharge': 0.3,
+        'congestion_surcharge': congestion,
+    })
+
+    kind = rng.random(rows)
+    edges = np.cumsum(list(DIRTY.values()))
+    dirty = dict(zip(DIRTY, (
+        (kind >= low) & (kind < high) for low, high in zip(np.r_[0, edges[:-1]], edges)
+    )))
+    trips.loc[dirty['zero_distance'], 'trip_distance'] = 0.0
+    trips.loc[dirty['long_trip'], 'trip_distance'] = np.round(rng.uniform(100, 300, dirty['long_trip'].sum()), 2)
+    trips.loc[dirty['backwards'], 'seconds'] *= -1
+    trips.loc[dirty['overnight'], 'seconds'] += 4 * 3600
+    refund = dirty['refund']
+    trips.loc[refund, 'payment_type'] = rng.choice([3, 4], refund.sum())
+    for column in ['fare_amount', 'extra', 'mta_tax', 'tip_amount', 'improvement_surcharge']:
+        trips.loc[refund, column] = -trips.loc[refund, column]
+
+    trips['total_amount'] = np.round(trips[[
+        'fare_amount', 'extra', 'mta_tax', 'tip_amount', 'tolls_amount', 'improvement_surcharge'
+    ]].sum(axis=1) + trips['congestion_surcharge'].fillna(0), 2)
+
+    # A duplicate repeats the row before it
+    duplicate = np.flatnonzero(dirty['duplicate'][1:]) + 1
+    trips.iloc[duplicate] = trips.iloc[duplicate - 1].to_numpy()
+
+    trips['tpep_pickup_datetime'] = pd.to_datetime(trips['pickup'], unit='s')
+    trips['tpep_dropoff_datetime'] = pd.to_datetime(trips['pickup'] + trips['seconds'], unit='s')
+    return trips[COLUMNS]
+
+
+def write_chunk(chunk, path, first):
+    if pa is None:
+        chunk.to_csv(path, mode='w' if first else 'a', header=first,
+                     index=False, date_format=DATETIME_FORMAT)
+        return
+    # Arrow prints whole floats without the '.0' pandas adds; the values
+    # read back the same either way
+    table = pa.Table.from_pandas(chunk.astype({
+        'tpep_pickup_datetime': 'datetime64[s]', 'tpep_dropoff_datetime': 'datetime64[s]'
+    }), preserve_index=False)
+    with open(path, 'wb' if first else 'ab') as f:
+        if first:
+            f.write((','.join(COLUMNS) + '\n').encode())
+        pa_csv.write_csv(table, f, pa_csv.WriteOptions(include_header=False, quoting_style='none'))
+
+
+def write_trips(path, rows, month='2019-01', seed=42, zone_file=ZONE_FILE):
+    zones = pd.read_csv(zone_file)
+    written = 0
+    for index, offset in enumerate(range(0, rows, CHUNK_ROWS)):
+        chunk = generate_chunk(min(CHUNK_ROWS, rows - offset), month, seed, index, zones)
+        write_chunk(chunk, path, index == 0)
+        written += len(chunk)
+        if rows > CHUNK_ROWS:
+            print(f"  {written:,} rows written...")
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic yellow cab trips')
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--month', default='2019-01', help='YYYY-MM the pickups fall in')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=None,
+                        help='CSV to write (default ../data/synthetic_tripdata_<month>.csv)')
+    args = parser.parse_args()
+
+    output = args.output or f'../data/synthetic_tripdata_{args.month}.csv'
+    start = time.perf_counter()
+    count = write_trips(output, args.rows, args.month, args.seed)
+    elapsed = time.perf_counter() - start
+    print(f"{count:,} trips written to {output} in {elapsed:.1f}s "
+          f"({os.path.getsize(output) / 1024 ** 2:,.0f} MB).")
@@ -1,11 +1,9 @@
 const API = 'http://localhost:5000/api'
 
+let nextCursor = null
+
 document.addEventListener('DOMContentLoaded', () => {
-    loadStats()
-    loadHourlyChart()
-    loadTopZones()
-    loadDistanceChart()
-    loadBoroughChart()
+    loadDashboard()
     loadTrips()
 
     document.getElementById('apply-filters')
@@ -13,13 +11,26 @@ document.addEventListener('DOMContentLoaded', () => {
 
     document.getElementById('reset-filters')
         .addEventListener('click', resetFilters)
+
+    document.getElementById('load-more')
+        .addEventListener('click', () => loadTrips(true))
 })
 
 
-async function loadStats() {
-    const data = await fetchData(`${API}/stats`)
+// One request (and one scan on the server) for every summary on the page
+
+async function loadDashboard() {
+    const data = await fetchData(`${API}/dashboard?limit=10`)
     if (!data) return
 
+    showStats(data.stats)
+    showHourlyChart(data.hourly)
+    showTopZones(data.top_zones)
+    showDistanceChart(data.distance)
+    showBoroughChart(data.boroughs)
+}
+
+function showStats(data) {
     document.getElementById('total-trips').textContent =
         data.total_trips.toLocaleString()
 
@@ -36,10 +47,7 @@ async function loadStats() {
         `${data.average_distance} mi`
 }
 
-async function loadHourlyChart() {
-    const data = await fetchData(`${API}/hourly`)
-    if (!data) return
-
+function showHourlyChart(data) {
     const ctx = document.getElementById('hourly-chart').getContext('2d')
 
     new Chart(ctx, {
@@ -64,10 +72,7 @@ async function loadHourlyChart() {
     })
 }
 
-async function loadTopZones() {
-    const data = await fetchData(`${API}/top-zones?limit=10`)
-    if (!data) return
-
+function showTopZones(data) {
     const ctx = document.getElementById('zones-chart').getContext('2d')
 
     new Chart(ctx, {
@@ -88,10 +93,7 @@ async function loadTopZones() {
     })
 }
 
-async function loadDistanceChart() {
-    const data = await fetchData(`${API}/distance-distribution`)
-    if (!data) return
-
+function showDistanceChart(data) {
     const ctx = document.getElementById('distance-chart').getContext('2d')
 
     new Chart(ctx, {
@@ -118,10 +120,7 @@ async function loadDistanceChart() {
     })
 }
 
-async function loadBoroughChart() {
-    const data = await fetchData(`${API}/boroughs`)
-    if (!data) return
-
+function showBoroughChart(data) {
     const ctx = document.getElementById('borough-chart').getContext('2d')
 
     new Chart(ctx, {
@@ -142,7 +141,9 @@ async function loadBoroughChart() {
     })
 }
 
-async function loadTrips() {
+// Passing append fetches the page after the rows already shown
+
+async function loadTrips(append = false) {
     const borough  = document.getElementById('borough-filter').value
     const minFare  = document.getElementById('min-fare').value
     const maxFare  = document.getElementById('max-fare').value
@@ -154,14 +155,19 @@ async function loadTrips() {
 
     if (borough)  url += `&borough=${borough}`
     if (rushHour !== '') url += `&rush_hour=${rushHour}`
+    if (append === true && nextCursor) url += `&cursor=${encodeURIComponent(nextCursor)}`
+
+    const data = await fetchData(url)
+    if (!data) return
 
-    const trips = await fetchData(url)
-    if (!trips) return
+    const trips = data.trips
+    nextCursor = data.next_cursor
+    document.getElementById('load-more').hidden = !nextCursor
 
     const tbody = document.getElementById('trips-body')
-    tbody.innerHTML = ''
+    if (append !== true) tbody.innerHTML = ''
 
-    if (trips.length === 0) {
+    if (trips.length === 0 && append !== true) {
         tbody.innerHTML = '<tr><td colspan="9">No trips match your filters</td></tr>'
         return
     }